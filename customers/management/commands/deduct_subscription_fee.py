@@ -1,26 +1,44 @@
 # -*- coding:utf-8 -*-
 from __future__ import unicode_literals
 
-from django.core.management.base import BaseCommand
+import re
+from optparse import make_option
 
-from customers.models import Customer, Transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from customers.models import BillingRun, billing_key
 
 class Command(BaseCommand):
-    help = 'Deducts the monthly subscription fee from every customer'
+    help = ('Deducts the monthly subscription fee and the SMS sent since '
+            'the last run from every active customer. Each month is only '
+            'billed once; running it again continues an unfinished run')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--period', dest='period', default=None,
+                    help='Month to bill as YYYY-MM, the current month if '
+                         'not given'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of customers billed per transaction'),
+        )
 
     def handle(self, *args, **options):
-        for customer in Customer.objects.filter(is_active=True):
-            customer.credit -= customer.subscription_price
-            customer.save()
-
-            transaction = Transaction(customer=customer, 
-                                      credit = - customer.subscription_price,
-                                      description = 'Månedligt abonnement',
-                                      is_confirmed=True)
-            transaction.save()
-            
-            if customer.credit < 0:
-                for admin in customer.employee_set.filter(is_admin=True):
-                    subject = 'Din ToolControl-konto er i minus'
-                    message = ('Hej %s\n\n Kontoen for %s på ToolControl er gået i minus (%s kr.). Systemet fungerer stadig, men vi beder dig om at bringe kontoen i plus inden for nærmeste fremtid.\n\n MVH\n ToolControl' % (admin.name, customer.name, customer.credit))
-                    admin.send_message(subject, message)
+        key = options['period'] or billing_key(timezone.now())
+        if not re.match(r'^\d{4}-\d{2}$', key):
+            raise CommandError('The period must be given as YYYY-MM')
+
+        run = BillingRun.objects.start(key)
+        if run.finished:
+            self.stdout.write('%s was billed at %s' % (key, run.finished))
+            return
+
+        def progress(billed):
+            self.stdout.write('Billed %s customers' % billed)
+
+        run.bill(options['batch_size'], progress)
+        run = BillingRun.objects.get(pk=run.pk)
+        self.stdout.write('Billed %s customers for %s: %.2f kr. in '
+                          'subscriptions and %s SMS for %.2f kr.' %
+                          (run.customer_count, key, run.subscription_total,
+                           run.sms_count, run.sms_total))
@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from customers.models import MetricBucket, add_to_counters, truncate_time
+
+class Command(BaseCommand):
+    help = ('Merges old hourly metrics into one bucket per day and deletes '
+            'metrics past the retention period')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--hourly-days', dest='hourly_days', type='int',
+                    default=35,
+                    help='Number of days to keep hourly buckets for'),
+        make_option('--days', dest='days', type='int', default=400,
+                    help='Number of days to keep any buckets for'),
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        downsample_before = truncate_time(
+            now - datetime.timedelta(days=options['hourly_days']), 'day')
+        delete_before = truncate_time(
+            now - datetime.timedelta(days=options['days']), 'day')
+
+        with transaction.commit_on_success():
+            deleted = MetricBucket.objects.filter(start__lt=delete_before)
+            deleted_count = deleted.count()
+            deleted.delete()
+
+            # Collect the hourly buckets of each metric and day
+            days = {}
+            buckets = MetricBucket.objects.filter(
+                start__lt=downsample_before).values_list('pk', 'name',
+                                                         'start', 'value')
+            for pk, name, start, value in buckets.iterator():
+                day = truncate_time(start, 'day')
+                if start != day:
+                    pks, total = days.get((name, day), ([], 0))
+                    days[(name, day)] = (pks + [pk], total + value)
+
+            for (name, day), (pks, total) in days.items():
+                MetricBucket.objects.filter(pk__in=pks).delete()
+                add_to_counters(MetricBucket.objects,
+                                {'name': name, 'start': day},
+                                {'value': total})
+
+        self.stdout.write('Deleted %s buckets and merged %s days of hourly '
+                          'buckets' % (deleted_count, len(days)))
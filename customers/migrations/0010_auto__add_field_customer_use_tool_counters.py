@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Customer.use_tool_counters'
+        db.add_column(u'customers_customer', 'use_tool_counters',
+                      self.gf('django.db.models.fields.BooleanField')(default=False),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'Customer.use_tool_counters'
+        db.delete_column(u'customers_customer', 'use_tool_counters')
+
+
+    models = {
+        u'customers.customer': {
+            'Meta': {'object_name': 'Customer'},
+            'address': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'credit': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'sms_price': ('django.db.models.fields.FloatField', [], {'default': '1.0'}),
+            'sms_sent': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'subscription_price': ('django.db.models.fields.FloatField', [], {'default': '100.0'}),
+            'town': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'use_tool_counters': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'zip_code': ('django.db.models.fields.IntegerField', [], {})
+        },
+        u'customers.faqcategory': {
+            'Meta': {'object_name': 'FAQCategory'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'customers.faqpost': {
+            'Meta': {'object_name': 'FAQPost'},
+            'answer': ('django.db.models.fields.TextField', [], {}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['customers.FAQCategory']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'question': ('django.db.models.fields.TextField', [], {})
+        },
+        u'customers.transaction': {
+            'Meta': {'object_name': 'Transaction'},
+            'credit': ('django.db.models.fields.FloatField', [], {}),
+            'customer': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['customers.Customer']"}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_confirmed': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['customers']
\ No newline at end of file
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'MetricBucket'
+        db.create_table(u'customers_metricbucket', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('start', self.gf('django.db.models.fields.DateTimeField')()),
+            ('value', self.gf('django.db.models.fields.IntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'customers', ['MetricBucket'])
+
+        # Adding unique constraint on 'MetricBucket', fields ['name', 'start']
+        db.create_unique(u'customers_metricbucket', ['name', 'start'])
+
+        # Adding index on 'MetricBucket', fields ['start', 'name']
+        db.create_index(u'customers_metricbucket', ['start', 'name'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'MetricBucket', fields ['start', 'name']
+        db.delete_index(u'customers_metricbucket', ['start', 'name'])
+
+        # Removing unique constraint on 'MetricBucket', fields ['name', 'start']
+        db.delete_unique(u'customers_metricbucket', ['name', 'start'])
+
+        # Deleting model 'MetricBucket'
+        db.delete_table(u'customers_metricbucket')
+
+
+    models = {
+        u'customers.customer': {
+            'Meta': {'object_name': 'Customer'},
+            'address': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'credit': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'sms_price': ('django.db.models.fields.FloatField', [], {'default': '1.0'}),
+            'sms_sent': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'subscription_price': ('django.db.models.fields.FloatField', [], {'default': '100.0'}),
+            'town': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'use_tool_counters': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'zip_code': ('django.db.models.fields.IntegerField', [], {})
+        },
+        u'customers.faqcategory': {
+            'Meta': {'object_name': 'FAQCategory'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'customers.faqpost': {
+            'Meta': {'object_name': 'FAQPost'},
+            'answer': ('django.db.models.fields.TextField', [], {}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['customers.FAQCategory']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'question': ('django.db.models.fields.TextField', [], {})
+        },
+        u'customers.metricbucket': {
+            'Meta': {'unique_together': "(('name', 'start'),)", 'object_name': 'MetricBucket', 'index_together': "[['start', 'name']]"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'start': ('django.db.models.fields.DateTimeField', [], {}),
+            'value': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'customers.transaction': {
+            'Meta': {'object_name': 'Transaction'},
+            'credit': ('django.db.models.fields.FloatField', [], {}),
+            'customer': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['customers.Customer']"}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_confirmed': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['customers']
\ No newline at end of file
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'BillingRun'
+        db.create_table(u'customers_billingrun', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('key', self.gf('django.db.models.fields.CharField')(unique=True, max_length=20)),
+            ('started', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('finished', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('last_customer', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('customer_count', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('subscription_total', self.gf('django.db.models.fields.FloatField')(default=0.0)),
+            ('sms_count', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('sms_total', self.gf('django.db.models.fields.FloatField')(default=0.0)),
+        ))
+        db.send_create_signal(u'customers', ['BillingRun'])
+
+        # Adding field 'Transaction.billing_run'
+        db.add_column(u'customers_transaction', 'billing_run',
+                      self.gf('django.db.models.fields.related.ForeignKey')(to=orm['customers.BillingRun'], null=True, blank=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'Transaction.billing_run'
+        db.delete_column(u'customers_transaction', 'billing_run_id')
+
+        # Deleting model 'BillingRun'
+        db.delete_table(u'customers_billingrun')
+
+
+    models = {
+        u'customers.billingrun': {
+            'Meta': {'object_name': 'BillingRun'},
+            'customer_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '20'}),
+            'last_customer': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'sms_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'sms_total': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'subscription_total': ('django.db.models.fields.FloatField', [], {'default': '0.0'})
+        },
+        u'customers.customer': {
+            'Meta': {'object_name': 'Customer'},
+            'address': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'credit': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'sms_price': ('django.db.models.fields.FloatField', [], {'default': '1.0'}),
+            'sms_sent': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'subscription_price': ('django.db.models.fields.FloatField', [], {'default': '100.0'}),
+            'town': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'use_tool_counters': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'zip_code': ('django.db.models.fields.IntegerField', [], {})
+        },
+        u'customers.faqcategory': {
+            'Meta': {'object_name': 'FAQCategory'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'customers.faqpost': {
+            'Meta': {'object_name': 'FAQPost'},
+            'answer': ('django.db.models.fields.TextField', [], {}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['customers.FAQCategory']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'question': ('django.db.models.fields.TextField', [], {})
+        },
+        u'customers.metricbucket': {
+            'Meta': {'unique_together': "(('name', 'start'),)", 'object_name': 'MetricBucket', 'index_together': "[['start', 'name']]"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'start': ('django.db.models.fields.DateTimeField', [], {}),
+            'value': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'customers.transaction': {
+            'Meta': {'object_name': 'Transaction'},
+            'billing_run': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['customers.BillingRun']", 'null': 'True', 'blank': 'True'}),
+            'credit': ('django.db.models.fields.FloatField', [], {}),
+            'customer': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['customers.Customer']"}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_confirmed': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['customers']
\ No newline at end of file
@@ -1,10 +1,39 @@
 # -*- coding:utf-8 -*-
 import datetime, logging
+from collections import defaultdict
 
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
 from paypal.standard.ipn.signals import payment_was_successful
 
+def add_to_counters(manager, lookup, counts):
+    """
+    Adds the counts to the counter fields of the row matching lookup in one
+    UPDATE, creating the row if it doesn't exist yet
+
+    """
+    counts = dict((field, count) for field, count in counts.items() if count)
+    if not counts:
+        return
+
+    updates = dict((field, F(field) + count)
+                   for field, count in counts.items())
+    if manager.filter(**lookup).update(**updates):
+        return
+
+    # Someone else may create the row between the UPDATE and the INSERT
+    sid = transaction.savepoint()
+    try:
+        values = dict(lookup)
+        values.update(counts)
+        manager.create(**values)
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        manager.filter(**lookup).update(**updates)
+
 class Customer(models.Model):
     # Info
     name = models.CharField('Navn', max_length=200)
@@ -21,25 +50,36 @@ class Customer(models.Model):
     subscription_price = models.FloatField('Abonnementspris', default=100.0)
     sms_price = models.FloatField('SMS-pris', default=1.0)
 
+    # Read the model and category totals from persisted counters instead of
+    # grouping the tools. Meant for customers with very large catalogs
+    use_tool_counters = models.BooleanField('Brug optalte værktøjstal',
+                                            default=False)
+
     def get_absolute_url(self):
         return reverse('customer_detail', args=[self.pk])
 
     def __unicode__(self):
         return self.name
 
+    def activity(self):
+        """
+        Logins, events and tickets within the last 30 days. Lists of
+        customers set _activity for all of them in one query
+
+        """
+        if not hasattr(self, '_activity'):
+            from tools.models import CustomerDailyActivity
+            self._activity = CustomerDailyActivity.objects.totals([self])[self.pk]
+        return self._activity
+
     def events(self):
-        from tools.models import Event
-        return Event.objects.filter(tool__model__category__customer=self, 
-                                    start_date__gte=datetime.datetime.now()-datetime.timedelta(days=30)).count()
+        return self.activity()['events']
 
     def logins(self):
-        from tools.models import Login
-        return Login.objects.filter(employee__customer=self,
-                                    timestamp__gte=datetime.datetime.now()-datetime.timedelta(days=30)).count()
+        return self.activity()['logins']
 
     def tickets(self):
-        from tools.models import Ticket
-        return Ticket.objects.filter(reported_by=self).count()
+        return self.activity()['tickets']
 
     def transactions(self):
         return Transaction.objects.filter(customer=self).order_by('-timestamp')
@@ -51,9 +91,165 @@ class Transaction(models.Model):
     is_confirmed = models.BooleanField('Bekræftet', default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # Set on the fees and SMS charges written by a billing run
+    billing_run = models.ForeignKey('BillingRun', null=True, blank=True,
+                                    editable=False)
+
     def credit_with_fee(self):
         return round((self.credit + 2.6) / 0.966, 2)
 
+NEGATIVE_CREDIT_SUBJECT = u'Din ToolControl-konto er i minus'
+NEGATIVE_CREDIT_MESSAGE = (u'Hej %s\n\n Kontoen for %s på ToolControl er gået i minus (%s kr.). Systemet fungerer stadig, men vi beder dig om at bringe kontoen i plus inden for nærmeste fremtid.\n\n MVH\n ToolControl')
+
+def billing_key(when):
+    """
+    Returns the key of the billing run for the month containing when
+
+    """
+    if timezone.is_aware(when):
+        when = timezone.localtime(when)
+    return when.strftime('%Y-%m')
+
+class BillingRunManager(models.Manager):
+    def start(self, key):
+        """
+        Returns the billing run with the given key, creating it the first
+        time. A run of a key that has finished bills nobody again
+
+        """
+        run, created = self.get_or_create(key=key)
+        return run
+
+class BillingRun(models.Model):
+    """
+    The monthly billing of the subscription fees and SMS usage of the
+    active customers. Customers are billed in order of primary key,
+    batch_size per transaction, and last_customer is moved forward in the
+    same transaction, so a run that stops halfway continues where it
+    stopped and no customer is billed twice for the same key
+
+    """
+    key = models.CharField(max_length=20, unique=True)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    last_customer = models.IntegerField(default=0)
+    customer_count = models.IntegerField(default=0)
+    subscription_total = models.FloatField(default=0.0)
+    sms_count = models.IntegerField(default=0)
+    sms_total = models.FloatField(default=0.0)
+
+    objects = BillingRunManager()
+
+    def __unicode__(self):
+        return self.key
+
+    def bill(self, batch_size=500, progress=None):
+        """
+        Bills the active customers not billed by this run yet. Returns the
+        number of customers billed by this call
+
+        """
+        if self.finished:
+            return 0
+
+        billed = 0
+        while True:
+            with transaction.commit_on_success():
+                count = self._bill_batch(batch_size)
+            if not count:
+                break
+            billed += count
+            if progress:
+                progress(billed)
+
+        self.finished = timezone.now()
+        BillingRun.objects.filter(pk=self.pk).update(finished=self.finished)
+        return billed
+
+    def _bill_batch(self, batch_size):
+        # Lock the run, so runs of the same key started twice take turns
+        # and the second one continues after the first one's customers
+        run = BillingRun.objects.select_for_update().get(pk=self.pk)
+        customers = list(Customer.objects.filter(
+                is_active=True, pk__gt=run.last_customer).order_by(
+                'pk').values_list('pk', 'subscription_price', 'sms_price',
+                                  'sms_sent')[:batch_size])
+        if not customers:
+            return 0
+
+        # Customer primary keys by the amount they are charged, and by the
+        # number of SMS they are charged for
+        charges = defaultdict(list)
+        sms_charged = defaultdict(list)
+        transactions = []
+        subscription_total = sms_total = sms_count = 0
+
+        for pk, subscription_price, sms_price, sms_sent in customers:
+            charge = subscription_price
+            transactions.append(Transaction(
+                    customer_id=pk, credit=-subscription_price,
+                    description=u'Månedligt abonnement', is_confirmed=True,
+                    billing_run=self))
+            subscription_total += subscription_price
+
+            if sms_sent > 0:
+                charge += sms_sent * sms_price
+                transactions.append(Transaction(
+                        customer_id=pk, credit=-sms_sent * sms_price,
+                        description=u'SMS-forbrug (%s stk.)' % sms_sent,
+                        is_confirmed=True, billing_run=self))
+                sms_charged[sms_sent].append(pk)
+                sms_count += sms_sent
+                sms_total += sms_sent * sms_price
+
+            charges[charge].append(pk)
+
+        for charge, pks in charges.items():
+            Customer.objects.filter(pk__in=pks).update(
+                credit=F('credit') - charge)
+
+        # Subtract the SMS charged for rather than set the count to zero,
+        # SMS sent meanwhile are charged by the next run
+        for sms_sent, pks in sms_charged.items():
+            Customer.objects.filter(pk__in=pks).update(
+                sms_sent=F('sms_sent') - sms_sent)
+
+        Transaction.objects.bulk_create(transactions)
+        self._queue_notices([customer[0] for customer in customers])
+
+        BillingRun.objects.filter(pk=self.pk).update(
+            last_customer=customers[-1][0],
+            customer_count=F('customer_count') + len(customers),
+            subscription_total=F('subscription_total') + subscription_total,
+            sms_count=F('sms_count') + sms_count,
+            sms_total=F('sms_total') + sms_total)
+        return len(customers)
+
+    def _queue_notices(self, customer_ids):
+        """
+        Queues a notice to the administrators of the customers whose credit
+        is below zero
+
+        """
+        from tools.models import Employee, Notification
+
+        negative = dict((pk, (name, credit)) for pk, name, credit in
+                        Customer.objects.filter(
+                pk__in=customer_ids, credit__lt=0).values_list(
+                'pk', 'name', 'credit'))
+        if not negative:
+            return
+
+        messages = []
+        for admin in Employee.objects.filter(customer__in=list(negative),
+                                             is_admin=True):
+            name, credit = negative[admin.customer_id]
+            messages.append((admin, NEGATIVE_CREDIT_SUBJECT, 
+                             NEGATIVE_CREDIT_MESSAGE % (admin.name, name,
+                                                        credit)))
+        Notification.objects.enqueue_batch(messages)
+
 class FAQCategory(models.Model):
     name = models.CharField('Navn', max_length=200)
 
@@ -65,6 +261,89 @@ class FAQPost(models.Model):
     question = models.TextField('Spørgsmål')
     answer = models.TextField('Svar')
 
+def truncate_time(value, resolution='hour'):
+    """
+    Returns the start of the hour or day (in local time) containing value
+
+    """
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if resolution == 'day':
+        value = value.replace(hour=0)
+    return value
+
+class MetricBucketManager(models.Manager):
+    def add(self, name, count=1, when=None):
+        """
+        Adds count to the metric in the hour containing when (default now)
+
+        """
+        if when is None:
+            when = timezone.now()
+        add_to_counters(self, {'name': name, 'start': truncate_time(when)},
+                        {'value': count})
+
+    def totals(self, since, until=None):
+        """
+        Returns the sum of every metric from since until until (default now)
+        as a dictionary keyed by metric name
+
+        """
+        buckets = self.filter(start__gte=truncate_time(since))
+        if until is not None:
+            buckets = buckets.filter(start__lt=until)
+        return dict(buckets.values_list('name').annotate(Sum('value')))
+
+    def series(self, since, resolution='hour', names=None):
+        """
+        Returns the hours (or dates, for days) since since and the value of
+        each metric in each of them, as a dictionary of lists keyed by
+        metric name
+
+        """
+        if resolution == 'day':
+            key = lambda value: truncate_time(value).date()
+            periods = [key(since)]
+            while periods[-1] < key(timezone.now()):
+                periods.append(periods[-1] + datetime.timedelta(days=1))
+        else:
+            key = truncate_time
+            periods = [key(since)]
+            while periods[-1] + datetime.timedelta(hours=1) <= timezone.now():
+                periods.append(periods[-1] + datetime.timedelta(hours=1))
+        index = dict((period, i) for i, period in enumerate(periods))
+
+        buckets = self.filter(start__gte=truncate_time(since, resolution))
+        if names:
+            buckets = buckets.filter(name__in=names)
+
+        series = {}
+        for name, start, value in buckets.values_list(
+            'name', 'start', 'value').iterator():
+            values = series.setdefault(name, [0] * len(periods))
+            i = index.get(key(start))
+            if i is not None:
+                values[i] += value
+
+        return periods, series
+
+class MetricBucket(models.Model):
+    """
+    The value of a metric within an hour, behind the admin dashboard. Old
+    hours are merged into one bucket per day by the prune_metrics command
+
+    """
+    name = models.CharField(max_length=100)
+    start = models.DateTimeField()
+    value = models.IntegerField(default=0)
+
+    objects = MetricBucketManager()
+
+    class Meta:
+        unique_together = (('name', 'start'),)
+        index_together = [['start', 'name']]
+
 def confirm_transaction(sender, **kwargs):
     transaction_id = int(sender.invoice)
     transaction = Transaction.objects.get(id=transaction_id)
@@ -74,6 +353,8 @@ def confirm_transaction(sender, **kwargs):
     transaction.customer.credit += transaction.credit
     transaction.customer.save()
 
+    MetricBucket.objects.add('ipn')
+
     logger = logging.getLogger(__name__)
     logger.info('Transaction ID %s (%s kr. from %s) has been paid' % (transaction_id, transaction.credit, transaction.customer))
 
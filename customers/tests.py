@@ -1,3 +1,103 @@
 from django.test import TestCase
 
-# Create your tests here.
+from customers import urls
+from customers.models import BillingRun, Customer, Transaction
+from toolcontrol.querybudget import QueryBudgetMixin
+from tools.models import Employee, Notification, Tool, ToolCategory
+from tools.models import ToolModel
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    BUDGETS = {
+        'admin_index': 10, 'metrics': 10, 'customer_list': 10,
+        'customer_create': 10, 'customer_detail': 20, 'customer_update': 10,
+        'customer_section': 10,
+        'ticket_list': 10, 'ticket_create': 10, 'ticket_detail': 15, 
+        'ticket_update': 10, 'faqpost_list': 10, 'faqpost_create': 10, 
+        'faqpost_update': 10, 'faqcategory_create': 10, 
+        'faqcategory_update': 10, 'action': 30,
+        }
+
+    def setUp(self):
+        self.customers = [
+            Customer.objects.create(name='Kunde %s' % n, address='Vej %s' % n,
+                                    zip_code=8000, town='Aarhus')
+            for n in range(12)]
+        self.admin = Employee.objects.create_user('Admin', 'a@example.com',
+                                                  12345678, 'kode')
+        self.admin.is_admin = True
+        self.admin.save()
+
+        category = ToolCategory.objects.create(name='Boremaskiner',
+                                               customer=self.customers[0])
+        model = ToolModel.objects.create(name='Bosch', category=category)
+        Tool.objects.create_range(Tool.objects.range_names('B', '1', 3),
+                                  model, price=100)
+
+        self.client.login(username='Admin', password='kode')
+
+    def test_budgets_cover_urls(self):
+        self.assertBudgetsCover(urls.urlpatterns)
+
+    def test_pages(self):
+        for url_name in ('admin_index', 'metrics', 'customer_list', 
+                         'customer_create', 'ticket_list', 'faqpost_list'):
+            self.assertQueryBudget(url_name)
+        self.assertQueryBudget('customer_detail', args=[self.customers[0].pk])
+
+    def test_sections(self):
+        customer = self.customers[0]
+        for section in ('tools', 'models', 'categories', 'employees',
+                        'construction_sites', 'containers', 'transactions'):
+            self.assertQueryBudget('customer_section', 
+                                   args=[customer.pk, section])
+
+        for n in range(25):
+            Transaction.objects.create(customer=customer, credit=n,
+                                       description='Indbetaling')
+        response = self.assertQueryBudget('customer_section', 
+                                          args=[customer.pk, 'transactions'])
+        self.assertEqual(len(response.context['rows']), 20)
+        self.assertTrue(response.context['next_url'])
+
+        response = self.client.get(response.context['next_url'])
+        self.assertEqual(len(response.context['rows']), 5)
+        self.assertIsNone(response.context['next_url'])
+
+class BillingRunTest(TestCase):
+    def setUp(self):
+        self.customers = [
+            Customer.objects.create(name='Kunde %s' % n, address='Vej %s' % n,
+                                    zip_code=8000, town='Aarhus', 
+                                    credit=credit, sms_sent=n)
+            for n, credit in enumerate((150, 150, 50))]
+        self.admin = Employee.objects.create_user('Admin', 'a@example.com',
+                                                  12345678, 'kode')
+        self.admin.customer = self.customers[2]
+        self.admin.is_admin = True
+        self.admin.save()
+
+    def test_bill(self):
+        run = BillingRun.objects.start('2013-05')
+        self.assertEqual(run.bill(batch_size=2), 3)
+
+        credits = [customer.credit for customer in 
+                   Customer.objects.order_by('pk')]
+        self.assertEqual(credits, [50, 49, -52])
+        self.assertFalse(Customer.objects.filter(sms_sent__gt=0).exists())
+        self.assertEqual(Transaction.objects.filter(billing_run=run).count(),
+                         5)
+        self.assertEqual(Notification.objects.filter(
+                employee=self.admin).count(), 2)
+
+        # The period is only billed once
+        self.assertEqual(BillingRun.objects.start('2013-05').bill(), 0)
+        self.assertEqual(Customer.objects.get(pk=self.customers[0].pk).credit,
+                         50)
+
+    def test_resume(self):
+        run = BillingRun.objects.start('2013-05')
+        run._bill_batch(2)
+
+        self.assertEqual(BillingRun.objects.start('2013-05').bill(), 1)
+        self.assertEqual(Transaction.objects.count(), 5)
@@ -10,6 +10,7 @@ from customers.views import CreateFAQCategory, UpdateFAQCategory
 urlpatterns = patterns('customers.views',
     # Index URL
     url(r'^$', login_required(IndexTemplate.as_view()), name = 'admin_index'),
+    url(r'^metrics/$', 'metrics', name='metrics'),
 
     # Customer URL's
     url(r'^customers/$', login_required(CustomerList.as_view()), 
@@ -20,6 +21,9 @@ urlpatterns = patterns('customers.views',
         name='customer_detail'),
     url(r'^customers/(?P<pk>\d+)/update/$', 
         login_required(UpdateCustomer.as_view()), name='customer_update'),
+    url(r'^customers/(?P<pk>\d+)/(?P<section>tools|models|categories|'
+        r'employees|construction_sites|containers|transactions)/$',
+        'customer_section', name='customer_section'),
 
     # Ticket URL's
     url(r'^tickets/$', login_required(TicketList.as_view()), 
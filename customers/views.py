@@ -6,16 +6,20 @@ logger = logging.getLogger(__name__)
 
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
-from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, render
+from django.utils import simplejson, timezone
 from django.views.generic import CreateView, DetailView, FormView, ListView
 from django.views.generic import TemplateView, UpdateView
 
 from customers.forms import CreateTicketForm, TicketAnswerForm
 from customers.forms import CreateCustomerForm, CustomerForm, TicketForm
 from customers.forms import AdminTransactionForm
-from customers.models import Customer, FAQCategory, FAQPost, Transaction
-from tools.models import Event, Login, Ticket, TicketAnswer, Tool, ToolModel
+from customers.models import Customer, FAQCategory, FAQPost, MetricBucket
+from customers.models import Transaction
+from tools.models import Ticket, TicketAnswer, Tool, ToolModel
+from tools.models import CustomerDailyActivity, CustomerToolStats
+from tools.models import ToolCategory
 
 class HasCustomerRedirectMixin(object):
     def dispatch(self, request, *args, **kwargs):
@@ -25,6 +29,9 @@ class HasCustomerRedirectMixin(object):
             return super(HasCustomerRedirectMixin, 
                          self).dispatch(request, *args, **kwargs)
 
+# Number of unread answers and unconfirmed transactions on the dashboard
+DASHBOARD_LIMIT = 20
+
 # Index view
 class IndexTemplate(HasCustomerRedirectMixin, TemplateView):
     template_name = 'customers/admin_index.html'
@@ -32,18 +39,64 @@ class IndexTemplate(HasCustomerRedirectMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super(IndexTemplate, self).get_context_data(**kwargs)
 
-        context['logins'] = Login.objects.filter(timestamp__gte=datetime.datetime.now() - datetime.timedelta(days = 1)).count()
-        context['events'] = Event.objects.filter(start_date__gte=datetime.datetime.now() - datetime.timedelta(days = 1)).count()
+        metrics = MetricBucket.objects.totals(timezone.now() - datetime.timedelta(days = 1))
+        context['logins'] = metrics.get('logins', 0)
+        context['events'] = sum(value for name, value in metrics.items()
+                                if name.startswith('event:'))
         context['tickets'] = Ticket.objects.filter(is_open=True, assigned_to=self.request.user)
-        context['answers'] = TicketAnswer.objects.filter(is_read=False, ticket__assigned_to=self.request.user)
-        context['transactions'] = Transaction.objects.filter(is_confirmed=False)
+
+        answers = TicketAnswer.objects.filter(is_read=False, ticket__assigned_to=self.request.user)
+        context['answer_count'] = answers.count()
+        context['answers'] = answers.select_related('ticket__duplicate', 'created_by').order_by('-timestamp')[:DASHBOARD_LIMIT]
+
+        transactions = Transaction.objects.filter(is_confirmed=False)
+        context['transaction_count'] = transactions.count()
+        context['transactions'] = transactions.select_related('customer').order_by('-timestamp')[:DASHBOARD_LIMIT]
 
         return context
 
+# The JSON metrics windows and the resolution of each
+METRIC_WINDOWS = {
+    '24h': (datetime.timedelta(hours=24), 'hour'),
+    '7d': (datetime.timedelta(days=7), 'hour'),
+    '30d': (datetime.timedelta(days=30), 'day'),
+}
+
+@login_required
+def metrics(request):
+    if request.user.customer:
+        return HttpResponseRedirect(reverse('index'))
+
+    window = request.GET.get('window', '24h')
+    if window not in METRIC_WINDOWS:
+        raise Http404
+
+    length, resolution = METRIC_WINDOWS[window]
+    periods, series = MetricBucket.objects.series(
+        timezone.now() - length, resolution, request.GET.getlist('name'))
+
+    response = {'window': window,
+                'resolution': resolution,
+                'periods': [period.isoformat() for period in periods],
+                'series': series}
+    return HttpResponse(simplejson.dumps(response),
+                        content_type='application/json')
+
 # Customer views
 class CustomerList(HasCustomerRedirectMixin, ListView):
     model = Customer
 
+    def get_context_data(self, **kwargs):
+        context = super(CustomerList, self).get_context_data(**kwargs)
+
+        customers = list(context['object_list'])
+        totals = CustomerDailyActivity.objects.totals(customers)
+        for customer in customers:
+            customer._activity = totals[customer.pk]
+
+        context['object_list'] = context['customer_list'] = customers
+        return context
+
 class CreateCustomer(HasCustomerRedirectMixin, CreateView):
     model = Customer
     form_class = CreateCustomerForm
@@ -70,19 +123,101 @@ class CustomerDetail(HasCustomerRedirectMixin, FormView):
         context = super(CustomerDetail, self).get_context_data(**kwargs)
         customer = get_object_or_404(Customer, id = self.kwargs['pk'])
 
+        # Only the totals of each section, the rows are loaded by
+        # customer_section when the section is opened
         context['customer'] = customer
-        context['tools'] = Tool.objects.filter(model__category__customer=customer)
-        context['models'] = ToolModel.objects.filter(category__customer=customer)
-        context['categories'] = customer.toolcategory_set.all()
-        context['employees'] = customer.employee_set.all()
-        context['construction_sites'] = customer.constructionsite_set.all()
-        context['containers'] = customer.container_set.all()
+        context['stats'] = CustomerToolStats.objects.for_customer(customer)
+        context['employee_count'] = customer.employee_set.count()
+        context['construction_site_count'] = customer.constructionsite_set.count()
+        context['container_count'] = customer.container_set.count()
+
+        rows, next_cursor = section_page(customer, 'transactions', None,
+                                         TRANSACTION_PAGE_SIZE)
+        context['rows'] = rows
+        context['next_url'] = section_url(customer, 'transactions',
+                                          next_cursor)
 
         return context
 
     def get_success_url(self):
         return reverse('customer_detail', args=[self.kwargs['pk']])
 
+# Rows per page of the sections of the customer detail page, and the
+# transactions shown before the first "Vis flere"
+SECTION_PAGE_SIZE = 50
+TRANSACTION_PAGE_SIZE = 20
+
+def section_queryset(customer, section):
+    if section == 'tools':
+        tools = Tool.objects.filter(model__category__customer=customer)
+        return tools.select_related('model__category', 'container',
+                                    'employee', 'construction_site')
+    elif section == 'models':
+        tool_models = ToolModel.objects.with_rollups(customer.use_tool_counters)
+        return tool_models.filter(category__customer=customer
+                                  ).select_related('category')
+    elif section == 'categories':
+        categories = ToolCategory.objects.with_rollups(customer.use_tool_counters)
+        return categories.filter(customer=customer)
+    elif section == 'employees':
+        return customer.employee_set.all()
+    elif section == 'construction_sites':
+        return customer.constructionsite_set.all()
+    elif section == 'containers':
+        return customer.container_set.select_related('location')
+    elif section == 'transactions':
+        return Transaction.objects.filter(customer=customer)
+    raise Http404
+
+def section_page(customer, section, after, page_size=SECTION_PAGE_SIZE):
+    """
+    Returns a page of the rows of a section of the customer detail page
+    and the cursor of the next page, or None on the last page. Rows are
+    ordered by primary key, transactions newest first, and the page starts
+    after the row with primary key after
+
+    """
+    descending = section == 'transactions'
+    queryset = section_queryset(customer, section).order_by(
+        descending and '-pk' or 'pk')
+    if after is not None:
+        queryset = queryset.filter(**{descending and 'pk__lt' or 'pk__gt':
+                                          after})
+
+    rows = list(queryset[:page_size + 1])
+    if len(rows) > page_size:
+        return rows[:page_size], rows[page_size - 1].pk
+    return rows, None
+
+def section_url(customer, section, next_cursor):
+    if next_cursor is None:
+        return None
+    return '%s?after=%s' % (reverse('customer_section', 
+                                    args=[customer.pk, section]), next_cursor)
+
+@login_required
+def customer_section(request, pk, section):
+    if request.user.customer:
+        return HttpResponseRedirect(reverse('index'))
+
+    customer = get_object_or_404(Customer, id=pk)
+
+    after = request.GET.get('after')
+    if after is not None:
+        if not after.isdigit():
+            raise Http404
+        after = int(after)
+
+    page_size = SECTION_PAGE_SIZE
+    if section == 'transactions':
+        page_size = TRANSACTION_PAGE_SIZE
+    rows, next_cursor = section_page(customer, section, after, page_size)
+
+    context = {'customer': customer,
+               'rows': rows,
+               'next_url': section_url(customer, section, next_cursor)}
+    return render(request, 'customers/sections/%s.html' % section, context)
+
 class UpdateCustomer(HasCustomerRedirectMixin, UpdateView):
     model = Customer
     form_class = CustomerForm
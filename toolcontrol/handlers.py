@@ -1,28 +1,168 @@
 # -*- coding:utf-8 -*-
+import collections
+import datetime
+import hashlib
 import logging
+import os
+import re
+import sys
+import threading
+import time
 import traceback
 
-from django.http import Http404
-from django.shortcuts import get_object_or_404
+from django.db import connection, transaction
 
 from tools.models import Ticket
 
+def normalize_trace(stack_trace):
+    """
+    Removes what differs between occurrences of the same error from a stack
+    trace: line numbers and memory addresses
+
+    """
+    stack_trace = re.sub(r', line \d+', '', stack_trace)
+    return re.sub(r'0x[0-9a-fA-F]+', '0x', stack_trace)
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def error_fingerprint(message, stack_trace):
+    return hashlib.sha1('%s\n%s' % (_utf8(message), 
+                                    _utf8(normalize_trace(stack_trace)))
+                        ).hexdigest()
+
 class DBLogHandler(logging.Handler):
+    """
+    Logs records as error tickets, one ticket per fingerprint of the
+    message and stack trace with a count of its occurrences.
+
+    emit only formats the record and puts it in a buffer of capacity
+    records, the oldest records are dropped when it is full. A background
+    thread writes the buffer to the database every flush_interval seconds.
+    Only rate_limit records per fingerprint are buffered per rate_period
+    seconds; the rest are only counted
+
+    """
+    def __init__(self, capacity=1000, flush_interval=2.0, rate_limit=10,
+                 rate_period=60, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.buffer = collections.deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+
+        # Fingerprint -> (start of the period, records buffered in it)
+        self.rates = {}
+        # Fingerprint -> records not buffered because of the rate limit
+        self.suppressed = collections.defaultdict(int)
+
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+        self.pid = None
+
+    def _ensure_thread(self):
+        # A forked worker doesn't inherit the thread
+        if self.thread is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run,
+                                           name='DBLogHandler')
+            self.thread.daemon = True
+            self.thread.start()
+
     def emit(self, record):
-        if record.exc_info:
-            stack_trace = '\n'.join(traceback.format_exception(*record.exc_info))
-        else:
-            stack_trace = 'Ingen stack trace tilgængelig'
+        # The database writes of the flush could be logged themselves
+        if threading.current_thread() is self.thread:
+            return
 
         try:
-            org_ticket = get_object_or_404(Ticket, name=record.getMessage(),
-                                           description=stack_trace,
-                                           duplicate=None)
-            
-            t = Ticket(name=record.getMessage(), description=stack_trace, 
-                       level='Fejl', duplicate=org_ticket)
-        except Http404:
-            t = Ticket(name=record.getMessage(), description=stack_trace, 
-                       level='Fejl')
-            
-        t.save()
+            if record.exc_info:
+                stack_trace = '\n'.join(traceback.format_exception(*record.exc_info))
+            else:
+                stack_trace = 'Ingen stack trace tilgængelig'
+            message = record.getMessage()
+            fingerprint = error_fingerprint(message, stack_trace)
+            now = time.time()
+
+            self.acquire()
+            try:
+                start, count = self.rates.get(fingerprint, (now, 0))
+                if now - start > self.rate_period:
+                    start, count = now, 0
+                if count >= self.rate_limit:
+                    self.suppressed[fingerprint] += 1
+                else:
+                    self.rates[fingerprint] = (start, count + 1)
+                    self.buffer.append((fingerprint, message, stack_trace,
+                                        record.created))
+                    # Flush early rather than drop records in a storm
+                    if len(self.buffer) * 2 >= self.buffer.maxlen:
+                        self.wakeup.set()
+                self._ensure_thread()
+            finally:
+                self.release()
+        except Exception:
+            self.handleError(record)
+
+    def _run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered and suppressed records to their tickets
+
+        """
+        self.acquire()
+        try:
+            records = list(self.buffer)
+            self.buffer.clear()
+            suppressed, self.suppressed = (self.suppressed,
+                                           collections.defaultdict(int))
+            now = time.time()
+            self.rates = dict(
+                (fingerprint, rate) for fingerprint, rate in self.rates.items()
+                if now - rate[0] <= self.rate_period)
+        finally:
+            self.release()
+
+        if not records and not suppressed:
+            return
+
+        # One write per fingerprint
+        errors = collections.OrderedDict()
+        for fingerprint, message, stack_trace, created in records:
+            if fingerprint in errors:
+                errors[fingerprint][2] += 1
+                errors[fingerprint][3] = created
+            else:
+                errors[fingerprint] = [message, stack_trace, 1, created]
+
+        try:
+            with transaction.commit_on_success():
+                for fingerprint, (message, stack_trace, count,
+                                  created) in errors.items():
+                    Ticket.objects.record_error(
+                        fingerprint, message, stack_trace, 
+                        count + suppressed.pop(fingerprint, 0),
+                        datetime.datetime.fromtimestamp(created))
+                # These have been buffered, and so written, before
+                for fingerprint, count in suppressed.items():
+                    Ticket.objects.add_occurrences(fingerprint, count)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+        finally:
+            if threading.current_thread() is self.thread:
+                connection.close()
+
+    def close(self):
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join(self.flush_interval * 2)
+        self.flush()
+        logging.Handler.close(self)
@@ -0,0 +1,226 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime, httplib, logging, re, threading, urllib
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils.importlib import import_module
+
+from customers.models import Customer, MetricBucket
+from tools.models import Notification
+
+logger = logging.getLogger(__name__)
+
+MAIL_FROM = 'ToolControl <kontakt@toolcontrol.dk>'
+
+# Give up on a notification after this many attempts
+MAX_ATTEMPTS = 5
+
+# The delay before the first retry, doubled for every failed attempt
+RETRY_DELAY = datetime.timedelta(minutes=1)
+
+class SMSError(Exception):
+    pass
+
+class CPSMSGateway(object):
+    """
+    Sends SMS through cpsms.dk. Every thread keeps its own keep-alive
+    connection to the gateway
+
+    """
+    host = 'cpsms.dk'
+    pattern = re.compile("<(?P<status>.+?)>(?P<message>.+?)</.+?>")
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def get_connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = httplib.HTTPConnection(self.host,
+                                                           timeout=30)
+        return self.local.connection
+
+    def send(self, recipient, message):
+        params = urllib.urlencode({'username': 'hromby',
+                                   'password': 'IRMLVJ',
+                                   'recipient': recipient,
+                                   'message': message.encode('utf-8'),
+                                   'utf8': 1,
+                                   'from': 'ToolControl',})
+
+        connection = self.get_connection()
+        try:
+            connection.request('GET', '/sms?%s' % params)
+            content = connection.getresponse().read()
+        except Exception:
+            # Drop the connection so the next attempt reconnects
+            connection.close()
+            self.local.connection = None
+            raise
+
+        match = self.pattern.search(content)
+        if match is None:
+            raise SMSError('Unexpected response from SMS gateway: %s' %
+                           content)
+
+        if match.group('status') != 'succes':
+            raise SMSError('SMS gateway returned "%s: %s"' %
+                           (match.group('status'), match.group('message')))
+
+        return match.group('message')
+
+class FakeSMSGateway(object):
+    """
+    Gateway for tests and local development. Messages are stored in
+    FakeSMSGateway.outbox instead of being sent, and recipients listed in
+    FakeSMSGateway.failing make the gateway fail
+
+    """
+    outbox = []
+    failing = set()
+
+    def send(self, recipient, message):
+        if recipient in self.failing:
+            raise SMSError('Fake gateway refused %s' % recipient)
+        self.outbox.append((recipient, message))
+        return 'Fake'
+
+def get_sms_gateway():
+    path = getattr(settings, 'SMS_GATEWAY',
+                   'toolcontrol.notifications.CPSMSGateway')
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)()
+
+class Dispatcher(object):
+    """
+    Drains the notification queue. SMS are sent in parallel on a bounded
+    thread pool and mails are sent in batches sharing one SMTP session.
+    Only the calling thread touches the database
+
+    """
+    def __init__(self, workers=4, batch_size=100, mails_per_session=20,
+                 sms_gateway=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.mails_per_session = mails_per_session
+        self.sms_gateway = sms_gateway or get_sms_gateway()
+        self.pool = ThreadPool(workers)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def run(self):
+        """
+        Sends batches until the queue has nothing due. Returns the number
+        of notifications handled
+
+        """
+        handled = 0
+        while True:
+            count = self.run_once()
+            handled += count
+            if count < self.batch_size:
+                return handled
+
+    def run_once(self):
+        notifications = Notification.objects.claim(self.batch_size)
+        if not notifications:
+            return 0
+
+        sms = [n for n in notifications if n.channel == 'SMS']
+        mails = [n for n in notifications if n.channel == 'Mail']
+        sessions = [mails[i:i + self.mails_per_session]
+                    for i in range(0, len(mails), self.mails_per_session)]
+
+        sms_results = self.pool.map_async(self.send_sms, sms)
+        mail_results = self.pool.map_async(self.send_mails, sessions)
+
+        results = sms_results.get()
+        for session_results in mail_results.get():
+            results.extend(session_results)
+
+        self.record(results)
+        return len(notifications)
+
+    def send_sms(self, notification):
+        try:
+            response = self.sms_gateway.send(notification.recipient,
+                                             notification.message)
+            logger.debug('SMS gateway returned "%s"' % response)
+            return notification, None
+        except Exception, e:
+            return notification, e
+
+    def send_mails(self, notifications):
+        results = []
+        connection = get_connection()
+
+        try:
+            connection.open()
+        except Exception, e:
+            return [(notification, e) for notification in notifications]
+
+        try:
+            for notification in notifications:
+                try:
+                    EmailMessage(notification.subject, notification.message,
+                                 MAIL_FROM, [notification.recipient],
+                                 connection=connection).send()
+                    results.append((notification, None))
+                except Exception, e:
+                    results.append((notification, e))
+        finally:
+            connection.close()
+
+        return results
+
+    def record(self, results):
+        now = datetime.datetime.now()
+        sent_ids = []
+        sms_per_customer = defaultdict(int)
+
+        for notification, error in results:
+            if error is None:
+                sent_ids.append(notification.pk)
+                if notification.channel == 'SMS' and notification.customer_id:
+                    sms_per_customer[notification.customer_id] += 1
+                continue
+
+            notification.attempts += 1
+            notification.last_error = '%s' % error
+
+            if notification.attempts >= MAX_ATTEMPTS:
+                notification.status = 'Fejlet'
+                logger.error('%s to %s failed for good: %s' %
+                             (notification.channel, notification.recipient,
+                              error))
+            else:
+                notification.next_attempt = now + (
+                    RETRY_DELAY * 2 ** (notification.attempts - 1))
+                logger.warning('%s to %s failed, retrying at %s: %s' %
+                               (notification.channel, notification.recipient,
+                                notification.next_attempt, error))
+
+            notification.save()
+
+        if sent_ids:
+            Notification.objects.filter(pk__in=sent_ids).update(
+                status='Sendt', sent=now)
+
+        # One UPDATE per distinct count rather than per customer
+        customers_per_count = defaultdict(list)
+        for customer_id, count in sms_per_customer.items():
+            customers_per_count[count].append(customer_id)
+
+        for count, customer_ids in customers_per_count.items():
+            Customer.objects.filter(pk__in=customer_ids).update(
+                sms_sent=F('sms_sent') + count)
+
+        MetricBucket.objects.add('sms', len([
+                    notification for notification, error in results
+                    if error is None and notification.channel == 'SMS']))
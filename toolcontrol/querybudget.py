@@ -0,0 +1,222 @@
+# -*- coding:utf-8 -*-
+"""
+Counting of the SQL queries run per request
+
+QueryBudgetMiddleware records the number of queries, the time spent in the
+database and how often each statement was run for every request. It logs a
+warning when a view runs more queries than its budget, or the same
+statement more than QUERY_REPEAT_LIMIT times, which is usually a query per
+row of a list. QueryBudgetMixin asserts the same in tests.
+
+Enable it by adding 'toolcontrol.querybudget.QueryBudgetMiddleware' to
+MIDDLEWARE_CLASSES.
+
+Settings:
+
+QUERY_BUDGET: queries allowed per request, 50 if not set
+QUERY_BUDGETS: budgets of single views by URL name
+QUERY_REPEAT_LIMIT: times the same statement may run, 10 if not set
+
+"""
+from __future__ import unicode_literals
+
+import logging, re, time
+from collections import defaultdict
+from contextlib import contextmanager
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+from django.core.urlresolvers import Resolver404, RegexURLResolver, resolve
+from django.core.urlresolvers import reverse
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.util import CursorWrapper
+
+def fingerprint(sql):
+    """
+    Returns the shape of a statement: the statement without its literal
+    values and with lists of any length written the same way
+
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+\b', '?', sql)
+    sql = re.sub(r'%s', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+class QueryRecorder(object):
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = defaultdict(int)
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[fingerprint(sql)] += 1
+
+    def repeated(self, limit):
+        """
+        Returns the statements run more than limit times with their counts,
+        the most frequent first
+
+        """
+        return sorted(((sql, count) for sql, count in self.statements.items()
+                       if count > limit), key=lambda item: -item[1])
+
+class RecordingCursorWrapper(CursorWrapper):
+    def __init__(self, cursor, db, recorders):
+        super(RecordingCursorWrapper, self).__init__(cursor, db)
+        self.recorders = recorders
+
+    def _record(self, sql, start):
+        duration = time.time() - start
+        for recorder in self.recorders:
+            recorder.add(sql, duration)
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return super(RecordingCursorWrapper, self).execute(sql, params)
+        finally:
+            self._record(sql, start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(RecordingCursorWrapper, self).executemany(sql,
+                                                                   param_list)
+        finally:
+            self._record(sql, start)
+
+def start_recording(using=DEFAULT_DB_ALIAS):
+    """
+    Starts recording the queries run on the connection by this thread and
+    returns the QueryRecorder. Recordings can overlap
+
+    """
+    connection = connections[using]
+    recorder = QueryRecorder()
+
+    recorders = getattr(connection, '_query_recorders', None)
+    if not recorders:
+        recorders = connection._query_recorders = []
+        connection._query_saved_cursor = (connection.use_debug_cursor,
+                                          connection.make_debug_cursor)
+        # Every cursor is made by make_debug_cursor while use_debug_cursor
+        # is set, whatever DEBUG is
+        connection.use_debug_cursor = True
+        connection.make_debug_cursor = (
+            lambda cursor: RecordingCursorWrapper(cursor, connection,
+                                                  recorders))
+    recorders.append(recorder)
+    return recorder
+
+def stop_recording(recorder, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    recorders = getattr(connection, '_query_recorders', [])
+    if recorder in recorders:
+        recorders.remove(recorder)
+    if not recorders and hasattr(connection, '_query_saved_cursor'):
+        (connection.use_debug_cursor,
+         connection.make_debug_cursor) = connection._query_saved_cursor
+        del connection._query_saved_cursor
+        connection._query_recorders = None
+
+@contextmanager
+def record_queries(using=DEFAULT_DB_ALIAS):
+    recorder = start_recording(using)
+    try:
+        yield recorder
+    finally:
+        stop_recording(recorder, using)
+
+def query_budget(url_name):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(url_name, getattr(settings, 'QUERY_BUDGET', 50))
+
+def repeat_limit():
+    return getattr(settings, 'QUERY_REPEAT_LIMIT', 10)
+
+def budget_problems(recorder, budget, limit):
+    """
+    Returns descriptions of how the recorded queries break the budget and
+    the repeat limit
+
+    """
+    problems = []
+    if budget is not None and recorder.count > budget:
+        problems.append('%s queries, budget is %s' % (recorder.count, budget))
+    for sql, count in recorder.repeated(limit):
+        problems.append('%s times: %s' % (count, sql))
+    return problems
+
+class QueryBudgetMiddleware(object):
+    def process_request(self, request):
+        request._query_recorder = start_recording()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        try:
+            request._query_url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            pass
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_query_recorder', None)
+        if recorder is None:
+            return response
+        stop_recording(recorder)
+        del request._query_recorder
+
+        url_name = getattr(request, '_query_url_name', None)
+        problems = budget_problems(recorder, query_budget(url_name),
+                                   repeat_limit())
+        if problems:
+            logger.warning('%s (%s) ran %s queries in %.0f ms: %s' %
+                           (request.path, url_name, recorder.count,
+                            recorder.duration * 1000, '; '.join(problems)))
+        return response
+
+def url_names(urlpatterns):
+    """
+    Returns the names of the URL patterns, including those of included
+    patterns
+
+    """
+    names = set()
+    for pattern in urlpatterns:
+        if isinstance(pattern, RegexURLResolver):
+            names.update(url_names(pattern.url_patterns))
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+class QueryBudgetMixin(object):
+    """
+    Test case mixin for pinning the number of queries of views. BUDGETS
+    maps every URL name of the patterns under test to its budget
+
+    """
+    BUDGETS = {}
+
+    def assertBudgetsCover(self, urlpatterns):
+        missing = url_names(urlpatterns) - set(self.BUDGETS)
+        self.assertFalse(missing, 'No query budget for %s' %
+                         ', '.join(sorted(missing)))
+
+    def assertQueryBudget(self, url_name, data=None, args=(), method='get',
+                          status_code=200):
+        """
+        Requests the view and fails if it runs more queries than its budget
+        or the same statement more than the repeat limit. Returns the
+        response
+
+        """
+        url = reverse(url_name, args=args)
+        with record_queries() as recorder:
+            response = getattr(self.client, method)(url, data or {})
+
+        self.assertEqual(response.status_code, status_code)
+        problems = budget_problems(recorder, self.BUDGETS[url_name],
+                                   repeat_limit())
+        self.assertFalse(problems, '%s: %s' % (url_name, '\n'.join(problems)))
+        return response
@@ -2,8 +2,26 @@ $(document).ready(function() {
     $(document).on("click", "a.admin_pane", function() {
 	$("div.admin_pane").hide();
 	var pane_id = $(this).attr("id");
-	$("div.admin_pane#" + pane_id).show();
+	var pane = $("div.admin_pane#" + pane_id);
+	pane.show();
+
+	// Sections of the customer page are loaded the first time they are shown
+	if(pane.attr("data-url") && !pane.hasClass("loaded")) {
+	    pane.addClass("loaded");
+	    pane.children("div.section").load(pane.attr("data-url"));
+	}
 	return false;
     });
-});
 
+    // Append the next page of a section
+    $(document).on("click", "a.load_more_section", function() {
+	var more = $(this).closest("div.load_more_section");
+	$.get($(this).attr("data-url"), function(data) {
+	    var page = $("<div>").html(data);
+	    more.prevAll(".section_rows").first().append(page.find(".section_line"));
+	    more.after(page.find("div.load_more_section"));
+	    more.remove();
+	});
+	return false;
+    });
+});
@@ -57,6 +57,9 @@ $(document).ready(function() {
 	    if($(this).attr("href") == "#add_many_tools") {
 		var object_type = "add_many_tools";
 	    }
+	    else if($(this).attr("href") == "#import_tools") {
+		var object_type = "import_tools";
+	    }
 	    else {
 		var object_type = $("table#index_navigation td.selected").attr("id");
 	    }
@@ -143,6 +146,32 @@ $(document).ready(function() {
 	return false;
     });
 
+    // Importing tools from a file. The file can't be sent with serialize
+    $(document).on("click", "input.import", function() {
+	$.ajax({
+	    url: "/import_tools_form/",
+	    type: "POST",
+	    data: new FormData($("form.import")[0]),
+	    processData: false,
+	    contentType: false,
+	    success: function(data) {
+		if(data.status == "success") {
+		    $("div#content").load("/tool_list/");
+		    set_message(data.response);
+		    $('#mask').fadeOut('fast', function() {
+			$('#mask').remove();
+		    }); 
+		    $('div.popup').fadeOut('slow'); 
+		}
+		else {
+		    $("div.popup#add").html(data.response);
+		}
+	    }
+	});
+
+	return false;
+    });
+
     // Search function
     var delay = (function(){
 	var timer = 0;
@@ -242,6 +271,9 @@ $(document).ready(function() {
 	    $('body').append('<div id="mask"></div>');
 	    $('#mask').fadeIn('fast');
 	}
+	else if (action == "labels") {
+	    window.open("/labels/?ids=" + object_ids.toString());
+	}
 	else {
 	    $.post("/"+object_type+"_action/", "object_ids=" + object_ids.toString() + "&action=" + action, function(data) {
 		$("div#content").load("/"+object_type+"_list/", "search="+search);
@@ -407,6 +439,52 @@ $(document).ready(function() {
 	return false;
     });
 
+    // Append the next page of the list
+    function load_more() {
+	var link = $("div#content a.load_more");
+	if(link.length == 0 || link.hasClass("loading")) {
+	    return;
+	}
+	link.addClass("loading");
+
+	var object_type = $("table#index_navigation td.selected").attr("id");
+	var search = $("input#search").val();
+	var ordering = link.attr("data-ordering");
+	var after = link.attr("id");
+
+	$.get("/"+object_type+"_list/", "search="+search+"&ordering="+ordering+"&after="+after, function(data) {
+	    var page = $("<div>").html(data);
+	    var rows = page.find("table").first().find("> tbody > tr").slice(1);
+	    $("div#content table").first().children("tbody").append(rows);
+	    $("div#content div.load_more").remove();
+	    $("div#content table").first().after(page.find("div.load_more"));
+	});
+    }
+
+    $(document).on("click", "a.load_more", function() {
+	load_more();
+	return false;
+    });
+
+    // Append the next page of a tool's or loaner's history
+    $(document).on("click", "a.load_more_history", function() {
+	var more = $(this).closest("div.load_more_history");
+	$.get($(this).attr("data-url"), function(data) {
+	    var page = $("<div>").html(data);
+	    var rows = page.find("tr.event_line, tr.loan_line");
+	    more.prev("table").children("tbody").append(rows);
+	    more.after(page.find("div.load_more_history"));
+	    more.remove();
+	});
+	return false;
+    });
+
+    $(window).scroll(function() {
+	if($(window).scrollTop() + $(window).height() > $(document).height() - 200) {
+	    load_more();
+	}
+    });
+
     // Handle edits
     $(document).on("click", "a.edit", function() {
 	var object_type = $(this).attr("id");
@@ -474,7 +552,14 @@ $(document).ready(function() {
 	$("div.popup#delete form").attr("action", "/"+object_type+"_delete/");
 	$("div.popup#delete p").text("Er du sikker på, at du vil slette " + $(this).attr("id") + "?");
 	$("div.popup#delete input#id").attr("value", $(this).attr("href").replace("#",""));
-	
+
+	// Tell what else is deleted with tools, models and categories
+	if (object_type == "tool" || object_type == "model" || object_type == "category") {
+	    $.post("/"+object_type+"_delete/", "preview=1&id="+$(this).attr("href").replace("#",""), function(data) {
+		$("div.popup#delete p").text(data.response);
+	    });
+	}
+
 	var popupBox = "div.popup#delete";
 	//Set the center alignment padding + border
 	var popMargTop = ($(popupBox).height() + 24) / 2; 
@@ -1,11 +1,9 @@
 # -*- coding:utf-8 -*-
 from __future__ import unicode_literals
-import datetime
 
 from django.db.models import Q
-from django.utils import timezone
 
-from tools.models import Employee
+from tools.models import Employee, Notification
 from toolcontrol.enums import MESSAGES
 
 def handle_loan_messages(tools, loaner):
@@ -25,19 +23,10 @@ def handle_loan_messages(tools, loaner):
     else:
         admins = Employee.objects.filter(loan_threshold__lte=len(tools))
 
-    for admin in admins:
-        admin.send_message('Værktøj udlånt', message)
+    Notification.objects.enqueue_many(admins, 'Værktøj udlånt', message)
 
 def check_for_service(tool):
-    if tool.service_interval == 0:
-        return False
-
-    now = timezone.now()
-    service_interval = datetime.timedelta(days=tool.service_interval*30*0.9)
-
-    # Find out whether the time between last service and now is bigger than
-    # the max service interval
-    return now - tool.last_service > service_interval
+    return tool.needs_service()
 
 verbose_messages = {
     MESSAGES.TOOL_SERVICE_SUCCESS: ' blev serviceret',
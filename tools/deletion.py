@@ -0,0 +1,157 @@
+# -*- coding:utf-8 -*-
+"""
+Deletion of tool categories, models and tools with everything under them
+
+Deleting through the ORM collects every event, reservation and tool of the
+deleted objects and sends pre_delete for each of them; pre_delete_event
+loads and saves the tool of every event, although the tool is deleted as
+well. CascadeDeleter finds the same rows up front, does the bookkeeping of
+the delete receivers once for all of them and deletes the rows in batches
+without signals
+
+"""
+from __future__ import unicode_literals
+
+import logging
+logger = logging.getLogger(__name__)
+
+from collections import defaultdict
+
+from django.db import router, transaction
+from django.db.models import F
+from django.db.models.sql import DeleteQuery
+
+from tools.models import ArchivedEvent, CustomerToolStats, Event, Reservation
+from tools.models import Tool, ToolCategory, ToolModel
+from tools.models import apply_tool_counters, tool_stats_contribution
+
+# The tables deleted from, in the order the rows are deleted, with the
+# names used in the preview
+TABLES = (
+    (Reservation, 'reservationer'),
+    (ArchivedEvent, 'arkiverede hændelser'),
+    (Event, 'hændelser'),
+    (Tool, 'værktøj'),
+    (ToolModel, 'modeller'),
+    (ToolCategory, 'kategorier'),
+    )
+
+class CascadeDeleter(object):
+    """
+    Deletes the categories, models or tools with the given primary keys
+    and the rows depending on them. The tools' events are deleted with
+    them, so none of the bookkeeping of pre_delete_event is needed
+
+    """
+    def __init__(self, model, pks, batch_size=1000):
+        if model not in (ToolCategory, ToolModel, Tool):
+            raise ValueError('Cannot delete %s in bulk' % model.__name__)
+        self.batch_size = batch_size
+
+        self.categories = ToolCategory.objects.none()
+        self.models = ToolModel.objects.none()
+        if model == ToolCategory:
+            self.categories = ToolCategory.objects.filter(pk__in=pks)
+            self.models = ToolModel.objects.filter(category__in=pks)
+            self.tools = Tool.objects.filter(model__category__in=pks)
+        elif model == ToolModel:
+            self.models = ToolModel.objects.filter(pk__in=pks)
+            self.tools = Tool.objects.filter(model__in=pks)
+        else:
+            self.tools = Tool.objects.filter(pk__in=pks)
+
+    def querysets(self):
+        """
+        Returns the querysets of the rows to delete in the order of TABLES
+
+        """
+        tool_ids = self.tools.values('pk')
+        return (Reservation.objects.filter(tool__in=tool_ids),
+                ArchivedEvent.objects.filter(tool__in=tool_ids),
+                Event.objects.filter(tool__in=tool_ids),
+                self.tools, self.models, self.categories)
+
+    def preview(self):
+        """
+        Returns the number of rows which would be deleted from each table
+        as a list of the names in TABLES and counts. Nothing is changed
+
+        """
+        return [(name, queryset.count()) for (model, name), queryset
+                in zip(TABLES, self.querysets())]
+
+    def _update_stats(self, tools, model_ids, category_ids):
+        """
+        Subtracts the deleted rows from the stats and counters of what is
+        left, as the delete receivers would have done one row at a time
+
+        """
+        deltas = defaultdict(lambda: defaultdict(int))
+        counters = defaultdict(lambda: [0, 0])
+        for (pk, model_id, category_id, customer_id, location, price,
+             buy_date, end_date) in tools:
+            contribution = tool_stats_contribution(location, price, buy_date,
+                                                   end_date)
+            for field, value in contribution.items():
+                deltas[customer_id][field] -= value
+            if category_id not in category_ids:
+                counters[model_id][0] -= 1
+                counters[model_id][1] -= price or 0
+
+        models = defaultdict(int)
+        for model_id, category_id, customer_id, price in (
+            ToolModel.objects.filter(pk__in=model_ids).values_list(
+                'pk', 'category', 'category__customer', 'price')):
+            deltas[customer_id]['model_count'] -= 1
+            deltas[customer_id]['model_price_sum'] -= price or 0
+            if category_id not in category_ids:
+                models[category_id] += 1
+
+        for customer_id in ToolCategory.objects.filter(
+            pk__in=category_ids).values_list('customer', flat=True):
+            deltas[customer_id]['category_count'] -= 1
+
+        for customer_id, customer_deltas in deltas.items():
+            CustomerToolStats.objects.apply_delta(customer_id,
+                                                  **customer_deltas)
+        for model_id, (tool_count, tool_price_sum) in counters.items():
+            apply_tool_counters(model_id, tool_count, tool_price_sum)
+        for category_id, model_count in models.items():
+            ToolCategory.objects.filter(pk=category_id).update(
+                model_count=F('model_count') - model_count)
+
+    def delete(self):
+        """
+        Deletes the rows in a single transaction, batch_size tools at a
+        time. Returns the number of rows deleted from each table like
+        preview
+
+        """
+        using = router.db_for_write(Tool)
+
+        with transaction.commit_on_success():
+            counts = self.preview()
+            model_ids = list(self.models.values_list('pk', flat=True))
+            category_ids = set(self.categories.values_list('pk', flat=True))
+            tools = list(self.tools.values_list(
+                    'pk', 'model', 'model__category',
+                    'model__category__customer', 'location', 'price',
+                    'buy_date', 'end_date'))
+            self._update_stats(tools, model_ids, category_ids)
+
+            tool_ids = [tool[0] for tool in tools]
+            for offset in range(0, len(tool_ids), self.batch_size):
+                batch = tool_ids[offset:offset + self.batch_size]
+                # The tools must not point at the events deleted first
+                Tool.objects.filter(pk__in=batch).update(open_event=None)
+                for model in (Reservation, ArchivedEvent, Event):
+                    DeleteQuery(model).delete_batch(
+                        batch, using, field=model._meta.get_field('tool'))
+                DeleteQuery(Tool).delete_batch(batch, using)
+
+            DeleteQuery(ToolModel).delete_batch(model_ids, using)
+            DeleteQuery(ToolCategory).delete_batch(list(category_ids), using)
+
+        logger.info('Deleted %s' % ', '.join('%s %s' % (count, name)
+                                             for name, count in counts))
+        return counts
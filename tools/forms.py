@@ -2,6 +2,8 @@
 from __future__ import unicode_literals
 
 import datetime
+import logging
+logger = logging.getLogger(__name__)
 
 from django import forms
 from django.shortcuts import get_object_or_404
@@ -12,6 +14,7 @@ from toolcontrol.utils import handle_loan_messages
 from tools.models import Container, ContainerLoan, ConstructionSite, Employee
 from tools.models import Event, ForgotPasswordToken, Reservation, Tool
 from tools.models import ToolCategory, ToolModel
+from tools.importer import InvalidImportFile, ToolImporter, read_rows
 
 class NewForm(forms.Form):
     def as_new_table(self):
@@ -68,13 +71,8 @@ class LoanForm(NewModelForm):
         if not self.cleaned_data['tools']:
             return obj_dict
 
-        for tool_id in tool_ids:
-            tool = get_object_or_404(Tool, id = tool_id)
-            response = tool.loan(cd['employee'], cd['construction_site'])
-            try:
-                obj_dict[response].append(tool.name)
-            except KeyError:
-                obj_dict[response] = [tool.name]
+        obj_dict = Tool.objects.bulk_loan(tool_ids, cd['employee'], 
+                                          cd['construction_site'])
 
         try:
             if cd['employee']:
@@ -226,9 +224,10 @@ class ContainerLoanForm(NewModelForm):
         model = ContainerLoan
         fields = ['construction_site',]
 
-    def __init__(self, customer, *args, **kwargs):
-        super(ToolModelForm, self).__init__(*args, **kwargs)
+    def __init__(self, customer, user=None, *args, **kwargs):
+        super(ContainerLoanForm, self).__init__(*args, **kwargs)
         self.fields['construction_site'].queryset = ConstructionSite.objects.filter(customer=customer)
+        self.user = user
 
     def save(self, commit=True):
         cd = self.cleaned_data
@@ -241,7 +240,7 @@ class ContainerLoanForm(NewModelForm):
 
         for container_id in container_ids:
             container = get_object_or_404(Container, id = container_id)
-            response = container.loan(cd['construction_site'])
+            response = container.loan(cd['construction_site'], self.user)
 
             try:
                 obj_dict[response].append(container.name)
@@ -378,8 +377,14 @@ class CreateManyToolsForm(NewForm):
 
     buy_date = forms.DateField(label = "Indkøbsdato")
 
+    # Tools inserted per query when saving
+    batch_size = 500
+    # Tools created at most by one submission
+    range_limit = 5000
+
     def __init__(self, customer, *args, **kwargs):
         super(CreateManyToolsForm, self).__init__(*args, **kwargs)
+        self.customer = customer
         self.fields['model'].queryset = ToolModel.objects.filter(category__customer=customer).order_by('name')
 
         self.fields['buy_date'].initial = datetime.datetime.now()
@@ -392,37 +397,24 @@ class CreateManyToolsForm(NewForm):
             self.fields['service_interval'].initial = self.fields['model'].initial.service_interval
 
     def save(self, force_insert=False, force_update=False, commit=True):
-        zeros = len(self.cleaned_data['start_index']) - 1
         if not self.cleaned_data['price']:
             price = self.cleaned_data['model'].price
             service_interval = self.cleaned_data['model'].service_interval
         else:
             price = self.cleaned_data['price']
             service_interval = self.cleaned_data['service_interval']
-        for n in range(int(self.cleaned_data['start_index']),
-                       self.cleaned_data['end_index']+1):
-            name = (self.cleaned_data['prefix'] + 
-                    self.get_zeros(n, zeros) + str(n))
-            tool = Tool(name = name, 
-                        price = price, 
-                        service_interval = service_interval,
-                        model = self.cleaned_data['model'],
-                        invoice_number = self.cleaned_data['invoice_number'],
-                        secondary_name = self.cleaned_data['secondary_name'],
-                        buy_date = self.cleaned_data['buy_date'],
-                        container = self.cleaned_data['container'])
-            tool.save()
-            event = Event(event_type = "Oprettelse", tool = tool)
-            event.save()
-
-    def get_zeros(self, n, zeros):
-        while n > 9:
-            zeros -= 1
-            n = n / 10
-        out = ""
-        for n in range(zeros):
-            out += "0"
-        return out
+
+        def progress(created, total):
+            logger.info('Created %s of %s tools' % (created, total))
+
+        return Tool.objects.create_range(
+            self.names, self.cleaned_data['model'], 
+            batch_size=self.batch_size, progress=progress,
+            price=price, service_interval=service_interval, 
+            invoice_number=self.cleaned_data['invoice_number'],
+            secondary_name=self.cleaned_data['secondary_name'],
+            buy_date=self.cleaned_data['buy_date'],
+            container=self.cleaned_data['container'])
 
     def clean_start_index(self):
         data = self.cleaned_data['start_index']
@@ -437,12 +429,54 @@ class CreateManyToolsForm(NewForm):
         start_index = cleaned_data.get("start_index")
         end_index = cleaned_data.get("end_index")
 
-        if start_index is not None:
+        if start_index is not None and end_index is not None:
             if int(start_index) > end_index:
                 raise forms.ValidationError('Start-indeks skal være lavere end slut-indeks')
+            if end_index - int(start_index) + 1 > self.range_limit:
+                raise forms.ValidationError(
+                    'Der kan højst oprettes %s værktøj ad gangen' % 
+                    self.range_limit)
+
+            self.names = Tool.objects.range_names(
+                cleaned_data.get('prefix') or '', start_index, end_index)
+            existing = sorted(Tool.objects.existing_names(self.customer, 
+                                                          self.names))
+            if existing:
+                raise forms.ValidationError(
+                    'Der findes allerede værktøj med navnene %s' % 
+                    ', '.join(existing[:10] + (['...'] if existing[10:] else [])))
 
         return cleaned_data
 
+class ImportToolsForm(NewForm):
+    file = forms.FileField(label="Fil", 
+                           help_text="CSV- eller XLSX-fil med kolonnerne Navn, Kategori og Model og eventuelt Pris, Serviceinterval, Bilagsnummer, Sekundært navn, Købsdato, Container og Medarbejder")
+    dry_run = forms.BooleanField(label="Kun kontrol", required=False,
+                                 initial=True,
+                                 help_text="Kontroller filen uden at oprette noget")
+
+    def __init__(self, customer, *args, **kwargs):
+        super(ImportToolsForm, self).__init__(*args, **kwargs)
+        self.customer = customer
+
+    def clean_file(self):
+        data = self.cleaned_data['file']
+        if not data.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError('Filen skal være en CSV- eller XLSX-fil')
+
+        # Reads the header row
+        try:
+            next(read_rows(data, data.name), None)
+        except InvalidImportFile as e:
+            raise forms.ValidationError('%s' % e)
+        return data
+
+    def save(self):
+        data = self.cleaned_data['file']
+        importer = ToolImporter(self.customer)
+        return importer.run(lambda: read_rows(data, data.name),
+                            dry_run=self.cleaned_data['dry_run'])
+
 class ReservationForm(NewModelForm):
     tools = forms.CharField(widget=forms.HiddenInput, required=False)
 
@@ -466,19 +500,11 @@ class ReservationForm(NewModelForm):
         if not self.cleaned_data['tools']:
             return obj_dict
 
-        for tool_id in tool_ids:
-            tool = get_object_or_404(Tool, id = tool_id)
-            response = tool.reserve(employee = self.cleaned_data['employee'],
-                                    construction_site = self.cleaned_data['construction_site'],
-                                    start_date = self.cleaned_data['start_date'],
-                                    end_date = self.cleaned_data['end_date'])
-
-            try:
-                obj_dict[response].append(tool.name)
-            except KeyError:
-                obj_dict[response] = [tool.name]
-
-        return obj_dict
+        cd = self.cleaned_data
+        return Reservation.objects.reserve_tools(tool_ids, cd['employee'],
+                                                 cd['construction_site'],
+                                                 cd['start_date'],
+                                                 cd['end_date'])
 
     def clean(self):
         cleaned_data = super(ReservationForm, self).clean()
@@ -0,0 +1,324 @@
+# -*- coding:utf-8 -*-
+"""
+Import of tools from CSV and XLSX spreadsheets
+
+The file is read row by row, twice: once to validate every row and once to
+write the rows, so only the names seen so far are kept in memory. Names of
+categories, models, containers and employees are looked up in dictionaries
+loaded once per import
+
+"""
+from __future__ import unicode_literals
+
+import csv, datetime, logging
+logger = logging.getLogger(__name__)
+
+from django.db import transaction
+
+from tools.models import Container, Employee, Tool, ToolCategory, ToolModel
+
+# Column headers, lower case, and the fields they are read into
+COLUMNS = {
+    'navn': 'name',
+    'kategori': 'category',
+    'model': 'model',
+    'pris': 'price',
+    'serviceinterval': 'service_interval',
+    'bilagsnummer': 'invoice_number',
+    'sekundært navn': 'secondary_name',
+    'købsdato': 'buy_date',
+    'container': 'container',
+    'medarbejder': 'employee',
+    }
+
+REQUIRED_COLUMNS = ('navn', 'kategori', 'model')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y')
+
+class InvalidImportFile(Exception):
+    pass
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value
+    return ('%s' % value).strip()
+
+def read_csv(fileobj):
+    sample = fileobj.read(4096)
+    fileobj.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=str(';,\t'))
+    except csv.Error:
+        dialect = csv.excel
+
+    for row in csv.reader(fileobj, dialect):
+        yield [cell.decode('utf-8-sig') for cell in row]
+
+def read_xlsx(fileobj):
+    try:
+        import openpyxl
+    except ImportError:
+        raise InvalidImportFile('XLSX-filer kræver openpyxl')
+
+    sheet = openpyxl.load_workbook(fileobj, read_only=True).active
+    for row in sheet.iter_rows():
+        yield [cell.value for cell in row]
+
+def read_rows(fileobj, filename):
+    """
+    Yields the line number and a dictionary of the fields of every row in
+    the file below the header row. Empty rows are skipped
+
+    """
+    fileobj.seek(0)
+    if filename.lower().endswith('.xlsx'):
+        rows = read_xlsx(fileobj)
+    else:
+        rows = read_csv(fileobj)
+
+    try:
+        header = [_text(cell).lower() for cell in next(rows)]
+    except StopIteration:
+        raise InvalidImportFile('Filen er tom')
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise InvalidImportFile('Filen mangler kolonnerne %s' % 
+                                ', '.join(missing))
+
+    fields = [COLUMNS.get(column) for column in header]
+    for line, row in enumerate(rows, 2):
+        values = dict((field, _text(value))
+                      for field, value in zip(fields, row) if field)
+        if any(values.values()):
+            yield line, values
+
+class ImportResult(object):
+    def __init__(self):
+        self.errors = []
+        self.tools = 0
+        self.categories = set()
+        self.models = set()
+        self.written = 0
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+class ToolImporter(object):
+    """
+    Imports the tools of a customer. Categories and models not known yet
+    are created, containers and employees must exist already. The names of
+    new tools must not be used by the customer's existing tools
+
+    """
+    def __init__(self, customer, batch_size=500):
+        self.customer = customer
+        self.batch_size = batch_size
+
+        self.categories = dict(
+            (category.name.lower(), category) for category in
+            ToolCategory.objects.filter(customer=customer))
+        self.models = dict(
+            ((model.category.name.lower(), model.name.lower()), model)
+            for model in ToolModel.objects.filter(
+                category__customer=customer).select_related('category'))
+        self.containers = dict(
+            (name.lower(), pk) for name, pk in Container.objects.filter(
+                customer=customer).values_list('name', 'pk'))
+        self.employees = dict(
+            (name.lower(), pk) for name, pk in Employee.objects.filter(
+                customer=customer).values_list('name', 'pk'))
+        self.existing = set(Tool.objects.filter(
+                model__category__customer=customer).values_list(
+                'name', flat=True).iterator())
+
+    def _integer(self, values, field, label, result, line):
+        value = values.get(field)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            result.error(line, '%s skal være et tal' % label)
+
+    def _date(self, values, result, line):
+        value = values.get('buy_date')
+        if not value:
+            return datetime.date.today()
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(value, date_format).date()
+            except ValueError:
+                pass
+        result.error(line, 'Købsdatoen %s kan ikke læses' % value)
+
+    def parse(self, line, values, result):
+        """
+        Returns the field values of the tool in the row, adding any problems
+        to result
+
+        """
+        errors = len(result.errors)
+        tool = {'name': values.get('name'),
+                'category': values.get('category'),
+                'model': values.get('model'),
+                'secondary_name': values.get('secondary_name') or None}
+
+        for field, column in (('name', 'navn'), ('category', 'kategori'),
+                              ('model', 'model')):
+            if not tool[field]:
+                result.error(line, 'Kolonnen %s er tom' % column)
+
+        tool['price'] = self._integer(values, 'price', 'Prisen', result, line)
+        tool['service_interval'] = self._integer(
+            values, 'service_interval', 'Serviceintervallet', result, line)
+        tool['invoice_number'] = self._integer(
+            values, 'invoice_number', 'Bilagsnummeret', result, line)
+        tool['buy_date'] = self._date(values, result, line)
+
+        tool['container_id'] = None
+        if values.get('container'):
+            tool['container_id'] = self.containers.get(
+                values['container'].lower())
+            if tool['container_id'] is None:
+                result.error(line, 'Containeren %s findes ikke' %
+                             values['container'])
+
+        tool['employee_id'] = None
+        if values.get('employee'):
+            tool['employee_id'] = self.employees.get(
+                values['employee'].lower())
+            if tool['employee_id'] is None:
+                result.error(line, 'Medarbejderen %s findes ikke' %
+                             values['employee'])
+
+        return tool if len(result.errors) == errors else None
+
+    def validate(self, rows):
+        """
+        Reads every row and returns an ImportResult with all the problems
+        found and what would be created
+
+        """
+        result = ImportResult()
+        names = set()
+
+        for line, values in rows:
+            tool = self.parse(line, values, result)
+            if tool is None:
+                continue
+
+            if tool['name'] in self.existing:
+                result.error(line, 'Der findes allerede værktøj med navnet %s'
+                             % tool['name'])
+                continue
+            if tool['name'] in names:
+                result.error(line, 'Navnet %s er brugt flere gange i filen' %
+                             tool['name'])
+                continue
+            names.add(tool['name'])
+
+            category = tool['category'].lower()
+            if category not in self.categories:
+                result.categories.add(category)
+            if (category, tool['model'].lower()) not in self.models:
+                result.models.add((category, tool['model'].lower()))
+            result.tools += 1
+
+        return result
+
+    def get_model(self, tool):
+        """
+        Returns the tool's model, creating it and its category the first
+        time they are used
+
+        """
+        category_key = tool['category'].lower()
+        model_key = (category_key, tool['model'].lower())
+
+        if model_key not in self.models:
+            if category_key not in self.categories:
+                category = ToolCategory(name=tool['category'],
+                                        customer=self.customer)
+                category.save()
+                self.categories[category_key] = category
+
+            model = ToolModel(name=tool['model'],
+                              category=self.categories[category_key])
+            if tool['price'] is not None:
+                model.price = tool['price']
+            if tool['service_interval'] is not None:
+                model.service_interval = tool['service_interval']
+            model.save()
+            self.models[model_key] = model
+
+        return self.models[model_key]
+
+    def write(self, rows, progress=None):
+        """
+        Creates the tools in the rows, which must have been validated,
+        batch_size tools per transaction. Returns the number of tools
+
+        """
+        written = 0
+        batch = []
+        for line, values in rows:
+            batch.append(values)
+            if len(batch) == self.batch_size:
+                written += self._write_batch(batch)
+                batch = []
+                if progress:
+                    progress(written)
+        if batch:
+            written += self._write_batch(batch)
+            if progress:
+                progress(written)
+        return written
+
+    def _write_batch(self, batch):
+        result = ImportResult()
+        tools = []
+        with transaction.commit_on_success():
+            for values in batch:
+                tool = self.parse(None, values, result)
+                model = self.get_model(tool)
+                tools.append(Tool(
+                        name=tool['name'], model=model,
+                        price=(tool['price'] if tool['price'] is not None
+                               else model.price),
+                        service_interval=(
+                            tool['service_interval']
+                            if tool['service_interval'] is not None
+                            else model.service_interval),
+                        invoice_number=tool['invoice_number'],
+                        secondary_name=tool['secondary_name'],
+                        buy_date=tool['buy_date'],
+                        container_id=tool['container_id'],
+                        employee_id=tool['employee_id'],
+                        location=('Udlånt' if tool['employee_id']
+                                  else 'Lager')))
+            Tool.objects.write_created(tools, self.customer.pk)
+        return len(tools)
+
+    def run(self, open_rows, dry_run=False, progress=None):
+        """
+        Validates the rows and, unless there are errors or this is a dry
+        run, writes them. open_rows is called to read the rows, once for
+        each pass. Returns the ImportResult
+
+        """
+        result = self.validate(open_rows())
+        logger.info('Import for %s: %s tools, %s errors' %
+                    (self.customer, result.tools, len(result.errors)))
+
+        if not result.errors and not dry_run:
+            result.written = self.write(open_rows(), progress)
+        return result
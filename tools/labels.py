@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+"""
+QR codes and printable labels for tools
+
+A rendered QR code only depends on the text it encodes, so the PNGs are
+kept on disk under the SHA-1 of that text and never rendered twice. Labels
+for many tools at once are rendered in a process pool, as encoding the PNGs
+is bound by the CPU
+
+"""
+from __future__ import unicode_literals
+
+import base64, hashlib, io, logging, multiprocessing, os, tempfile, zipfile
+logger = logging.getLogger(__name__)
+
+import qrcode
+
+from django.conf import settings
+
+QR_URL = 'http://toolcontrol.dk/tools/%s/qr_action'
+
+# Changing how the codes are rendered must change the version, so cached
+# PNGs of the old kind aren't served anymore
+QR_VERSION = '1'
+
+# Labels rendered in the request itself instead of in the pool
+POOL_THRESHOLD = 50
+
+def qr_cache_dir():
+    return getattr(settings, 'QR_CACHE_DIR',
+                   os.path.join(tempfile.gettempdir(), 'toolcontrol-qr'))
+
+def qr_key(text):
+    return hashlib.sha1(('%s:%s' % (QR_VERSION, text)).encode('utf-8')
+                        ).hexdigest()
+
+def render_qr(text):
+    output = io.BytesIO()
+    qrcode.make(text).save(output, 'PNG')
+    return output.getvalue()
+
+def cached_qr(text, cache_dir=None):
+    """
+    Returns the key and PNG of the QR code for text, rendering and storing
+    it if it isn't in the cache yet
+
+    """
+    key = qr_key(text)
+    path = os.path.join(cache_dir or qr_cache_dir(), key[:2], key + '.png')
+
+    try:
+        with open(path, 'rb') as cached:
+            return key, cached.read()
+    except IOError:
+        pass
+
+    data = render_qr(text)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Write to a temporary file first, so a reader never sees half a PNG
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as output:
+            output.write(data)
+        os.rename(temporary, path)
+    except (IOError, OSError):
+        logger.exception('Could not cache the QR code %s' % key)
+    return key, data
+
+def tool_qr(pk):
+    return cached_qr(QR_URL % pk)
+
+def render_label(args):
+    """
+    Returns the PNG of a label with the tool's QR code above its name.
+    Takes a single tuple of the tool's primary key, its name and the cache
+    directory so it can be mapped over a process pool
+
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    pk, name, cache_dir = args
+    key, data = cached_qr(QR_URL % pk, cache_dir)
+    code = Image.open(io.BytesIO(data)).convert('L')
+
+    try:
+        font = ImageFont.truetype('DejaVuSans-Bold.ttf', 28)
+    except IOError:
+        font = ImageFont.load_default()
+
+    width, height = code.size
+    label = Image.new('L', (width, height + 40), 255)
+    label.paste(code, (0, 0))
+    draw = ImageDraw.Draw(label)
+    text_width = draw.textsize(name, font=font)[0]
+    draw.text(((width - text_width) // 2, height - 5), name, fill=0,
+              font=font)
+
+    output = io.BytesIO()
+    label.save(output, 'PNG')
+    return output.getvalue()
+
+def render_labels(tools):
+    """
+    Returns the label PNGs of the given tools in order. Many labels are
+    rendered in a process pool of QR_LABEL_PROCESSES (by default one per
+    CPU) processes
+
+    """
+    cache_dir = qr_cache_dir()
+    jobs = [(tool.pk, tool.name, cache_dir) for tool in tools]
+
+    processes = getattr(settings, 'QR_LABEL_PROCESSES', None)
+    if len(jobs) < POOL_THRESHOLD or processes == 1:
+        return [render_label(job) for job in jobs]
+
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(render_label, jobs,
+                        chunksize=max(1, len(jobs) // (4 * processes)))
+    finally:
+        pool.close()
+        pool.join()
+
+def labels_zip(tools):
+    """
+    Returns a ZIP file with a label PNG per tool named after the tool
+
+    """
+    output = io.BytesIO()
+    archive = zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED)
+    for tool, png in zip(tools, render_labels(tools)):
+        archive.writestr(('%s-%s.png' % (tool.name, tool.pk)).replace(
+                '/', '_').encode('utf-8'), png)
+    archive.close()
+    return output.getvalue()
+
+def labels_sheet(tools):
+    """
+    Returns the tools with their label PNGs as data URIs, for a printable
+    sheet served in one response
+
+    """
+    return [(tool, 'data:image/png;base64,%s' % base64.b64encode(png))
+            for tool, png in zip(tools, render_labels(tools))]
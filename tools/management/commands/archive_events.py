@@ -0,0 +1,39 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from tools.models import ArchivedEvent
+
+class Command(BaseCommand):
+    args = '<customer_id customer_id ...>'
+    help = ('Moves the closed events older than the given number of days '
+            'of the given customers (or all customers) to the archive')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=365,
+                    help='Archive events started more than this many days ago'),
+        make_option('--batch-size', dest='batch_size', type='int', 
+                    default=1000, help='Events moved per transaction'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help='Only count the events to archive'),
+        )
+
+    def handle(self, *args, **options):
+        before = (datetime.datetime.now() - 
+                  datetime.timedelta(days=options['days']))
+        customers = args or None
+
+        if options['dry_run']:
+            count = ArchivedEvent.objects.archivable(before, customers).count()
+            self.stdout.write('%s events started before %s can be archived' %
+                              (count, before))
+            return
+
+        count = ArchivedEvent.objects.archive(before, customers, 
+                                              options['batch_size'])
+        self.stdout.write('Archived %s events started before %s' % 
+                          (count, before))
@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from customers.models import Customer
+from tools.importer import InvalidImportFile, ToolImporter, read_rows
+
+class Command(BaseCommand):
+    args = '<customer_id> <file>'
+    help = 'Imports the tools in a CSV or XLSX file for a customer'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', 
+                    default=500, help='Tools created per transaction'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help='Only validate the file'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: import_tools %s' % self.args)
+
+        try:
+            customer = Customer.objects.get(pk=args[0])
+        except Customer.DoesNotExist:
+            raise CommandError('Customer %s does not exist' % args[0])
+
+        path = args[1]
+        importer = ToolImporter(customer, options['batch_size'])
+
+        def progress(written):
+            self.stdout.write('Imported %s tools' % written)
+
+        with open(path, 'rb') as fileobj:
+            try:
+                result = importer.run(lambda: read_rows(fileobj, path),
+                                      dry_run=options['dry_run'],
+                                      progress=progress)
+            except InvalidImportFile as e:
+                raise CommandError('%s' % e)
+
+        for line, error in result.errors:
+            self.stderr.write('Line %s: %s' % (line, error))
+
+        self.stdout.write('%s tools, %s new categories, %s new models, '
+                          '%s errors' % (result.tools, len(result.categories),
+                                         len(result.models), 
+                                         len(result.errors)))
+        if result.errors:
+            raise CommandError('Nothing imported')
+        if not options['dry_run']:
+            self.stdout.write('Imported %s tools' % result.written)
@@ -0,0 +1,26 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from tools.models import CustomerDailyActivity
+
+class Command(BaseCommand):
+    args = '<customer_id customer_id ...>'
+    help = ('Rebuilds the daily logins, events and tickets of the given '
+            'customers (or all customers) from the login, event and ticket '
+            'tables')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=30,
+                    help='Number of days back to rebuild'),
+        )
+
+    def handle(self, *args, **options):
+        since = datetime.date.today() - datetime.timedelta(days=options['days'])
+        rows = CustomerDailyActivity.objects.rebuild(since, args or None)
+        self.stdout.write('Rebuilt %s customer days of activity since %s' %
+                          (rows, since))
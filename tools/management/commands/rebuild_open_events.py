@@ -0,0 +1,18 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tools.models import Tool
+
+class Command(BaseCommand):
+    help = 'Points every tool at the event its current location comes from'
+
+    def handle(self, *args, **options):
+        with transaction.commit_on_success():
+            Tool.objects.filter(location='Lager').update(open_event=None)
+            Tool.objects.point_open_events(exclude_location='Lager')
+
+        self.stdout.write('Open events: %s' % Tool.objects.filter(
+                open_event__isnull=False).count())
@@ -0,0 +1,28 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tools.models import Tool, ToolModel, build_search_text
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search text of all tools and tool models'
+
+    def handle(self, *args, **options):
+        with transaction.commit_on_success():
+            tool_models = ToolModel.objects.values_list('pk', 'name',
+                                                        'category__name')
+            for pk, name, category_name in tool_models.iterator():
+                ToolModel.objects.filter(pk=pk).update(
+                    search_text=build_search_text(name, category_name))
+
+            tools = Tool.objects.values_list('pk', 'name', 'secondary_name',
+                                             'invoice_number')
+            for pk, name, secondary_name, invoice_number in tools.iterator():
+                Tool.objects.filter(pk=pk).update(
+                    search_text=build_search_text(name, secondary_name,
+                                                  invoice_number))
+
+        self.stdout.write('Rebuilt search text for %s tool models and %s tools' %
+                          (tool_models.count(), tools.count()))
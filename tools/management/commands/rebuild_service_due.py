@@ -0,0 +1,24 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tools.models import Tool, service_due_date
+
+class Command(BaseCommand):
+    help = 'Recomputes when every tool is due for service'
+
+    def handle(self, *args, **options):
+        tools = Tool.objects.values_list('pk', 'last_service',
+                                         'service_interval')
+        count = 0
+
+        with transaction.commit_on_success():
+            for pk, last_service, service_interval in tools.iterator():
+                Tool.objects.filter(pk=pk).update(
+                    next_service_due=service_due_date(last_service,
+                                                      service_interval))
+                count += 1
+
+        self.stdout.write('Updated %s tools' % count)
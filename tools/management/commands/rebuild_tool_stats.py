@@ -0,0 +1,22 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from customers.models import Customer
+from tools.models import CustomerToolStats, ToolCategory
+
+class Command(BaseCommand):
+    args = '<customer_id customer_id ...>'
+    help = ('Rebuilds the tool statistics and the model and category counters '
+            'of the given customers (or all customers) from scratch')
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.all()
+        if args:
+            customers = customers.filter(pk__in=args)
+
+        for customer in customers:
+            stats = CustomerToolStats.objects.rebuild(customer)
+            ToolCategory.objects.rebuild_counters(customer)
+            self.stdout.write('%s: %s tools' % (customer, stats.tool_count))
@@ -0,0 +1,45 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tools.labels import labels_zip
+from tools.models import Tool
+
+class Command(BaseCommand):
+    args = '<customer_id> <zip file>'
+    help = ('Writes a ZIP file of label PNGs for the given tools of a '
+            'customer, or for all of them')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--ids', dest='ids', default='',
+                    help='Comma separated ids of the tools'),
+        make_option('--prefix', dest='prefix', default='',
+                    help='Name prefix of a range of tools'),
+        make_option('--start-index', dest='start_index',
+                    help='First index of the range, with leading zeros'),
+        make_option('--end-index', dest='end_index', type='int',
+                    help='Last index of the range'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: render_labels %s' % self.args)
+
+        tools = Tool.objects.filter(
+            model__category__customer=args[0]).only('name').order_by('name')
+        if options['ids']:
+            tools = tools.filter(pk__in=options['ids'].split(','))
+        elif options['start_index'] and options['end_index'] is not None:
+            names = set(Tool.objects.range_names(options['prefix'], 
+                                                 options['start_index'],
+                                                 options['end_index']))
+            tools = tools.filter(name__startswith=options['prefix'])
+            tools = [tool for tool in tools if tool.name in names]
+        tools = list(tools)
+
+        with open(args[1], 'wb') as output:
+            output.write(labels_zip(tools))
+        self.stdout.write('Wrote %s labels to %s' % (len(tools), args[1]))
@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from toolcontrol.notifications import Dispatcher
+
+class Command(BaseCommand):
+    help = 'Sends the queued SMS and mails'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=4,
+                    help='Number of threads sending at the same time'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=100,
+                    help='Number of notifications claimed per batch'),
+        make_option('--loop', action='store_true', dest='loop',
+                    default=False,
+                    help='Keep polling the queue instead of exiting when it is empty'),
+        make_option('--interval', dest='interval', type='int', default=10,
+                    help='Seconds between polls when looping'),
+        )
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher(workers=options['workers'],
+                                batch_size=options['batch_size'])
+
+        try:
+            while True:
+                started = time.time()
+                handled = dispatcher.run()
+                if handled:
+                    self.stdout.write('Handled %s notifications in %.2f seconds' %
+                                      (handled, time.time() - started))
+
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            dispatcher.close()
@@ -1,36 +1,76 @@
 # -*- coding:utf-8 -*-
 from __future__ import unicode_literals
 
-import datetime
+import datetime, time
+from optparse import make_option
 
 from django.core.management.base import BaseCommand
 
-from toolcontrol.utils import check_for_service
-from tools.models import Employee, Tool
+from tools.models import Employee, Notification, Reservation
 
 class Command(BaseCommand):
     help = 'Sends an SMS to every employee that has a tool that is reserved'
 
-    def handle(self,*args, **options):
-        # Send SMS to all employees who have tools that are reserved
-        for employee in Employee.objects.all():
-            tools_to_return = []
-        
-            for tool in employee.tool_set.all():
-                now = datetime.datetime.now()
-                future = now + datetime.timedelta(days=3)
-                if tool.is_reserved(now,future):
-                    tools_to_return.append(tool)
-
-            subject = 'Daglig reservationsopdatering'
-            message = 'Daglig reservationsopdatering. Følgende værktøj i din besiddelse er reserveret inden for tre dage:\n'
-
-            for tool in tools_to_return:
-                now = datetime.datetime.now()
-                future = now + datetime.timedelta(days=3)
-                reservation = tool.is_reserved(now,future)[0]
-                if reservation.employee != employee:
-                    message += '%s (reserveret til %s fra %s)\n' % (tool.name, reservation.employee, reservation.start_date.isoformat())
-
-            if tools_to_return:
-                employee.send_message(subject, message)
+    option_list = BaseCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=3,
+                    help='Number of days ahead to look for reservations'),
+        make_option('--customer', dest='customer', type='int',
+                    help='Only handle the customer with this id'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help='Print the messages instead of sending them'),
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        today = datetime.date.today()
+        future = today + datetime.timedelta(days=options['days'])
+
+        # Every reservation in the period of a tool that is loaned out to
+        # an employee, with the earliest reservation of each tool first
+        reservations = (Reservation.objects.overlapping(today, future)
+                        .filter(tool__location='Udlånt',
+                                tool__employee__isnull=False))
+        if options['customer']:
+            reservations = reservations.filter(
+                tool__model__category__customer=options['customer'])
+
+        reservations = reservations.values(
+            'tool', 'tool__name', 'tool__employee', 'employee',
+            'employee__name', 'construction_site__name',
+            'start_date').order_by('tool__employee', 'tool', 'start_date')
+
+        lines = {}
+        seen_tools = set()
+        for reservation in reservations.iterator():
+            if reservation['tool'] in seen_tools:
+                continue
+            seen_tools.add(reservation['tool'])
+
+            holder = reservation['tool__employee']
+            if reservation['employee'] == holder:
+                continue
+
+            lines.setdefault(holder, []).append(
+                '%s (reserveret til %s fra %s)\n' % (
+                    reservation['tool__name'],
+                    (reservation['employee__name'] or 
+                     reservation['construction_site__name']),
+                    reservation['start_date'].isoformat()))
+
+        subject = 'Daglig reservationsopdatering'
+        messages = []
+        for employee in Employee.objects.filter(pk__in=lines.keys()):
+            message = ('Daglig reservationsopdatering. Følgende værktøj i din besiddelse er reserveret inden for %s dage:\n' % options['days'] +
+                       ''.join(lines[employee.pk]))
+
+            if options['dry_run']:
+                self.stdout.write('To %s: %s' % (employee.name, message))
+            messages.append((employee, subject, message))
+
+        if not options['dry_run']:
+            Notification.objects.enqueue_batch(messages)
+
+        self.stdout.write('Found %s reserved tools for %s employees in %.2f seconds' %
+                          (len(seen_tools), len(messages), 
+                           time.time() - started))
@@ -1,55 +1,130 @@
 # -*- coding:utf-8 -*-
 from __future__ import unicode_literals
-from django.core.management.base import BaseCommand
 
-from toolcontrol.utils import check_for_service
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
 
 from customers.models import Customer
 from tools.models import Employee, Tool
 
+# Employees that never receive the daily service update
+EXCLUDED_NAMES = ['Henrik', 'Jacob Møller']
+
 class Command(BaseCommand):
     help = 'Sends a mail to every employee that has a tool that needs service'
 
-    def handle(self,*args, **options):
+    option_list = BaseCommand.option_list + (
+        make_option('--customer', dest='customer', type='int',
+                    help='Only handle the customer with this id'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help='Print the messages instead of sending them'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=2000,
+                    help='Number of tools fetched per query'),
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+
+        customers = Customer.objects.all()
+        if options['customer']:
+            customers = customers.filter(pk=options['customer'])
+        customer_ids = list(customers.values_list('pk', flat=True))
+
+        # Collect the tools to service per customer and per holder in a
+        # single pass over the due tools
+        customer_lines = dict((customer_id, [])
+                              for customer_id in customer_ids)
+        employee_lines = {}
+        tool_count = 0
+
+        for tool in self.due_tools(customer_ids, options['chunk_size']):
+            tool_count += 1
+            customer_lines[tool['model__category__customer']].append(
+                '%s (%s)\n' % (tool['name'], self.get_location(tool)))
+
+            if tool['employee']:
+                employee_lines.setdefault(tool['employee'], []).append(
+                    '%s\n' % tool['name'])
+
+        self.stdout.write('Found %s tools needing service in %.2f seconds' %
+                          (tool_count, time.time() - started))
+
         # First, message the admins of the tools that need service
-        for customer in Customer.objects.all():
-            tools = Tool.objects.filter(model__category__customer=customer)
-            tools_to_service = []
-
-            for tool in tools:
-                if check_for_service(tool):
-                    tools_to_service.append(tool)
-        
-            subject = 'Daglig serviceopdatering'
+        subject = 'Daglig serviceopdatering'
+        admins = (Employee.objects.filter(customer__in=customer_ids,
+                                          is_admin=True)
+                  .exclude(name__in=EXCLUDED_NAMES))
+
+        sent = 0
+        for admin in admins:
             message = 'Daglig serviceopdatering. Følgende værktøj mangler service:\n'
-            
-            if not tools_to_service:
+            lines = customer_lines[admin.customer_id]
+
+            if not lines:
                 message += 'Intet!'
             else:
-                for tool in tools_to_service:
-                    message += '%s (%s)\n'% (tool.name, tool.get_location())
+                message += ''.join(lines)
+
+            self.send(admin, subject, message, options['dry_run'])
+            sent += 1
 
-            for admin in Employee.objects.filter(customer=customer, is_admin=True):
-                if admin.name != 'Henrik' and admin.name != 'Jacob Møller':
-                    admin.send_message(subject, message)
-                
         # Send SMS to all loaners who have tools that need service
-        for employee in Employee.objects.all():
-            tools_to_service = []
-        
-            for tool in employee.tool_set.all():
-                if check_for_service(tool):
-                    tools_to_service.append(tool)
+        loaners = (Employee.objects.filter(pk__in=employee_lines.keys())
+                   .exclude(name__in=EXCLUDED_NAMES))
 
-            subject = 'Daglig serviceopdatering'
-            message = 'Daglig serviceopdatering. Følgende værktøj i din besiddelse mangler service:\n'
+        for employee in loaners:
+            message = ('Daglig serviceopdatering. Følgende værktøj i din besiddelse mangler service:\n' +
+                       ''.join(employee_lines[employee.pk]))
 
-            for tool in tools_to_service:
-                message += '%s\n' % tool.name
+            self.send(employee, subject, message, options['dry_run'])
+            sent += 1
 
-            if (tools_to_service and employee.name != 'Henrik' and 
-                employee.name != 'Jacob Møller'):
-                employee.send_message(subject, message)
+        self.stdout.write('Sent %s messages in %.2f seconds' %
+                          (sent, time.time() - started))
 
+    def due_tools(self, customer_ids, chunk_size):
+        """
+        Yields the tools that need service as dictionaries, fetched in
+        chunks of chunk_size ordered by primary key
 
+        """
+        tools = (Tool.objects.due_for_service()
+                 .filter(model__category__customer__in=customer_ids)
+                 .values('pk', 'name', 'location', 'employee',
+                         'employee__name', 'construction_site__name',
+                         'model__category__customer')
+                 .order_by('pk'))
+
+        last_pk = 0
+        while True:
+            count = 0
+            for tool in tools.filter(pk__gt=last_pk)[:chunk_size].iterator():
+                count += 1
+                last_pk = tool['pk']
+                yield tool
+
+            if count < chunk_size:
+                return
+
+    def get_location(self, tool):
+        # Same as Tool.get_location, but for the values fetched above
+        if tool['location'] == 'Udlånt':
+            if tool['employee__name'] and tool['construction_site__name']:
+                return '%s/%s' % (tool['employee__name'],
+                                  tool['construction_site__name'])
+            elif tool['employee__name']:
+                return tool['employee__name']
+            else:
+                return tool['construction_site__name']
+        else:
+            return tool['location']
 
+    def send(self, employee, subject, message, dry_run):
+        if dry_run:
+            self.stdout.write('To %s: %s' % (employee.name, message))
+        else:
+            employee.send_message(subject, message)
@@ -1,23 +1,26 @@
 # -*- coding:utf-8 -*-
 from __future__ import unicode_literals
 
-import datetime, re, urllib
-from itertools import chain
+import datetime
+import os
+from collections import defaultdict
 
 import logging
 logger = logging.getLogger(__name__)
 
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser
-from django.core.mail import send_mail
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models, transaction
+from django.db import router
+from django.db.models import Count, F, Q
 from django.db.models import Sum
-from django.db.models.signals import pre_delete
+from django.db.models.sql import DeleteQuery
+from django.db.models.signals import post_save, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from toolcontrol.enums import MESSAGES
-from customers.models import Customer
+from customers.models import Customer, MetricBucket, add_to_counters
 
 class ConstructionSite(models.Model):
     verbose_name = 'building_site'
@@ -87,15 +90,21 @@ class Container(models.Model):
            return MESSAGES.CONTAINER_LOAN_RIGHTS
 
         if self.location == None:
-            container_loan = ContainerLoan(container=self,
-                                           construction_site=construction_site)
-            container_loan.save()
-
-            for tool in self.tool_set.filter(location='Lager'):
-                tool.loan(construction_site=construction_site)
-
-            self.location = construction_site
-            self.save()
+            with transaction.commit_on_success():
+                container_loan = ContainerLoan(container=self,
+                                               construction_site=construction_site)
+                container_loan.save()
+
+                tools = list(self.tool_set.filter(location='Lager').only(
+                        'name', 'location'))
+                obj_dict, loaned_tools = Tool.objects._partition_loans(
+                    tools, None, construction_site)
+                if loaned_tools:
+                    Tool.objects._write_loans(loaned_tools, None, 
+                                              construction_site)
+
+                self.location = construction_site
+                self.save()
 
             return MESSAGES.CONTAINER_LOAN_SUCCESS
         else:
@@ -106,15 +115,27 @@ class Container(models.Model):
            return MESSAGES.CONTAINER_RETURN_RIGHTS
 
         if self.location != None:
-            container_loan = self.containerloan_set.filter(end_date__isnull=True)[0]
-            container_loan.end_date = datetime.datetime.now()
-            container_loan.save()
-
-            for tool in self.tool_set.filter(construction_site=self.location):
-                tool.end_loan()
-
-            self.location = None
-            self.save()
+            now = datetime.datetime.now()
+
+            with transaction.commit_on_success():
+                self.containerloan_set.filter(end_date__isnull=True).update(
+                    end_date=now)
+
+                tool_ids = list(self.tool_set.filter(
+                        location='Udlånt', 
+                        construction_site=self.location).values_list(
+                        'pk', flat=True))
+                if tool_ids:
+                    returned = Event.objects.filter(
+                        tool__in=tool_ids, event_type='Udlån',
+                        end_date__isnull=True).update(end_date=now)
+                    Tool.objects.filter(pk__in=tool_ids).update(
+                        location='Lager', employee=None, 
+                        construction_site=None, open_event=None)
+                    MetricBucket.objects.add('returns', returned)
+
+                self.location = None
+                self.save()
 
             return MESSAGES.CONTAINER_RETURN_SUCCESS
         else:
@@ -173,10 +194,9 @@ class Employee(AbstractBaseUser):
     USERNAME_FIELD = 'name'
 
     def send_message(self, subject, message):
-        if self.receive_sms:
-            self.send_sms(message)
-        if self.receive_mail:
-            self.send_mail(subject, message)
+        Notification.objects.enqueue(self, subject, message, 
+                                     sms=self.receive_sms, 
+                                     mail=self.receive_mail)
 
     def mark_login(self):
         login = Login(employee=self)
@@ -249,60 +269,193 @@ class Employee(AbstractBaseUser):
         return MESSAGES.EMPLOYEE_REMOVE_LOAN_FLAG_SUCCESS
 
     def send_mail(self, subject, message):
-        logger.debug('Sending mail to %s with content %s' % (self.name, message))
-        if self.email:
-            try:
-                send_mail(subject, message, 'ToolControl <kontakt@toolcontrol.dk>', 
-                          [self.email])
-                logger.debug('Mail successfully sent')
-            except Exception, e:
-                logger.error('Mail not sent: %s' % e)
-        else:
-            logger.debug('Mail not sent, user has no email')
+        Notification.objects.enqueue(self, subject, message, sms=False)
 
     def send_sms(self, message):
-        logger.debug('Sending SMS to %s with content %s' % (self.name, message))
-        if self.phone_number:
-            params = urllib.urlencode({'username': 'hromby', 
-                                       'password': 'IRMLVJ',
-                                       'recipient': self.phone_number,
-                                       'message': message.encode('utf-8'),
-                                       'utf8': 1,
-                                       'from': 'ToolControl',})
-
-            f = urllib.urlopen("http://cpsms.dk/sms?%s" % params)
-            content = f.read()
-            pattern = re.compile("<(?P<status>.+?)>(?P<message>.+?)</.+?>")
-            match = pattern.search(content)
-            
-            if match.group('status') == 'succes':
-                logger.debug('SMS gateway returned "%s: %s"' % (match.group('status'),
-                                                                match.group('message')))
-                if self.customer:
-                    self.customer.sms_sent += 1
-                    self.customer.save()
-            else:
-                logger.error('SMS gateway returned "%s: %s"' % (match.group('status'),
-                                                                match.group('message')))
-
-            return match.group('status'), match.group('message')
-        else:
-            logger.debug('SMS not sent, user has no phone number')
+        Notification.objects.enqueue(self, '', message, mail=False)
 
     def get_finished_loans(self):
-        return self.event_set.filter(end_date=None)
+        return self.event_set.filter(end_date__isnull=True)
+
+class NotificationManager(models.Manager):
+    def enqueue(self, employee, subject, message, sms=True, mail=True):
+        """
+        Queues an SMS and/or a mail for the employee. Nothing is sent until
+        the send_notifications command drains the queue
+
+        """
+        return self.enqueue_many([employee], subject, message, sms, mail)
+
+    def enqueue_many(self, employees, subject, message, sms=True, mail=True):
+        """
+        Queues the same message for several employees with one INSERT,
+        respecting each employee's choice of communication
+
+        """
+        return self.enqueue_batch([(employee, subject, message) 
+                                   for employee in employees], sms, mail)
+
+    def enqueue_batch(self, messages, sms=True, mail=True):
+        """
+        Queues a list of (employee, subject, message) tuples with one
+        INSERT, respecting each employee's choice of communication
+
+        """
+        notifications = []
+
+        for employee, subject, message in messages:
+            common = {'employee': employee if employee.pk else None,
+                      'customer_id': employee.customer_id,
+                      'subject': subject,
+                      'message': message}
+
+            if sms and employee.receive_sms:
+                if employee.phone_number:
+                    notifications.append(Notification(
+                            channel='SMS', recipient=employee.phone_number,
+                            **common))
+                else:
+                    logger.debug('SMS not queued, %s has no phone number' % 
+                                 employee.name)
+
+            if mail and employee.receive_mail:
+                if employee.email:
+                    notifications.append(Notification(
+                            channel='Mail', recipient=employee.email,
+                            **common))
+                else:
+                    logger.debug('Mail not queued, %s has no email' % 
+                                 employee.name)
+
+        if notifications:
+            self.bulk_create(notifications)
+            logger.debug('%s notifications queued' % len(notifications))
+
+        return len(notifications)
+
+    def claim(self, batch_size, lease=datetime.timedelta(minutes=5)):
+        """
+        Returns up to batch_size notifications that are due for sending and
+        pushes their next attempt forward by the lease, so that other
+        workers skip them while they are being sent
+
+        """
+        now = datetime.datetime.now()
+
+        with transaction.commit_on_success():
+            notifications = list(self.select_for_update().filter(
+                    status='Afventer', next_attempt__lte=now).order_by(
+                    'next_attempt')[:batch_size])
+            if notifications:
+                self.filter(pk__in=[n.pk for n in notifications]).update(
+                    next_attempt=now + lease)
+
+        return notifications
+
+class Notification(models.Model):
+    CHANNEL_CHOICES = (
+        ('SMS', 'SMS'),
+        ('Mail', 'Mail'),
+        )
+    STATUS_CHOICES = (
+        ('Afventer', 'Afventer'),
+        ('Sendt', 'Sendt'),
+        ('Fejlet', 'Fejlet'),
+        )
+
+    employee = models.ForeignKey(Employee, null=True, blank=True,
+                                 on_delete=models.SET_NULL)
+    customer = models.ForeignKey(Customer, null=True, blank=True)
+    channel = models.CharField(choices=CHANNEL_CHOICES, max_length=10)
+    recipient = models.CharField(max_length=255)
+    subject = models.CharField(max_length=200, blank=True)
+    message = models.TextField()
+
+    status = models.CharField(choices=STATUS_CHOICES, max_length=20,
+                              default='Afventer')
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=datetime.datetime.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    objects = NotificationManager()
+
+    class Meta:
+        index_together = [['status', 'next_attempt']]
 
 class ForgotPasswordToken(models.Model):
     token = models.CharField(max_length=200)
     user = models.ForeignKey(Employee)
 
+def _select_counters(queryset, **counters):
+    """
+    Selects the given persisted counter columns of the queryset's table
+    under the names of the rollup annotations
+
+    """
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    return queryset.extra(select=dict(
+            (name, '%s.%s' % (table, connection.ops.quote_name(column)))
+            for name, column in counters.items()))
+
+class ToolCategoryManager(models.Manager):
+    def with_rollups(self, counters=False):
+        """
+        Returns the categories with the number of models and tools and the
+        total tool price computed in the same query. With counters, the
+        persisted counters are read instead of grouping the tools
+
+        """
+        if counters:
+            return _select_counters(self.all(), 
+                                    rollup_model_count='model_count',
+                                    rollup_tool_count='tool_count',
+                                    rollup_total_price='tool_price_sum')
+
+        return self.annotate(rollup_model_count=Count('toolmodel', 
+                                                      distinct=True),
+                             rollup_tool_count=Count('toolmodel__tool'),
+                             rollup_total_price=Sum('toolmodel__tool__price'))
+
+    def rebuild_counters(self, customer):
+        """
+        Recomputes the persisted counters of the customer's models and
+        categories from the tool table
+
+        """
+        with transaction.commit_on_success():
+            tool_models = ToolModel.objects.with_rollups().filter(
+                category__customer=customer)
+            for tool_model in tool_models:
+                ToolModel.objects.filter(pk=tool_model.pk).update(
+                    tool_count=tool_model.number_of_tools(),
+                    tool_price_sum=tool_model.total_price())
+
+            for category in self.with_rollups().filter(customer=customer):
+                self.filter(pk=category.pk).update(
+                    model_count=category.number_of_models(),
+                    tool_count=category.number_of_tools(),
+                    tool_price_sum=category.total_price())
+
 class ToolCategory(models.Model):
     verbose_name = 'category'
 
     name = models.CharField('Navn', max_length=200)
     customer = models.ForeignKey(Customer, verbose_name='Kunde')
 
+    # Persisted rollups, kept current by the signal handlers at the bottom
+    # of this module and read by with_rollups(counters=True)
+    model_count = models.IntegerField(default=0, editable=False)
+    tool_count = models.IntegerField(default=0, editable=False)
+    tool_price_sum = models.BigIntegerField(default=0, editable=False)
+
+    objects = ToolCategoryManager()
+
     def total_price(self):
+        if hasattr(self, 'rollup_total_price'):
+            return self.rollup_total_price or 0
+
         price = Tool.objects.filter(model__category=self).aggregate(Sum('price'))
         if price['price__sum'] is None:
             return 0
@@ -310,14 +463,36 @@ class ToolCategory(models.Model):
             return price['price__sum']
 
     def number_of_models(self):
+        if hasattr(self, 'rollup_model_count'):
+            return self.rollup_model_count
+
         return ToolModel.objects.filter(category=self).count()
 
     def number_of_tools(self):
+        if hasattr(self, 'rollup_tool_count'):
+            return self.rollup_tool_count
+
         return Tool.objects.filter(model__category=self).count()
 
     def __unicode__(self):
         return self.name
 
+class ToolModelManager(models.Manager):
+    def with_rollups(self, counters=False):
+        """
+        Returns the models with the number of tools and the total tool price
+        computed in the same query. With counters, the persisted counters
+        are read instead of grouping the tools
+
+        """
+        if counters:
+            return _select_counters(self.all(),
+                                    rollup_tool_count='tool_count',
+                                    rollup_total_price='tool_price_sum')
+
+        return self.annotate(rollup_tool_count=Count('tool'),
+                             rollup_total_price=Sum('tool__price'))
+
 class ToolModel(models.Model):
     verbose_name = 'model'
 
@@ -326,7 +501,19 @@ class ToolModel(models.Model):
     service_interval = models.IntegerField('Serviceinterval', default=6)
     price = models.IntegerField('Pris', default=0)
 
+    # Lower case model and category name, see build_search_text
+    search_text = models.TextField(blank=True, editable=False)
+
+    # Persisted rollups, see ToolCategory
+    tool_count = models.IntegerField(default=0, editable=False)
+    tool_price_sum = models.BigIntegerField(default=0, editable=False)
+
+    objects = ToolModelManager()
+
     def total_price(self):
+        if hasattr(self, 'rollup_total_price'):
+            return self.rollup_total_price or 0
+
         price = Tool.objects.filter(model=self).aggregate(Sum('price'))
         if price['price__sum'] is None:
             return 0
@@ -334,11 +521,485 @@ class ToolModel(models.Model):
             return price['price__sum']
 
     def number_of_tools(self):
+        if hasattr(self, 'rollup_tool_count'):
+            return self.rollup_tool_count
+
         return Tool.objects.filter(model=self).count()
 
     def __unicode__(self):
         return self.name
 
+def build_search_text(*values):
+    """
+    Joins the given values into the lower case text searched by the tool
+    list. Holders and construction sites are not part of it, as they change
+    with every loan; they are matched through their own tables instead
+
+    """
+    return ' '.join('%s' % value for value in values
+                    if value not in (None, '')).lower()
+
+def service_due_date(last_service, service_interval):
+    """
+    Returns when a tool serviced at last_service is due for service again,
+    or None if it is never serviced. The service interval is in months and
+    the tool is due when 90 % of it has passed
+
+    """
+    if not service_interval or last_service is None:
+        return None
+    return last_service + datetime.timedelta(days=service_interval*30*0.9)
+
+# Events that stay open while the tool is away from store. A tool's
+# open_event is the one its current location comes from
+OPEN_EVENT_TYPES = ('Udlån', 'Reparation', 'Kasseret', 'Bortkommet')
+
+# Response for loaning a tool that is not at store, keyed by its location
+LOAN_LOCATION_MESSAGES = {
+    'Udlånt': MESSAGES.TOOL_LOAN_LOAN,
+    'Kasseret': MESSAGES.TOOL_LOAN_SCRAPPED,
+    'Bortkommet': MESSAGES.TOOL_LOAN_LOST,
+    'Reparation': MESSAGES.TOOL_LOAN_REPAIR,
+}
+
+# Tool actions applied by ToolManager.bulk_transition: the event written,
+# the location the tool moves to, the response when the user isn't an
+# administrator, and the response per current location. Only tools at
+# a location answered with the success response are moved
+TOOL_TRANSITIONS = {
+    'service': {
+        'event_type': 'Service', 'location': 'Lager',
+        'rights': MESSAGES.TOOL_SERVICE_RIGHTS,
+        'messages': {'Lager': MESSAGES.TOOL_SERVICE_SUCCESS,
+                     'Udlånt': MESSAGES.TOOL_SERVICE_LOAN,
+                     'Kasseret': MESSAGES.TOOL_SERVICE_SCRAPPED,
+                     'Bortkommet': MESSAGES.TOOL_SERVICE_LOST,
+                     'Reparation': MESSAGES.TOOL_SERVICE_REPAIR}},
+    'repair': {
+        'event_type': 'Reparation', 'location': 'Reparation',
+        'rights': MESSAGES.TOOL_REPAIR_RIGHTS,
+        'messages': {'Lager': MESSAGES.TOOL_REPAIR_SUCCESS,
+                     'Udlånt': MESSAGES.TOOL_REPAIR_LOAN,
+                     'Kasseret': MESSAGES.TOOL_REPAIR_SCRAPPED,
+                     'Bortkommet': MESSAGES.TOOL_REPAIR_LOST,
+                     'Reparation': MESSAGES.TOOL_REPAIR_REPAIR}},
+    'scrap': {
+        'event_type': 'Kasseret', 'location': 'Kasseret',
+        'rights': MESSAGES.TOOL_SCRAP_RIGHTS,
+        'messages': {'Lager': MESSAGES.TOOL_SCRAP_SUCCESS,
+                     'Udlånt': MESSAGES.TOOL_SCRAP_LOAN,
+                     'Kasseret': MESSAGES.TOOL_SCRAP_SCRAPPED,
+                     'Bortkommet': MESSAGES.TOOL_SCRAP_LOST,
+                     'Reparation': MESSAGES.TOOL_SCRAP_REPAIR}},
+    'lost': {
+        'event_type': 'Bortkommet', 'location': 'Bortkommet',
+        'rights': MESSAGES.TOOL_LOST_RIGHTS,
+        'messages': {'Lager': MESSAGES.TOOL_LOST_SUCCESS,
+                     'Udlånt': MESSAGES.TOOL_LOST_LOAN,
+                     'Kasseret': MESSAGES.TOOL_LOST_SCRAPPED,
+                     'Bortkommet': MESSAGES.TOOL_LOST_LOST,
+                     'Reparation': MESSAGES.TOOL_LOST_REPAIR}},
+    'end_loan': {
+        'event_type': None, 'location': 'Lager',
+        'rights': MESSAGES.TOOL_RETURN_RIGHTS,
+        'messages': {'Lager': MESSAGES.TOOL_RETURN_STORE,
+                     'Udlånt': MESSAGES.TOOL_RETURN_SUCCESS,
+                     'Kasseret': MESSAGES.TOOL_RETURN_SCRAPPED,
+                     'Bortkommet': MESSAGES.TOOL_RETURN_LOST,
+                     'Reparation': MESSAGES.TOOL_RETURN_SUCCESS}},
+}
+
+class ToolManager(models.Manager):
+    def bulk_transition(self, action, tool_ids, user):
+        """
+        Applies one of the TOOL_TRANSITIONS to every tool in tool_ids with
+        the same rules as the Tool method of that name. The tools moved are
+        written with one UPDATE and one bulk insert of events in a single
+        transaction. Returns a dictionary mapping each MESSAGES code to the
+        names of the tools it applies to, in the order the ids were given
+
+        """
+        transition = TOOL_TRANSITIONS[action]
+        tools = self.in_bulk(tool_ids)
+        tools = [tools[int(tool_id)] for tool_id in tool_ids
+                 if int(tool_id) in tools]
+        success = transition['messages']['Lager']
+        if action == 'end_loan':
+            success = MESSAGES.TOOL_RETURN_SUCCESS
+
+        obj_dict = {}
+        moved = []
+        for tool in tools:
+            if not user.is_admin and (action != 'end_loan' or
+                                      tool.employee_id != user.pk):
+                response = transition['rights']
+            else:
+                response = transition['messages'].get(tool.location, False)
+            obj_dict.setdefault(response, []).append(tool.name)
+            if response == success:
+                moved.append(tool)
+
+        if moved:
+            # The tools may belong to several customers, whose stats and
+            # activity are each updated with their own tools
+            customers = dict(self.filter(pk__in=[tool.pk for tool in moved])
+                             .values_list('pk', 'model__category__customer'))
+            with transaction.commit_on_success():
+                getattr(self, '_write_%s' % action, 
+                        self._write_transition)(transition, moved, customers)
+
+        return obj_dict
+
+    def _write_transition(self, transition, tools, customers):
+        """
+        Moves the tools at store to the transition's location with an open
+        event each. Must be called inside a transaction
+
+        """
+        ids = [tool.pk for tool in tools]
+        values = {'location': transition['location']}
+        if transition['location'] in ('Kasseret', 'Bortkommet'):
+            values['end_date'] = datetime.date.today()
+        self.filter(pk__in=ids).update(**values)
+        self._write_events(transition['event_type'], tools, customers)
+        self.point_open_events(ids)
+
+        # The stats only depend on the location for scrapped and lost tools
+        if 'end_date' in values:
+            deltas = defaultdict(lambda: defaultdict(int))
+            for tool in tools:
+                before = tool_stats_contribution(tool.location, tool.price,
+                                                 tool.buy_date, tool.end_date)
+                after = tool_stats_contribution(values['location'], 
+                                                tool.price, tool.buy_date,
+                                                values['end_date'])
+                for field in after:
+                    deltas[customers[tool.pk]][field] += (after[field] - 
+                                                          before[field])
+            for customer_id, customer_deltas in deltas.items():
+                CustomerToolStats.objects.apply_delta(customer_id, 
+                                                      **customer_deltas)
+
+    def _write_service(self, transition, tools, customers):
+        """
+        Writes a service event for each tool and sets its last service,
+        with one UPDATE per service interval. Must be called inside a
+        transaction
+
+        """
+        now = timezone.now()
+        intervals = {}
+        for tool in tools:
+            intervals.setdefault(tool.service_interval, []).append(tool.pk)
+        for service_interval, ids in intervals.items():
+            self.filter(pk__in=ids).update(
+                last_service=now, 
+                next_service_due=service_due_date(now, service_interval))
+        self._write_events('Service', tools, customers)
+
+    def _write_end_loan(self, transition, tools, customers):
+        """
+        Ends the open events of the tools and moves them back to store.
+        Must be called inside a transaction
+
+        """
+        ids = [tool.pk for tool in tools]
+        returned = Event.objects.filter(
+            tool__in=ids, event_type__in=OPEN_EVENT_TYPES,
+            end_date__isnull=True).update(end_date=datetime.datetime.now())
+        self.filter(pk__in=ids).update(location='Lager', employee=None, 
+                                       construction_site=None, 
+                                       open_event=None)
+        MetricBucket.objects.add('returns', returned)
+
+    def _write_events(self, event_type, tools, customers):
+        Event.objects.bulk_create([
+                Event(event_type=event_type, tool_id=tool.pk)
+                for tool in tools])
+
+        # bulk_create doesn't send post_save, so count the events here
+        events = defaultdict(int)
+        for tool in tools:
+            events[customers[tool.pk]] += 1
+        for customer_id, count in events.items():
+            CustomerDailyActivity.objects.record(customer_id, events=count)
+        MetricBucket.objects.add('event:%s' % event_type, len(tools))
+
+    def bulk_loan(self, tool_ids, employee=None, construction_site=None):
+        """
+        Loans out every tool in tool_ids in a constant number of queries,
+        following the same rules as Tool.loan. Returns a dictionary mapping
+        each MESSAGES code to the names of the tools it applies to, in the
+        order the ids were given
+
+        """
+        tools = self.in_bulk(tool_ids)
+        ordered_tools = [tools[int(tool_id)] for tool_id in tool_ids
+                         if int(tool_id) in tools]
+
+        obj_dict, loaned_tools = self._partition_loans(ordered_tools, 
+                                                       employee, 
+                                                       construction_site)
+
+        if loaned_tools:
+            with transaction.commit_on_success():
+                self._write_loans(loaned_tools, employee, construction_site)
+
+        return obj_dict
+
+    def search(self, customer, search):
+        """
+        Returns the customer's tools matching the search term on name,
+        secondary name, invoice number, model, category, holder,
+        construction site or location. The related tables are only
+        searched in their own small, per-customer lists, so the tool table
+        is scanned through its search_text column alone
+
+        """
+        tools = self.filter(model__category__customer=customer)
+        if not search:
+            return tools
+
+        term = search.lower()
+        tool_models = ToolModel.objects.filter(category__customer=customer,
+                                               search_text__contains=term)
+        employees = Employee.objects.filter(customer=customer,
+                                            name__icontains=search)
+        construction_sites = ConstructionSite.objects.filter(
+            customer=customer, name__icontains=search)
+
+        return tools.filter(Q(search_text__contains=term) |
+                            Q(model__in=tool_models.values('pk')) |
+                            Q(employee__in=employees.values('pk')) |
+                            Q(construction_site__in=
+                              construction_sites.values('pk')) |
+                            Q(location__iexact=search))
+
+    def due_for_service(self, now=None):
+        """
+        Returns the tools due for service, see service_due_date
+
+        """
+        if now is None:
+            now = timezone.now()
+
+        return self.filter(next_service_due__lt=now)
+
+    def point_open_events(self, tool_ids=None, exclude_location=None):
+        """
+        Points open_event of the given tools (or all tools) at their open
+        event, the newest unended event of a type in OPEN_EVENT_TYPES, in
+        a single UPDATE. Tools at exclude_location are left alone. Used
+        after events are created without saving the tools one at a time
+
+        """
+        qn = connection.ops.quote_name
+        tool_table = qn(self.model._meta.db_table)
+        event_table = qn(Event._meta.db_table)
+
+        sql = ('UPDATE %(tool)s SET %(open_event)s = ('
+               'SELECT %(event)s.%(id)s FROM %(event)s '
+               'WHERE %(event)s.%(tool_id)s = %(tool)s.%(id)s '
+               'AND %(event)s.%(end_date)s IS NULL '
+               'AND %(event)s.%(event_type)s IN (%(types)s) '
+               'ORDER BY %(event)s.%(start_date)s DESC, %(event)s.%(id)s DESC '
+               'LIMIT 1)' % {
+                'tool': tool_table, 'event': event_table, 
+                'open_event': qn('open_event_id'), 'id': qn('id'),
+                'tool_id': qn('tool_id'), 'end_date': qn('end_date'),
+                'event_type': qn('event_type'), 
+                'start_date': qn('start_date'),
+                'types': ', '.join(['%s'] * len(OPEN_EVENT_TYPES))})
+        params = list(OPEN_EVENT_TYPES)
+        conditions = []
+
+        if tool_ids is not None:
+            if not tool_ids:
+                return
+            conditions.append('%s IN (%s)' % (
+                    qn('id'), ', '.join(['%s'] * len(tool_ids))))
+            params.extend(tool_ids)
+
+        if exclude_location is not None:
+            conditions.append('%s <> %%s' % qn('location'))
+            params.append(exclude_location)
+
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        connection.cursor().execute(sql, params)
+        transaction.commit_unless_managed()
+
+    def _partition_loans(self, tools, employee, construction_site):
+        """
+        Decides the loan response for every tool in tools with a single
+        query for reservations. Returns the response dictionary and the list
+        of tools that may be loaned out
+
+        """
+        obj_dict = {}
+        loaned_tools = []
+
+        if not(employee or construction_site):
+            for tool in tools:
+                obj_dict.setdefault(MESSAGES.TOOL_LOAN_FAILURE,
+                                    []).append(tool.name)
+            return obj_dict, loaned_tools
+
+        reservations = Reservation.objects.reserved_tools(
+            [tool.pk for tool in tools], datetime.date.today())
+
+        for tool in tools:
+            # Only the earliest current reservation for each tool matters
+            reservation = reservations.get(tool.pk, [None])[0]
+
+            if reservation and (
+                (employee and employee.pk != reservation.employee_id) or
+                (construction_site and 
+                 construction_site.pk != reservation.construction_site_id)):
+                response = MESSAGES.TOOL_LOAN_RESERVED
+            elif tool.location == 'Lager':
+                response = MESSAGES.TOOL_LOAN_SUCCESS
+                loaned_tools.append(tool)
+            else:
+                response = LOAN_LOCATION_MESSAGES.get(tool.location, False)
+
+            obj_dict.setdefault(response, []).append(tool.name)
+
+        return obj_dict, loaned_tools
+
+    def _write_loans(self, tools, employee, construction_site):
+        """
+        Writes the loan events and moves the tools out of store. Must be
+        called inside a transaction
+
+        """
+        Event.objects.bulk_create([
+                Event(event_type='Udlån', tool=tool, employee=employee, 
+                      construction_site=construction_site)
+                for tool in tools])
+        self.filter(pk__in=[tool.pk for tool in tools]).update(
+            location='Udlånt', employee=employee, 
+            construction_site=construction_site)
+        self.point_open_events([tool.pk for tool in tools])
+
+        # bulk_create doesn't send post_save, so count the events here
+        loaner = employee or construction_site
+        if tools and loaner:
+            CustomerDailyActivity.objects.record(loaner.customer_id, 
+                                                 events=len(tools))
+        MetricBucket.objects.add('event:Udlån', len(tools))
+        MetricBucket.objects.add('loans', len(tools))
+
+    def range_names(self, prefix, start_index, end_index):
+        """
+        Returns the names from prefix + start_index to prefix + end_index.
+        The numbers are padded with zeros to the width of start_index, so
+        '007' to 120 gives 007, 008, ..., 120
+
+        """
+        width = len(start_index)
+        return [prefix + str(n).zfill(width) 
+                for n in xrange(int(start_index), end_index + 1)]
+
+    def existing_names(self, customer, names):
+        """
+        Returns the names in names already used by the customer's tools, 
+        in one query whatever the number of names
+
+        """
+        names = set(names)
+        if not names:
+            return set()
+
+        prefix = os.path.commonprefix(list(names))
+        existing = self.filter(model__category__customer=customer,
+                               name__startswith=prefix).values_list(
+            'name', flat=True)
+        return names.intersection(existing.iterator())
+
+    def create_range(self, names, model, batch_size=500, progress=None, 
+                     **fields):
+        """
+        Creates a tool of model with the given field values and its creation
+        event for every name, batch_size tools at a time in one transaction.
+        progress is called with the number of tools created so far and the
+        total after each batch. Returns the number of created tools
+
+        """
+        customer_id = model.category.customer_id
+
+        with transaction.commit_on_success():
+            for start in range(0, len(names), batch_size):
+                batch = names[start:start + batch_size]
+                self.write_created([Tool(name=name, model=model, **fields)
+                                    for name in batch], customer_id)
+
+                if progress:
+                    progress(start + len(batch), len(names))
+
+        return len(names)
+
+    def write_created(self, tools, customer_id):
+        """
+        Inserts the given new tools of the customer with their creation
+        events, and a loan event for those created as loaned out. As
+        bulk_create doesn't send any signals, this does what the save
+        receivers would have done for every tool and event at once. The
+        names must be new to the customer. Must be called inside a
+        transaction
+
+        """
+        if not tools:
+            return
+
+        now = timezone.now()
+        for tool in tools:
+            tool.last_service = now
+            tool.next_service_due = service_due_date(now, 
+                                                     tool.service_interval)
+            tool.search_text = build_search_text(tool.name, 
+                                                 tool.secondary_name,
+                                                 tool.invoice_number)
+        self.bulk_create(tools)
+
+        # bulk_create doesn't return the primary keys
+        tool_ids = dict(self.filter(
+                model__category__customer=customer_id,
+                name__in=[tool.name for tool in tools]).values_list(
+                'name', 'pk'))
+        events = [Event(event_type='Oprettelse', tool_id=tool_ids[tool.name])
+                  for tool in tools]
+        loans = [Event(event_type='Udlån', tool_id=tool_ids[tool.name],
+                       employee_id=tool.employee_id, 
+                       construction_site_id=tool.construction_site_id)
+                 for tool in tools if tool.location == 'Udlånt']
+        Event.objects.bulk_create(events + loans)
+        if loans:
+            self.point_open_events([event.tool_id for event in loans])
+
+        stats = {}
+        counters = {}
+        for tool in tools:
+            contribution = tool_stats_contribution(tool.location, tool.price,
+                                                   tool.buy_date, 
+                                                   tool.end_date)
+            for field, value in contribution.items():
+                stats[field] = stats.get(field, 0) + value
+            count, price_sum = counters.get(tool.model_id, (0, 0))
+            counters[tool.model_id] = (count + 1, 
+                                       price_sum + (tool.price or 0))
+
+        CustomerToolStats.objects.apply_delta(customer_id, **stats)
+        for model_id, (count, price_sum) in counters.items():
+            apply_tool_counters(model_id, count, price_sum)
+        CustomerDailyActivity.objects.record(customer_id, 
+                                             events=len(events) + len(loans))
+        MetricBucket.objects.add('event:Oprettelse', len(events))
+        if loans:
+            MetricBucket.objects.add('event:Udlån', len(loans))
+            MetricBucket.objects.add('loans', len(loans))
+
 class Tool(models.Model):
     verbose_name = 'tool'
 
@@ -354,6 +1015,13 @@ class Tool(models.Model):
     service_interval = models.IntegerField('Serviceinterval', default=6)
     price = models.IntegerField('Pris', default=0)
     last_service = models.DateTimeField('Seneste service', auto_now_add=True)
+    # The event the tool's current location comes from, see OPEN_EVENT_TYPES
+    open_event = models.ForeignKey('Event', null=True, blank=True,
+                                   editable=False, related_name='+',
+                                   on_delete=models.SET_NULL)
+    # See service_due_date, kept current when the tool is saved
+    next_service_due = models.DateTimeField(null=True, blank=True,
+                                            editable=False, db_index=True)
     location = models.CharField('Placering', choices=LOCATION_CHOICES, 
                                 max_length=20, default="Lager")
 
@@ -371,6 +1039,11 @@ class Tool(models.Model):
     end_date = models.DateField('Ophørsdato',
                                     null=True, blank=True)
 
+    # Lower case name, secondary name and invoice number, see 
+    # build_search_text
+    search_text = models.TextField(blank=True, editable=False)
+
+    objects = ToolManager()
     
     def get_location(self):
         if self.location == 'Udlånt':
@@ -407,11 +1080,13 @@ class Tool(models.Model):
            return MESSAGES.TOOL_SCRAP_RIGHTS
 
         if self.location == 'Lager':
-            event = Event(event_type='Kasseret', tool=self)
-            event.save()
-            self.location = 'Kasseret'
-            self.end_date = datetime.datetime.now()
-            self.save()
+            with transaction.commit_on_success():
+                event = Event(event_type='Kasseret', tool=self)
+                event.save()
+                self.location = 'Kasseret'
+                self.end_date = datetime.datetime.now()
+                self.open_event = event
+                self.save()
             return MESSAGES.TOOL_SCRAP_SUCCESS
         elif self.location == 'Udlånt':
             return MESSAGES.TOOL_SCRAP_LOAN
@@ -429,11 +1104,13 @@ class Tool(models.Model):
            return MESSAGES.TOOL_LOST_RIGHTS
 
         if self.location == 'Lager':
-            event = Event(event_type='Bortkommet', tool=self)
-            event.save()
-            self.location = 'Bortkommet'
-            self.end_date = datetime.datetime.now()
-            self.save()
+            with transaction.commit_on_success():
+                event = Event(event_type='Bortkommet', tool=self)
+                event.save()
+                self.location = 'Bortkommet'
+                self.end_date = datetime.datetime.now()
+                self.open_event = event
+                self.save()
             return MESSAGES.TOOL_LOST_SUCCESS
         elif self.location == 'Udlånt':
             return MESSAGES.TOOL_LOST_LOAN
@@ -452,8 +1129,6 @@ class Tool(models.Model):
 
         reservations = self.is_reserved(datetime.datetime.now())
 
-        print reservations
-
         # Check for reservation
         if reservations:
             reservation = reservations[0]
@@ -467,14 +1142,16 @@ class Tool(models.Model):
                     return MESSAGES.TOOL_LOAN_RESERVED
 
         if self.location == 'Lager':
-            event = Event(event_type='Udlån', tool=self,
-                          employee=employee, 
-                          construction_site=construction_site)
-            event.save()
-            self.location = 'Udlånt'
-            self.employee = employee
-            self.construction_site = construction_site
-            self.save()
+            with transaction.commit_on_success():
+                event = Event(event_type='Udlån', tool=self,
+                              employee=employee, 
+                              construction_site=construction_site)
+                event.save()
+                self.location = 'Udlånt'
+                self.employee = employee
+                self.construction_site = construction_site
+                self.open_event = event
+                self.save()
             return MESSAGES.TOOL_LOAN_SUCCESS
         elif self.location == 'Udlånt':
             return MESSAGES.TOOL_LOAN_LOAN
@@ -492,10 +1169,12 @@ class Tool(models.Model):
            return MESSAGES.TOOL_REPAIR_RIGHTS
 
         if self.location == 'Lager':
-            event = Event(event_type='Reparation', tool=self)
-            event.save()
-            self.location = 'Reparation'
-            self.save()
+            with transaction.commit_on_success():
+                event = Event(event_type='Reparation', tool=self)
+                event.save()
+                self.location = 'Reparation'
+                self.open_event = event
+                self.save()
             return MESSAGES.TOOL_REPAIR_SUCCESS
         elif self.location == 'Udlånt':
             return MESSAGES.TOOL_REPAIR_LOAN
@@ -513,7 +1192,7 @@ class Tool(models.Model):
            return MESSAGES.TOOL_RETURN_RIGHTS
 
         if self.location == 'Udlånt' or self.location == 'Reparation':
-            event = self.get_last_event()
+            event = self.open_event or self.get_last_event()
             event.end()
             return MESSAGES.TOOL_RETURN_SUCCESS
         elif self.location == 'Kasseret':
@@ -525,36 +1204,49 @@ class Tool(models.Model):
         else:
             return False
 
+    def needs_service(self, now=None):
+        if self.next_service_due is None:
+            return False
+        return self.next_service_due < (now or timezone.now())
+
     def get_last_event(self):
         return self.event_set.all().order_by('-start_date')[0]
 
+    def get_last_event_of_type(self, event_type):
+        """
+        Returns the newest event of the given type, looking in the archive
+        when the tool has none left in the event table
+
+        """
+        for events in (self.event_set, self.archivedevent_set):
+            try:
+                return events.filter(event_type=event_type).order_by('-start_date')[0]
+            except IndexError:
+                pass
+        raise IndexError('%s has no %s event' % (self, event_type))
+
     def update_last_service(self):
         logger.info('Updating last service for %s' % self.name)
         try:
-            last_service = self.event_set.filter(event_type='Service').order_by('-start_date')[0]
+            last_service = self.get_last_event_of_type('Service')
             logger.info('Last service is a service event at %s' % last_service.start_date)
         except IndexError:
-            last_service = self.event_set.filter(event_type='Oprettelse').order_by('-start_date')[0]
+            last_service = self.get_last_event_of_type('Oprettelse')
             logger.info('Last service is a creation event at %s' % last_service.start_date)
 
         self.last_service = last_service.start_date
         self.save()
 
     def is_reserved(self, start_date, end_date=None):
-        reservations_1 = self.reservation_set.filter(start_date__lte = start_date, end_date__gte = start_date)
-    
-        if end_date:
-            reservations_2 = self.reservation_set.filter(start_date__lte = end_date, end_date__gte = end_date)
-            reservations_3 = self.reservation_set.filter(start_date__gte = start_date, end_date__lte = end_date)
-            if reservations_1.exists() or reservations_2.exists() or reservations_3.exists():
-                return sorted(chain(reservations_1, reservations_2, reservations_3), key = lambda instance: instance.start_date)
-            else:
-                return False
-        else:
-            if reservations_1.exists():
-                return reservations_1.order_by('start_date')
-            else:
-                return False
+        """
+        Returns the reservations of this tool overlapping the period from
+        start_date to end_date (or just start_date) ordered by start date,
+        or False if there are none
+
+        """
+        reservations = list(self.reservation_set.overlapping(
+                start_date, end_date).order_by('start_date'))
+        return reservations or False
 
     def reserve(self, employee, construction_site, start_date, end_date):
         if self.is_reserved(start_date, end_date):
@@ -590,17 +1282,29 @@ class Event(models.Model):
     start_date = models.DateTimeField(auto_now_add=True)
     end_date = models.DateTimeField(null=True)
 
+    # Open events (end_date IS NULL) have their own partial indexes where
+    # the database supports them, see migration 0017
+    class Meta:
+        index_together = [['tool', 'start_date']]
+
     def end(self):
         if self.end_date:
             return False
-        self.end_date = datetime.datetime.now()
-        self.save()
-        self.tool.location = "Lager"
-        self.tool.employee = None
-        self.tool.construction_site = None
-        self.tool.save()
+
+        with transaction.commit_on_success():
+            self.end_date = datetime.datetime.now()
+            self.save()
+            self.tool.location = "Lager"
+            self.tool.employee = None
+            self.tool.construction_site = None
+            self.tool.open_event = None
+            self.tool.save()
+
+        MetricBucket.objects.add('returns')
         return True
 
+    is_archived = False
+
     def __unicode__(self):
         return "%s -> %s" % (self.tool, self.loaner)
 
@@ -612,10 +1316,183 @@ class Event(models.Model):
         else:
             return self.construction_site
 
+class ArchivedEventManager(models.Manager):
+    def archivable(self, before, customers=None):
+        """
+        Returns the events started before the given time which can no
+        longer change: ended loans and repairs and events without a
+        duration. Events a tool points at as its open event are kept
+
+        """
+        events = (Event.objects.filter(start_date__lt=before)
+                  .filter(Q(end_date__isnull=False) | 
+                          ~Q(event_type__in=OPEN_EVENT_TYPES))
+                  .exclude(pk__in=Tool.objects.filter(open_event__isnull=False)
+                           .values('open_event')))
+        if customers is not None:
+            events = events.filter(tool__model__category__customer__in=customers)
+        return events
+
+    def archive(self, before, customers=None, batch_size=1000):
+        """
+        Moves the archivable events started before the given time to the
+        archive, one transaction per batch. Returns the number of moved
+        events
+
+        """
+        fields = ('id', 'tool', 'tool__model__category__customer', 'employee',
+                  'construction_site', 'event_type', 'start_date', 'end_date')
+        using = router.db_for_write(Event)
+        moved = 0
+
+        while True:
+            with transaction.commit_on_success():
+                rows = list(self.archivable(before, customers)
+                            .order_by('pk').values_list(*fields)[:batch_size])
+                if not rows:
+                    break
+
+                self.bulk_create([
+                        self.model(original_id=pk, tool_id=tool_id, 
+                                   customer_id=customer_id, 
+                                   employee_id=employee_id,
+                                   construction_site_id=construction_site_id,
+                                   event_type=event_type, 
+                                   start_date=start_date, end_date=end_date)
+                        for (pk, tool_id, customer_id, employee_id, 
+                             construction_site_id, event_type, start_date, 
+                             end_date) in rows])
+
+                # Archived events are never open events, so the pre_delete
+                # receiver would have nothing to do for them
+                DeleteQuery(Event).delete_batch([row[0] for row in rows], 
+                                                using)
+            moved += len(rows)
+
+        return moved
+
+class ArchivedEvent(models.Model):
+    """
+    A closed event moved out of the event table by the archive_events
+    command. Read together with the event table by event_history
+
+    """
+    original_id = models.IntegerField()
+    customer = models.ForeignKey(Customer)
+    tool = models.ForeignKey(Tool)
+
+    employee = models.ForeignKey(Employee, null=True)
+    construction_site = models.ForeignKey(ConstructionSite, null=True)
+
+    event_type = models.CharField(choices=Event.EVENT_TYPE_CHOICES, 
+                                  max_length=200)
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField(null=True)
+
+    objects = ArchivedEventManager()
+
+    is_archived = True
+
+    class Meta:
+        index_together = [['tool', 'start_date'], 
+                          ['employee', 'start_date'],
+                          ['construction_site', 'start_date']]
+
+    def get_loan_location(self):
+        if self.employee and self.construction_site:
+            return "%s/%s" % (self.employee, self.construction_site)
+        elif self.employee:
+            return self.employee
+        else:
+            return self.construction_site
+
+def _history_after(model, start_date, archived, pk, descending):
+    """
+    Filter for the rows of model coming after the cursor row in the
+    history order: start date, then archived rows before event rows,
+    then id
+
+    """
+    later = 'lt' if descending else 'gt'
+    if model.is_archived == archived:
+        return (Q(**{'start_date__%s' % later: start_date}) |
+                Q(start_date=start_date, **{'pk__%s' % later: pk}))
+    # Ties on the start date go to the archive first when ascending and
+    # to the event table first when descending
+    if model.is_archived == descending:
+        return Q(**{'start_date__%se' % later: start_date})
+    return Q(**{'start_date__%s' % later: start_date})
+
+def event_history(limit, after=None, descending=True, related=(), **filters):
+    """
+    Returns up to limit events matching the filters from the event table
+    and the archive, ordered by start date, and a cursor for the next page
+    or None. The cursor is the last row's 'a<id>' for archived rows and
+    'e<id>' for event rows
+
+    """
+    sources = []
+    for model in (Event, ArchivedEvent):
+        queryset = model.objects.filter(**filters).select_related(*related)
+        sources.append(queryset)
+
+    if after:
+        model = ArchivedEvent if after[0] == 'a' else Event
+        pk = int(after[1:])
+        start_date = (model.objects.filter(pk=pk)
+                      .values_list('start_date', flat=True))
+        if not start_date:
+            return [], None
+        sources = [source.filter(_history_after(
+                    source.model, start_date[0], model.is_archived, pk,
+                    descending)) for source in sources]
+
+    prefix = '-' if descending else ''
+    rows = []
+    for queryset in sources:
+        rows.extend(queryset.order_by(prefix + 'start_date', prefix + 'pk')
+                    [:limit + 1])
+
+    # Archived rows sort before event rows with the same start date
+    rows.sort(key=lambda row: (row.start_date, not row.is_archived, row.pk),
+              reverse=descending)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = '%s%s' % ('a' if last.is_archived else 'e', last.pk)
+    return rows, next_cursor
+
 class Login(models.Model):
     employee = models.ForeignKey(Employee)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+class TicketManager(models.Manager):
+    def add_occurrences(self, fingerprint, count=1, last_seen=None):
+        """
+        Adds count occurrences to the ticket of the error with the given
+        fingerprint. Returns the number of updated tickets
+
+        """
+        return self.filter(fingerprint=fingerprint, 
+                           duplicate__isnull=True).update(
+            occurrences=F('occurrences') + count, 
+            last_seen=last_seen or datetime.datetime.now())
+
+    def record_error(self, fingerprint, name, description, count=1, 
+                     last_seen=None):
+        """
+        Adds count occurrences of the error with the given fingerprint to
+        its ticket, creating the ticket the first time the error is seen
+
+        """
+        last_seen = last_seen or datetime.datetime.now()
+        if not self.add_occurrences(fingerprint, count, last_seen):
+            self.create(fingerprint=fingerprint, name=name[:200], 
+                        description=description, level='Fejl', 
+                        occurrences=count, last_seen=last_seen)
+
 class Ticket(models.Model):
     LEVEL_CHOICES = (('Fejl', 'Fejl'),
                      ('Forbedring', 'Forbedring'),
@@ -637,6 +1514,19 @@ class Ticket(models.Model):
                                     related_name='tickets_assigned_to', 
                                     null=True, blank=True, default=None,
                                     verbose_name='Tildelt til')
+    # Tickets created before this field was added have no creation time
+    created = models.DateTimeField(auto_now_add=True, null=True)
+
+    # Logged errors are counted on one ticket per fingerprint, see
+    # toolcontrol.handlers.DBLogHandler
+    fingerprint = models.CharField(max_length=40, blank=True, editable=False,
+                                   db_index=True)
+    occurrences = models.IntegerField('Forekomster', default=1, 
+                                      editable=False)
+    last_seen = models.DateTimeField('Senest set', null=True, blank=True,
+                                     editable=False)
+
+    objects = TicketManager()
     
     def is_closed(self):
         return not self.is_open
@@ -654,6 +1544,108 @@ class TicketAnswer(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     
+class ReservationManager(models.Manager):
+    def overlapping(self, start_date, end_date=None):
+        """
+        Returns the reservations overlapping the period from start_date to
+        end_date, both included. Without an end date, the reservations
+        covering start_date are returned
+
+        """
+        if end_date is None:
+            end_date = start_date
+        return self.filter(start_date__lte=end_date, end_date__gte=start_date)
+
+    def reserved_tools(self, tool_ids, start_date, end_date=None):
+        """
+        Answers which of the given tools are reserved in the period with a
+        single query. Returns a dictionary mapping the id of every reserved
+        tool to its overlapping reservations ordered by start date
+
+        """
+        reserved = {}
+        for reservation in self.overlapping(start_date, end_date).filter(
+            tool__in=tool_ids).order_by('start_date'):
+            reserved.setdefault(reservation.tool_id, []).append(reservation)
+        return reserved
+
+    def free_windows(self, tool_ids, start_date, end_date):
+        """
+        Finds the earliest period of the same length as start_date to
+        end_date, starting on or after start_date, in which each tool is
+        free. Returns a dictionary mapping tool ids to (start, end) tuples
+
+        """
+        length = end_date - start_date
+        candidates = dict((tool_id, start_date) for tool_id in tool_ids)
+        found = set()
+
+        for reservation in self.filter(tool__in=tool_ids, 
+                                       end_date__gte=start_date).order_by(
+            'tool', 'start_date'):
+            tool_id = reservation.tool_id
+            if tool_id in found:
+                continue
+
+            if reservation.start_date > candidates[tool_id] + length:
+                found.add(tool_id)
+            else:
+                candidates[tool_id] = max(candidates[tool_id], 
+                                          reservation.end_date + 
+                                          datetime.timedelta(days=1))
+
+        return dict((tool_id, (start, start + length)) 
+                    for tool_id, start in candidates.items())
+
+    def reserve_tools(self, tool_ids, employee, construction_site, 
+                      start_date, end_date):
+        """
+        Reserves every tool in tool_ids for the period if it is free. The
+        tool rows are locked while checking and inserting, so concurrent
+        bookings of the same tools are serialized. Returns a dictionary
+        mapping each MESSAGES code to the names of the tools it applies
+        to. Tools that are already reserved get the nearest free period
+        appended to their name
+
+        """
+        obj_dict = {}
+        reservations = []
+
+        with transaction.commit_on_success():
+            tools = dict((tool.pk, tool) for tool in 
+                         Tool.objects.select_for_update().filter(
+                    pk__in=tool_ids).only('name', 'location'))
+            reserved = self.reserved_tools(tools.keys(), start_date, end_date)
+            windows = self.free_windows(reserved.keys(), start_date, end_date)
+
+            for tool_id in tool_ids:
+                tool = tools.get(int(tool_id))
+                if tool is None:
+                    continue
+
+                name = tool.name
+                if tool.pk in reserved:
+                    response = MESSAGES.TOOL_RESERVE_RESERVED
+                    name = '%s (ledig %s til %s)' % (
+                        tool.name, windows[tool.pk][0].isoformat(),
+                        windows[tool.pk][1].isoformat())
+                elif tool.location == 'Kasseret':
+                    response = MESSAGES.TOOL_RESERVE_SCRAPPED
+                elif tool.location == 'Bortkommet':
+                    response = MESSAGES.TOOL_RESERVE_LOST
+                else:
+                    response = MESSAGES.TOOL_RESERVE_SUCCESS
+                    reservations.append(self.model(
+                            tool=tool, employee=employee,
+                            construction_site=construction_site,
+                            start_date=start_date, end_date=end_date))
+
+                obj_dict.setdefault(response, []).append(name)
+
+            self.bulk_create(reservations)
+
+        return obj_dict
+
 class Reservation(models.Model):
     verbose_name = 'reservation'
     tool = models.ForeignKey(Tool, verbose_name='Værktøj')
@@ -665,6 +1657,11 @@ class Reservation(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
 
+    objects = ReservationManager()
+
+    class Meta:
+        index_together = [['tool', 'start_date', 'end_date']]
+
     def reservees(self):
         if self.employee and self.construction_site:
             return "%s/%s" % (self.employee, self.construction_site)
@@ -673,15 +1670,570 @@ class Reservation(models.Model):
         elif self.construction_site:
             return self.construction_site
 
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+def tool_stats_contribution(location, price, buy_date, end_date):
+    """
+    Returns what a single tool with the given values adds to its customer's
+    CustomerToolStats row
+
+    """
+    buy_date = _as_date(buy_date)
+    end_date = _as_date(end_date)
+
+    contribution = {
+        'tool_count': 1,
+        'tool_price_sum': price or 0,
+        'lost_count': int(location == 'Bortkommet'),
+        'scrapped_count': int(location == 'Kasseret'),
+        'alive_count': 0,
+        'alive_buy_date_sum': 0,
+        'dead_count': 0,
+        'dead_life_days_sum': 0,
+        }
+
+    if end_date is None:
+        contribution['alive_count'] = 1
+        contribution['alive_buy_date_sum'] = buy_date.toordinal()
+    else:
+        contribution['dead_count'] = 1
+        contribution['dead_life_days_sum'] = (end_date - buy_date).days
+
+    return contribution
+
+class CustomerToolStatsManager(models.Manager):
+    def apply_delta(self, customer_id, **deltas):
+        """
+        Adds the given deltas to the customer's stats row in one UPDATE. If
+        the row has not been built yet, nothing happens, as it will be built
+        from scratch when first read
+
+        """
+        deltas = dict((field, delta) for field, delta in deltas.items() 
+                      if delta)
+        if customer_id is None or not deltas:
+            return
+
+        self.filter(customer=customer_id).update(
+            **dict((field, F(field) + delta) 
+                   for field, delta in deltas.items()))
+
+    def rebuild(self, customer):
+        """
+        Recomputes the stats row for a customer from the tool, model and
+        category tables
+
+        """
+        tools = Tool.objects.filter(model__category__customer=customer)
+        values = {}
+
+        totals = tools.aggregate(count=Count('id'), price=Sum('price'))
+        values['tool_count'] = totals['count']
+        values['tool_price_sum'] = totals['price'] or 0
+
+        locations = dict(tools.filter(location__in=['Bortkommet', 'Kasseret'])
+                         .values_list('location').annotate(Count('id')))
+        values['lost_count'] = locations.get('Bortkommet', 0)
+        values['scrapped_count'] = locations.get('Kasseret', 0)
+
+        values['alive_count'] = 0
+        values['alive_buy_date_sum'] = 0
+        for buy_date in tools.filter(end_date__isnull=True).values_list(
+            'buy_date', flat=True).iterator():
+            values['alive_count'] += 1
+            values['alive_buy_date_sum'] += _as_date(buy_date).toordinal()
+
+        values['dead_count'] = 0
+        values['dead_life_days_sum'] = 0
+        for buy_date, end_date in tools.filter(end_date__isnull=False).values_list(
+            'buy_date', 'end_date').iterator():
+            values['dead_count'] += 1
+            values['dead_life_days_sum'] += (_as_date(end_date) - 
+                                             _as_date(buy_date)).days
+
+        models_totals = ToolModel.objects.filter(
+            category__customer=customer).aggregate(count=Count('id'), 
+                                                   price=Sum('price'))
+        values['model_count'] = models_totals['count']
+        values['model_price_sum'] = models_totals['price'] or 0
+        values['category_count'] = ToolCategory.objects.filter(
+            customer=customer).count()
+
+        with transaction.commit_on_success():
+            stats, created = self.get_or_create(customer=customer, 
+                                                defaults=values)
+            if not created:
+                for field, value in values.items():
+                    setattr(stats, field, value)
+                stats.save()
+
+        return stats
+
+    def for_customer(self, customer):
+        try:
+            return self.get(customer=customer)
+        except self.model.DoesNotExist:
+            return self.rebuild(customer)
+
+class CustomerToolStats(models.Model):
+    """
+    Running totals behind the stats page, one row per customer. The row is
+    kept current by the signal handlers below and can be rebuilt with the
+    rebuild_tool_stats command
+
+    """
+    customer = models.OneToOneField(Customer, related_name='tool_stats')
+
+    tool_count = models.IntegerField(default=0)
+    tool_price_sum = models.BigIntegerField(default=0)
+    lost_count = models.IntegerField(default=0)
+    scrapped_count = models.IntegerField(default=0)
+
+    # Sum of buy dates as proleptic ordinals for tools still in use
+    alive_count = models.IntegerField(default=0)
+    alive_buy_date_sum = models.BigIntegerField(default=0)
+
+    # Sum of days between buy date and end date for scrapped and lost tools
+    dead_count = models.IntegerField(default=0)
+    dead_life_days_sum = models.BigIntegerField(default=0)
+
+    model_count = models.IntegerField(default=0)
+    model_price_sum = models.BigIntegerField(default=0)
+    category_count = models.IntegerField(default=0)
+
+    objects = CustomerToolStatsManager()
+
+    def average_age(self):
+        if not self.alive_count:
+            return 0
+        return ((datetime.date.today().toordinal() * self.alive_count - 
+                 self.alive_buy_date_sum) // self.alive_count)
+
+    def average_life(self):
+        if not self.dead_count:
+            return 0
+        return self.dead_life_days_sum // self.dead_count
+
+    def average_tool_price(self):
+        if not self.tool_count:
+            return 0
+        return self.tool_price_sum / float(self.tool_count)
+
+    def average_model_price(self):
+        if not self.model_count:
+            return 0
+        return self.model_price_sum / float(self.model_count)
+
+    def lost_ratio(self):
+        if not (self.lost_count + self.scrapped_count):
+            return 0
+        return (self.lost_count / 
+                float(self.lost_count + self.scrapped_count) * 100)
+
+    def scrapped_ratio(self):
+        if not (self.lost_count + self.scrapped_count):
+            return 0
+        return (self.scrapped_count / 
+                float(self.lost_count + self.scrapped_count) * 100)
+
+@receiver(pre_save, sender=Tool)
+def pre_save_tool_search_text(sender, instance, **kwargs):
+    instance.search_text = build_search_text(instance.name, 
+                                             instance.secondary_name,
+                                             instance.invoice_number)
+
+@receiver(pre_save, sender=Tool)
+def pre_save_tool_service_due(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # last_service is only filled in by auto_now_add after this signal
+    last_service = instance.last_service or timezone.now()
+    instance.next_service_due = service_due_date(last_service,
+                                                 instance.service_interval)
+
+@receiver(pre_save, sender=ToolModel)
+def pre_save_tool_model_search_text(sender, instance, **kwargs):
+    category_name = ToolCategory.objects.filter(
+        pk=instance.category_id).values_list('name', flat=True)[0]
+    instance.search_text = build_search_text(instance.name, category_name)
+
+@receiver(post_save, sender=ToolCategory)
+def post_save_tool_category_search_text(sender, instance, created=False, 
+                                        raw=False, **kwargs):
+    if created or raw:
+        return
+
+    for tool_model in instance.toolmodel_set.only('name'):
+        ToolModel.objects.filter(pk=tool_model.pk).update(
+            search_text=build_search_text(tool_model.name, instance.name))
+
+def _activity_date(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+class CustomerDailyActivityManager(models.Manager):
+    def record(self, customer_id, date=None, **counts):
+        """
+        Adds the given counts of logins, events and tickets to the
+        customer's row for the day, creating the row if needed
+
+        """
+        if customer_id is None:
+            return
+
+        if date is None:
+            date = _activity_date(timezone.now())
+
+        add_to_counters(self, {'customer_id': customer_id, 'date': date},
+                        counts)
+
+    def totals(self, customers, days=30):
+        """
+        Returns the logins, events and tickets of the given customers
+        within the last days as a dictionary keyed by customer id. Customers
+        without any activity get zeros
+
+        """
+        customer_ids = [getattr(customer, 'pk', customer) 
+                        for customer in customers]
+        since = _activity_date(timezone.now()) - datetime.timedelta(days=days)
+
+        totals = dict((customer_id, {'logins': 0, 'events': 0, 'tickets': 0})
+                      for customer_id in customer_ids)
+        rows = (self.filter(customer__in=customer_ids, date__gt=since)
+                .values('customer').annotate(logins=Sum('logins'), 
+                                             events=Sum('events'),
+                                             tickets=Sum('tickets')))
+        for row in rows:
+            totals[row.pop('customer')].update(row)
+
+        return totals
+
+    def rebuild(self, since, customers=None):
+        """
+        Recomputes the rows from the date since from the login, event and
+        ticket tables. Tickets without a creation time are left out
+
+        """
+        logins = Login.objects.filter(
+            timestamp__gte=datetime.datetime.combine(since, datetime.time())
+            ).values_list('employee__customer', 'timestamp')
+        events = Event.objects.filter(
+            start_date__gte=datetime.datetime.combine(since, datetime.time())
+            ).values_list('tool__model__category__customer', 'start_date')
+        archived = ArchivedEvent.objects.filter(
+            start_date__gte=datetime.datetime.combine(since, datetime.time())
+            ).values_list('customer', 'start_date')
+        tickets = Ticket.objects.filter(
+            created__gte=datetime.datetime.combine(since, datetime.time())
+            ).values_list('reported_by', 'created')
+
+        rows = self.filter(date__gte=since)
+        if customers is not None:
+            logins = logins.filter(employee__customer__in=customers)
+            events = events.filter(tool__model__category__customer__in=customers)
+            archived = archived.filter(customer__in=customers)
+            tickets = tickets.filter(reported_by__in=customers)
+            rows = rows.filter(customer__in=customers)
+
+        counts = {}
+        for field, queryset in (('logins', logins), ('events', events),
+                                ('events', archived), ('tickets', tickets)):
+            for customer_id, timestamp in queryset.iterator():
+                if customer_id is None:
+                    continue
+                key = (customer_id, _activity_date(timestamp))
+                row = counts.setdefault(key, {'logins': 0, 'events': 0, 
+                                              'tickets': 0})
+                row[field] += 1
+
+        with transaction.commit_on_success():
+            rows.delete()
+            self.bulk_create([
+                    self.model(customer_id=customer_id, date=date, **counters)
+                    for (customer_id, date), counters in counts.items()])
+
+        return len(counts)
+
+class CustomerDailyActivity(models.Model):
+    """
+    Logins, events and tickets per customer per day, behind the activity
+    shown in the customer list. Counted when the rows are created and
+    rebuilt with the rebuild_daily_activity command
+
+    """
+    customer = models.ForeignKey(Customer, related_name='daily_activity')
+    date = models.DateField()
+
+    logins = models.IntegerField(default=0)
+    events = models.IntegerField(default=0)
+    tickets = models.IntegerField(default=0)
+
+    objects = CustomerDailyActivityManager()
+
+    class Meta:
+        unique_together = (('customer', 'date'),)
+
+@receiver(post_save, sender=Login)
+def post_save_login_activity(sender, instance, created=False, raw=False,
+                             **kwargs):
+    if created and not raw:
+        customer_id = Employee.objects.filter(
+            pk=instance.employee_id).values_list('customer', flat=True)[0]
+        CustomerDailyActivity.objects.record(customer_id, logins=1)
+        MetricBucket.objects.add('logins')
+
+@receiver(post_save, sender=Event)
+def post_save_event_activity(sender, instance, created=False, raw=False,
+                             **kwargs):
+    if created and not raw:
+        customer_id = Tool.objects.filter(pk=instance.tool_id).values_list(
+            'model__category__customer', flat=True)[0]
+        CustomerDailyActivity.objects.record(customer_id, events=1)
+        MetricBucket.objects.add('event:%s' % instance.event_type)
+        if instance.event_type == 'Udlån':
+            MetricBucket.objects.add('loans')
+
+@receiver(post_save, sender=Ticket)
+def post_save_ticket_activity(sender, instance, created=False, raw=False,
+                              **kwargs):
+    if created and not raw:
+        CustomerDailyActivity.objects.record(instance.reported_by_id, 
+                                             tickets=1)
+
+def _tool_customer_id(model_id):
+    try:
+        return ToolModel.objects.filter(pk=model_id).values_list(
+            'category__customer', flat=True)[0]
+    except IndexError:
+        return None
+
+@receiver(pre_save, sender=Tool)
+def pre_save_tool_stats(sender, instance, raw=False, **kwargs):
+    """
+    Remember what the tool contributed to the stats before this save
+
+    """
+    instance._stats_before = None
+    if raw or instance.pk is None:
+        return
+
+    try:
+        old = Tool.objects.filter(pk=instance.pk).values(
+            'location', 'price', 'buy_date', 'end_date', 'model')[0]
+    except IndexError:
+        return
+
+    instance._stats_before = (old['model'], 
+                              tool_stats_contribution(old['location'], 
+                                                      old['price'],
+                                                      old['buy_date'],
+                                                      old['end_date']))
+
+@receiver(post_save, sender=Tool)
+def post_save_tool_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    after = tool_stats_contribution(instance.location, instance.price,
+                                    instance.buy_date, instance.end_date)
+    before = getattr(instance, '_stats_before', None)
+
+    if before and before[0] == instance.model_id:
+        # Only send an UPDATE if something the stats depend on has changed
+        deltas = dict((field, after[field] - before[1][field]) 
+                      for field in after)
+        if any(deltas.values()):
+            CustomerToolStats.objects.apply_delta(
+                _tool_customer_id(instance.model_id), **deltas)
+        return
+
+    if before:
+        CustomerToolStats.objects.apply_delta(
+            _tool_customer_id(before[0]), 
+            **dict((field, -value) for field, value in before[1].items()))
+
+    CustomerToolStats.objects.apply_delta(
+        _tool_customer_id(instance.model_id), **after)
+
+@receiver(pre_delete, sender=Tool)
+def pre_delete_tool_stats(sender, instance, **kwargs):
+    """
+    Subtract what the tool contributes to the stats. A cascading delete
+    sends pre_delete for the tool's events first, and pre_delete_event may
+    have saved the tool at store since the instance was read, so the row
+    is read again
+
+    """
+    try:
+        row = Tool.objects.filter(pk=instance.pk).values_list(
+            'location', 'price', 'buy_date', 'end_date', 'model')[0]
+    except IndexError:
+        row = (instance.location, instance.price, instance.buy_date,
+               instance.end_date, instance.model_id)
+
+    contribution = tool_stats_contribution(*row[:4])
+    CustomerToolStats.objects.apply_delta(
+        _tool_customer_id(row[4]), 
+        **dict((field, -value) for field, value in contribution.items()))
+
+@receiver(pre_save, sender=ToolModel)
+def pre_save_tool_model_stats(sender, instance, raw=False, **kwargs):
+    instance._stats_before = None
+    if raw or instance.pk is None:
+        return
+
+    try:
+        instance._stats_before = ToolModel.objects.filter(
+            pk=instance.pk).values_list('category__customer', 'price',
+                                        'category', 'tool_count',
+                                        'tool_price_sum')[0]
+    except IndexError:
+        return
+
+    # Don't write back counters that have changed since the model was read
+    instance.tool_count, instance.tool_price_sum = instance._stats_before[3:]
+
+@receiver(post_save, sender=ToolModel)
+def post_save_tool_model_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    customer_id = ToolCategory.objects.filter(
+        pk=instance.category_id).values_list('customer', flat=True)[0]
+    before = getattr(instance, '_stats_before', None)
+
+    if before and before[0] == customer_id:
+        CustomerToolStats.objects.apply_delta(
+            customer_id, model_price_sum=instance.price - before[1])
+        return
+
+    if before:
+        CustomerToolStats.objects.apply_delta(before[0], model_count=-1,
+                                              model_price_sum=-before[1])
+    CustomerToolStats.objects.apply_delta(customer_id, model_count=1,
+                                          model_price_sum=instance.price)
+
+@receiver(pre_delete, sender=ToolModel)
+def pre_delete_tool_model_stats(sender, instance, **kwargs):
+    customer_id = ToolCategory.objects.filter(
+        pk=instance.category_id).values_list('customer', flat=True)[0]
+    CustomerToolStats.objects.apply_delta(customer_id, model_count=-1,
+                                          model_price_sum=-instance.price)
+
+@receiver(pre_save, sender=ToolCategory)
+def pre_save_tool_category_counters(sender, instance, raw=False, **kwargs):
+    # Don't write back counters that have changed since the category was read
+    if raw or instance.pk is None:
+        return
+
+    counters = ToolCategory.objects.filter(pk=instance.pk).values(
+        'model_count', 'tool_count', 'tool_price_sum')
+    for values in counters:
+        for field, value in values.items():
+            setattr(instance, field, value)
+
+@receiver(post_save, sender=ToolCategory)
+def post_save_tool_category_stats(sender, instance, created=False, raw=False,
+                                  **kwargs):
+    if created and not raw:
+        CustomerToolStats.objects.apply_delta(instance.customer_id, 
+                                              category_count=1)
+
+@receiver(pre_delete, sender=ToolCategory)
+def pre_delete_tool_category_stats(sender, instance, **kwargs):
+    CustomerToolStats.objects.apply_delta(instance.customer_id, 
+                                          category_count=-1)
+
+def apply_tool_counters(model_id, tool_count, tool_price_sum):
+    """
+    Adds to the persisted counters of a tool model and its category. Code
+    that creates, deletes or moves tools without saving them one at a time
+    must call this itself
+
+    """
+    if model_id is None or not (tool_count or tool_price_sum):
+        return
+
+    ToolModel.objects.filter(pk=model_id).update(
+        tool_count=F('tool_count') + tool_count,
+        tool_price_sum=F('tool_price_sum') + tool_price_sum)
+    ToolCategory.objects.filter(toolmodel=model_id).update(
+        tool_count=F('tool_count') + tool_count,
+        tool_price_sum=F('tool_price_sum') + tool_price_sum)
+
+@receiver(post_save, sender=Tool)
+def post_save_tool_counters(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # pre_save_tool_stats has remembered the model and price before the save
+    before = getattr(instance, '_stats_before', None)
+    price = instance.price or 0
+
+    if before and before[0] == instance.model_id:
+        apply_tool_counters(instance.model_id, 0, 
+                            price - before[1]['tool_price_sum'])
+        return
+
+    if before:
+        apply_tool_counters(before[0], -1, -before[1]['tool_price_sum'])
+    apply_tool_counters(instance.model_id, 1, price)
+
+@receiver(pre_delete, sender=Tool)
+def pre_delete_tool_counters(sender, instance, **kwargs):
+    apply_tool_counters(instance.model_id, -1, -(instance.price or 0))
+
+@receiver(post_save, sender=ToolModel)
+def post_save_tool_model_counters(sender, instance, created=False, raw=False,
+                                  **kwargs):
+    if raw:
+        return
+
+    if created:
+        ToolCategory.objects.filter(pk=instance.category_id).update(
+            model_count=F('model_count') + 1)
+        return
+
+    # Moving a model moves its tools to the new category as well
+    before = getattr(instance, '_stats_before', None)
+    if not before or before[2] == instance.category_id:
+        return
+
+    category, tool_count, tool_price_sum = before[2:]
+    ToolCategory.objects.filter(pk=category).update(
+        model_count=F('model_count') - 1,
+        tool_count=F('tool_count') - tool_count,
+        tool_price_sum=F('tool_price_sum') - tool_price_sum)
+    ToolCategory.objects.filter(pk=instance.category_id).update(
+        model_count=F('model_count') + 1,
+        tool_count=F('tool_count') + tool_count,
+        tool_price_sum=F('tool_price_sum') + tool_price_sum)
+
+@receiver(pre_delete, sender=ToolModel)
+def pre_delete_tool_model_counters(sender, instance, **kwargs):
+    # The tools deleted along with the model are subtracted from the
+    # category by their own pre_delete
+    ToolCategory.objects.filter(pk=instance.category_id).update(
+        model_count=F('model_count') - 1)
+
 @receiver(pre_delete, sender=Event)
 def pre_delete_event(sender, instance, **kwargs):
     """
-    If this event is the last recorded event for a tool, set the tool's
+    If the tool's current location comes from this event, set the tool's
     location to be at store
 
     """
-    if instance.tool.get_last_event() == instance:
-        instance.tool.loaned_to = None
-        instance.tool.location = 'Lager'
-        instance.tool.save()
+    tool = instance.tool
+    if tool.open_event_id == instance.pk:
+        tool.location = 'Lager'
+        tool.employee = None
+        tool.construction_site = None
+        tool.open_event = None
+        tool.save()
 
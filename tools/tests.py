@@ -5,7 +5,24 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import datetime
+import logging
+import sys
+
+from django.core import mail
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import override_settings
+
+from customers.models import Customer
+from toolcontrol.handlers import DBLogHandler
+from toolcontrol.notifications import Dispatcher, FakeSMSGateway
+from toolcontrol.querybudget import QueryBudgetMixin
+from tools import urls
+from tools.models import ConstructionSite, Container, CustomerDailyActivity
+from tools.models import CustomerToolStats
+from tools.models import Employee, Event, Notification, Ticket, Tool
+from tools.models import OPEN_EVENT_TYPES, ToolCategory, ToolModel
 
 
 class SimpleTest(TestCase):
@@ -14,3 +31,280 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+@override_settings(
+    SMS_GATEWAY='toolcontrol.notifications.FakeSMSGateway',
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class NotificationTest(TestCase):
+    def setUp(self):
+        FakeSMSGateway.outbox = []
+        FakeSMSGateway.failing = set()
+        self.customer = Customer.objects.create(name='Kunde', address='Vej 1',
+                                                zip_code=8000, town='Aarhus')
+        self.employee = Employee.objects.create(name='Medarbejder',
+                                                email='m@example.com',
+                                                phone_number=12345678,
+                                                customer=self.customer)
+
+    def test_send_message_only_queues(self):
+        self.employee.send_message('Emne', 'Besked')
+
+        self.assertEqual(Notification.objects.filter(status='Afventer').count(), 2)
+        self.assertEqual(FakeSMSGateway.outbox, [])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_dispatcher_sends_and_counts_sms(self):
+        self.employee.send_message('Emne', 'Besked')
+        self.employee.send_sms('Anden besked')
+
+        dispatcher = Dispatcher(workers=2)
+        try:
+            self.assertEqual(dispatcher.run(), 3)
+        finally:
+            dispatcher.close()
+
+        self.assertEqual(len(FakeSMSGateway.outbox), 2)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Notification.objects.filter(status='Sendt').count(), 3)
+        self.assertEqual(Customer.objects.get(pk=self.customer.pk).sms_sent, 2)
+
+    def test_failed_sms_is_retried_later(self):
+        FakeSMSGateway.failing.add('12345678')
+        self.employee.send_sms('Besked')
+
+        dispatcher = Dispatcher(workers=1)
+        try:
+            dispatcher.run()
+        finally:
+            dispatcher.close()
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, 'Afventer')
+        self.assertEqual(notification.attempts, 1)
+        self.assertTrue(notification.next_attempt > datetime.datetime.now())
+        self.assertEqual(Customer.objects.get(pk=self.customer.pk).sms_sent, 0)
+
+class DBLogHandlerTest(TestCase):
+    def setUp(self):
+        # The test flushes itself instead of the background thread
+        self.handler = DBLogHandler(flush_interval=3600, rate_limit=2)
+
+    def log_error(self):
+        try:
+            raise ValueError('Fejl')
+        except ValueError:
+            record = logging.LogRecord('tools', logging.ERROR, __file__, 1,
+                                       'Noget gik galt', (), sys.exc_info())
+        self.handler.emit(record)
+
+    def test_repeats_are_counted_on_one_ticket(self):
+        for n in range(5):
+            self.log_error()
+        self.assertEqual(len(self.handler.buffer), 2)
+        self.assertEqual(Ticket.objects.count(), 0)
+
+        self.handler.flush()
+        ticket = Ticket.objects.get()
+        self.assertEqual(ticket.occurrences, 5)
+        self.assertEqual(ticket.level, 'Fejl')
+
+        self.log_error()
+        self.handler.flush()
+        self.assertEqual(Ticket.objects.get().occurrences, 6)
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    # Queries per view with the tools made in setUp. More tools than
+    # QUERY_REPEAT_LIMIT, so a query per row fails the test as well
+    BUDGETS = {
+        'index': 10, 'login': 10, 'logout': 5, 'stats': 10, 'settings': 10,
+        'model_object': 5,
+        'container_list': 10, 'tool_list': 10, 'model_list': 10,
+        'category_list': 10, 'employee_list': 10, 'building_site_list': 10,
+        'event_list': 10, 'loan_list': 10, 'simple_tool_list': 10,
+        'container_banner': 5, 'tool_banner': 5, 'model_banner': 5,
+        'category_banner': 5, 'employee_banner': 5, 
+        'building_site_banner': 5,
+        'container_form': 10, 'tool_form': 10, 'model_form': 10, 
+        'category_form': 10, 'employee_form': 10, 'building_site_form': 10,
+        'construction_site_form': 10, 'add_many_tools_form': 10, 
+        'import_tools_form': 10,
+        'container_action': 30, 'tool_action': 30, 'model_action': 30,
+        'category_action': 30, 'employee_action': 30, 
+        'building_site_action': 30,
+        'loan_form': 10, 'reservation_form': 10, 'container_loan_form': 10,
+        'container_delete': 30, 'tool_delete': 30, 'model_delete': 30,
+        'category_delete': 30, 'employee_delete': 30, 
+        'building_site_delete': 30, 'event_delete': 15, 
+        'reservation_delete': 10,
+        'forgot_password': 10, 'reset_password': 10,
+        'qr_code': 5, 'qr_text': 5, 'qr_action': 15, 'labels': 10,
+        }
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Kunde', address='Vej 1',
+                                                zip_code=8000, town='Aarhus')
+        self.employee = Employee.objects.create_user('Admin', 'a@example.com',
+                                                     12345678, 'kode')
+        self.employee.customer = self.customer
+        self.employee.is_admin = True
+        self.employee.save()
+
+        category = ToolCategory.objects.create(name='Boremaskiner',
+                                               customer=self.customer)
+        self.model = ToolModel.objects.create(name='Bosch', category=category)
+        Tool.objects.create_range(Tool.objects.range_names('B', '01', 15),
+                                  self.model, price=100, 
+                                  buy_date=datetime.date.today())
+        self.tool = Tool.objects.order_by('pk')[0]
+        for tool in Tool.objects.all()[:12]:
+            tool.loan(employee=self.employee)
+
+        self.client.login(username='Admin', password='kode')
+
+    def test_budgets_cover_urls(self):
+        self.assertBudgetsCover(urls.urlpatterns)
+
+    def test_lists(self):
+        for url_name in ('tool_list', 'model_list', 'category_list',
+                         'container_list', 'employee_list', 
+                         'building_site_list'):
+            self.assertQueryBudget(url_name)
+        self.assertQueryBudget('simple_tool_list', {'model_id': self.model.pk})
+        self.assertQueryBudget('event_list', {'tool_id': self.tool.pk})
+        self.assertQueryBudget('loan_list', {'loaner_id': self.employee.pk,
+                                             'object_type': 'employee'})
+
+    def test_pages(self):
+        for url_name in ('index', 'stats', 'settings', 'tool_banner', 
+                         'model_banner', 'category_banner', 
+                         'container_banner', 'employee_banner', 
+                         'building_site_banner', 'tool_form', 'model_form',
+                         'add_many_tools_form', 'import_tools_form'):
+            self.assertQueryBudget(url_name)
+
+    def test_tool_actions(self):
+        ids = ','.join('%s' % pk for pk in 
+                       Tool.objects.order_by('pk').values_list('pk', flat=True))
+
+        self.assertQueryBudget('tool_action', {'action': 'end_loan', 
+                                               'object_ids': ids},
+                               method='post')
+        self.assertFalse(Tool.objects.exclude(location='Lager').exists())
+        self.assertFalse(Event.objects.filter(end_date__isnull=True,
+                                              event_type__in=OPEN_EVENT_TYPES
+                                              ).exists())
+
+        self.assertQueryBudget('tool_action', {'action': 'scrap',
+                                               'object_ids': ids},
+                               method='post')
+        self.assertEqual(Tool.objects.filter(location='Kasseret',
+                                             end_date__isnull=False,
+                                             open_event__isnull=False
+                                             ).count(), 15)
+
+        self.assertQueryBudget('tool_action', {'action': 'service',
+                                               'object_ids': ids},
+                               method='post')
+        self.assertFalse(Event.objects.filter(event_type='Service').exists())
+
+    def test_container_loan(self):
+        site = ConstructionSite.objects.create(name='Byggeplads',
+                                               customer=self.customer)
+        container = Container.objects.create(name='Container', is_active=True,
+                                             customer=self.customer)
+        Tool.objects.filter(location='Lager').update(container=container)
+
+        self.assertQueryBudget('container_loan_form',
+                               {'construction_site': site.pk,
+                                'containers': '%s' % container.pk},
+                               method='post')
+        self.assertEqual(Container.objects.get(pk=container.pk).location, site)
+        self.assertEqual(Tool.objects.filter(container=container,
+                                             location=u'Udl\xe5nt',
+                                             construction_site=site).count(), 3)
+
+    def test_bulk_transition_customers(self):
+        other = Customer.objects.create(name='Kunde 2', address='Vej 2',
+                                        zip_code=8000, town='Aarhus')
+        category = ToolCategory.objects.create(name='Save', customer=other)
+        model = ToolModel.objects.create(name='Makita', category=category)
+        Tool.objects.create_range(Tool.objects.range_names('S', '1', 2),
+                                  model, price=100, 
+                                  buy_date=datetime.date.today())
+        for customer in (self.customer, other):
+            CustomerToolStats.objects.rebuild(customer)
+
+        # One tool at store of each customer
+        ids = [Tool.objects.filter(model=self.model, location='Lager')[0].pk,
+               Tool.objects.filter(model=model)[0].pk]
+        Tool.objects.bulk_transition('scrap', ids, self.employee)
+
+        for customer in (self.customer, other):
+            stats = CustomerToolStats.objects.get(customer=customer)
+            self.assertEqual(stats.scrapped_count, 1)
+            self.assertEqual(stats.dead_count, 1)
+            self.assertEqual(
+                CustomerDailyActivity.objects.filter(customer=customer
+                    ).aggregate(Sum('events'))['events__sum'],
+                Event.objects.filter(tool__model__category__customer=customer
+                                     ).count())
+
+    def test_delete_employee_stats(self):
+        other = Employee.objects.create_user('Anden', 'b@example.com',
+                                             87654321, 'kode')
+        other.customer = self.customer
+        other.save()
+        CustomerToolStats.objects.rebuild(self.customer)
+
+        tools = list(Tool.objects.filter(location='Lager').order_by('pk'))
+        for tool in tools[:2]:
+            tool.loan(employee=other)
+        # A scrapped tool still pointing at the employee, so saving it at
+        # store while it is deleted changes what it contributes
+        tools[2].scrap(self.employee)
+        Tool.objects.filter(pk=tools[2].pk).update(employee=other)
+
+        other.delete()
+        self.assertEqual(Tool.objects.count(), 12)
+
+        stats = CustomerToolStats.objects.filter(customer=self.customer)
+        kept = stats.values()[0]
+        CustomerToolStats.objects.rebuild(self.customer)
+        self.assertEqual(kept, stats.values()[0])
+
+    def test_delete(self):
+        tool = Tool.objects.order_by('-pk')[0]
+        self.assertQueryBudget('tool_delete', {'id': tool.pk}, method='post')
+        self.assertEqual(ToolModel.objects.get(pk=self.model.pk).tool_count,
+                         14)
+
+        response = self.assertQueryBudget(
+            'category_delete', {'id': self.model.category_id, 
+                                'preview': 1}, method='post')
+        self.assertIn('14 v', response.content.decode('utf-8'))
+        self.assertEqual(Tool.objects.count(), 14)
+
+        self.assertQueryBudget('category_delete', 
+                               {'id': self.model.category_id}, method='post')
+        self.assertFalse(Tool.objects.exists())
+        self.assertFalse(Event.objects.exists())
+        self.assertFalse(ToolModel.objects.exists())
+
+    def test_qr(self):
+        self.assertQueryBudget('qr_code', args=[self.tool.pk])
+        self.assertQueryBudget('qr_text', args=[self.tool.pk])
+
+    def test_add_many_tools_range_limit(self):
+        response = self.assertQueryBudget(
+            'add_many_tools_form', {'prefix': 'C', 'start_index': '0',
+                                    'end_index': '999999999',
+                                    'model': self.model.pk,
+                                    'buy_date': '2013-01-01'},
+            method='post')
+        self.assertIn('failure', response.content)
+        self.assertEqual(Tool.objects.count(), 15)
+
+    def test_labels_range_limit(self):
+        self.assertQueryBudget('labels', {'prefix': 'B', 'start_index': '0',
+                                          'end_index': '999999999'},
+                               status_code=404)
@@ -75,6 +75,7 @@ urlpatterns = patterns('tools.views',
         {'class_name': ConstructionSite, 'form_name': BuildingSiteForm}, 
         name='building_site_form'),
     url(r'^add_many_tools_form/$', 'create_many_tools_form', name='add_many_tools_form'),
+    url(r'^import_tools_form/$', 'import_tools_form', name='import_tools_form'),
 
     # AJAX requests for inline forms
     url(r'^container_inline_form/$', 'inline_form', 
@@ -115,7 +116,8 @@ urlpatterns = patterns('tools.views',
     url(r'^reservation_form/$', 'action_form', {'form_name': ReservationForm, 'object_type': 'reservation'},
         name='reservation_form'),
     url(r'^container_loan_form/$', 'action_form', 
-        {'form_name': ContainerLoanForm, 'object_type': 'container_loan'}, 
+        {'form_name': ContainerLoanForm, 'object_type': 'container_loan',
+         'with_user': True},
         name='container_loan_form'),
 
     # AJAX requests for deletes
@@ -143,4 +145,5 @@ urlpatterns = patterns('tools.views',
     url(r'^tools/(?P<pk>\d+)/qr$', 'qr_code', name='qr_code'),
     url(r'^tools/(?P<pk>\d+)/qr_text$', 'qr_text', name='qr_text'),
     url(r'^tools/(?P<pk>\d+)/qr_action$', 'qr_action', name='qr_action'),
+    url(r'^labels/$', 'labels', name='labels'),
 )
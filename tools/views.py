@@ -1,7 +1,7 @@
 # -*- coding:utf-8 -*-
 from __future__ import unicode_literals
 
-import datetime, logging, qrcode
+import datetime, logging, re
 logger = logging.getLogger(__name__)
 
 from django.contrib.auth import login, logout, get_user_model
@@ -9,8 +9,10 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
 from django.core import serializers
 from django.core.urlresolvers import reverse
-from django.db.models import Avg, Sum, Q
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.db import connection, transaction
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.template import RequestContext
 from django.template.loader import render_to_string
@@ -20,12 +22,16 @@ from django.views.generic.edit import FormView
 
 from tools.forms import BuildingSiteForm, ContainerForm, ContainerLoanForm
 from tools.forms import CreateManyToolsForm, EmployeeForm, ForgotPasswordForm
+from tools.forms import ImportToolsForm
 from tools.forms import LoanForm, QRLoanForm, ReservationForm, SettingsForm
 from tools.forms import ToolForm, ToolCategoryForm, ToolModelForm
 
-from tools.models import ConstructionSite, Container, Event, Employee, Tool
+from tools.models import ConstructionSite, Container, CustomerToolStats
+from tools.models import Event, Employee, Tool
 from tools.models import ForgotPasswordToken, Reservation, ToolCategory
-from tools.models import Login, ToolModel
+from tools.models import Login, ToolModel, TOOL_TRANSITIONS, event_history
+from tools.deletion import TABLES as DELETED_TABLES, CascadeDeleter
+from tools.labels import labels_sheet, labels_zip, tool_qr
 
 from toolcontrol.enums import verbose_action, MESSAGES
 from toolcontrol.utils import handle_loan_messages, make_message
@@ -102,51 +108,21 @@ def stats(request):
     if not request.user.customer:
         return HttpResponseRedirect(reverse('admin_index'))
 
-    lost_tool_count = Tool.objects.filter(location='Bortkommet',
-                                          model__category__customer=request.user.customer).count()
-    scrapped_tool_count = Tool.objects.filter(location='Kasseret',
-                                          model__category__customer=request.user.customer).count()
-    
-    try:
-        lost_tools_ratio = (lost_tool_count / 
-                            (float(scrapped_tool_count + 
-                                   lost_tool_count)) * 100)
-        scrapped_tools_ratio = (scrapped_tool_count / 
-                                (float(scrapped_tool_count + 
-                                       lost_tool_count)) * 100)
-    except ZeroDivisionError:
-        scrapped_tools_ratio = 0
-        lost_tools_ratio = 0
-
-    alive_tools = Tool.objects.filter(end_date__isnull=True,
-                                      model__category__customer=request.user.customer)
-    timedeltas = [datetime.date.today() - tool.buy_date for tool in alive_tools]
-    try:
-        average_age = (sum(timedeltas, datetime.timedelta(0)) / alive_tools.count()).days
-    except ZeroDivisionError:
-        average_age = 0
-
-    dead_tools = Tool.objects.filter(end_date__isnull=False,
-                                     model__category__customer=request.user.customer)
-    timedeltas = [tool.end_date - tool.buy_date for tool in dead_tools]
-    try:
-        average_life = (sum(timedeltas, datetime.timedelta(0)) / dead_tools.count()).days
-    except ZeroDivisionError:
-        average_life = 0
+    stats = CustomerToolStats.objects.for_customer(request.user.customer)
 
     context_dictionary = {
-        'tool_count': Tool.objects.filter(model__category__customer=request.user.customer).count(),
-        'model_count': ToolModel.objects.filter(category__customer=request.user.customer).count(),
-        'category_count': ToolCategory.objects.filter(customer=request.user.customer).count(),
-        'sum_price_tools': Tool.objects.filter(model__category__customer=request.user.customer).aggregate(Sum('price')),
-        'avg_price_tools': Tool.objects.filter(model__category__customer=request.user.customer).aggregate(Avg('price')),
-        'avg_price_models': ToolModel.objects.filter(category__customer=request.user.customer).aggregate(Avg('price')),
-        'lost_tool_count': lost_tool_count,
-        'scrapped_tool_count': scrapped_tool_count,
-        'scrapped_tools_ratio': scrapped_tools_ratio,
-        'lost_tools_ratio': lost_tools_ratio,
-        'average_age': average_age,
-        'average_life': average_life,
+        'tool_count': stats.tool_count,
+        'model_count': stats.model_count,
+        'category_count': stats.category_count,
+        'sum_price_tools': stats.tool_price_sum,
+        'avg_price_tools': stats.average_tool_price(),
+        'avg_price_models': stats.average_model_price(),
+        'lost_tool_count': stats.lost_count,
+        'scrapped_tool_count': stats.scrapped_count,
+        'scrapped_tools_ratio': stats.scrapped_ratio(),
+        'lost_tools_ratio': stats.lost_ratio(),
+        'average_age': stats.average_age(),
+        'average_life': stats.average_life(),
         }
 
     return render(request, 'stats.html', context_dictionary)
@@ -174,32 +150,23 @@ class IndexView(FormView):
     def get_form(self, form_class):
         return form_class(customer=self.request.user.customer,**self.get_form_kwargs())
 
-class ContainerListView(ListView):
-    template_name = 'container_list.html'
-
-    def get(self, request, *args, **kwargs):
-        if not request.user.customer:
-            return HttpResponseRedirect(reverse('admin_index'))
-        else:
-            return super(ListView, 
-                         self).get(request, *args, **kwargs)
+# Number of rows rendered per request by the list views. The client fetches
+# the following rows with the cursor in next_cursor
+PAGE_SIZE = 50
 
-    def get_queryset(self):
-        search = self.request.GET.get('search', '')
-        ordering = self.request.GET.get('ordering', 'name')
+class KeysetListView(ListView):
+    """
+    List view paginated on the user selected ordering with the primary key
+    as tiebreak. The next page is the rows following the row with primary
+    key ?after=, so every page costs the same however far down the list it
+    is. Only the columns in fields are fetched, joined with the relations
+    in related
 
-        return Container.objects.filter(Q(name__icontains=search) |
-                                        Q(location__name__icontains=search),
-                                        customer=self.request.user.customer).select_related('location').order_by(ordering)
-
-    def get_context_data(self, **kwargs):
-        context = super(ContainerListView, self).get_context_data(**kwargs)
-        context['search'] = self.request.GET.get('search')
-        context['ordering'] = self.request.GET.get('ordering')
-        return context
-
-class ToolListView(ListView):
-    template_name = 'tool_list.html'
+    """
+    orderings = ('name',)
+    default_ordering = 'name'
+    fields = None
+    related = ()
 
     def get(self, request, *args, **kwargs):
         if not request.user.customer:
@@ -207,175 +174,238 @@ class ToolListView(ListView):
         else:
             return super(ListView, self).get(request, *args, **kwargs)
 
-    def get_queryset(self):
-        search = self.request.GET.get('search', '')
-        ordering = self.request.GET.get('ordering', 'name')
-
-        return Tool.objects.filter(Q(name__icontains=search) |
-                                   Q(model__name__icontains=search) |
-                                   Q(model__category__name__icontains=search) |
-                                   Q(employee__name__icontains=search) | 
-                                   Q(construction_site__name__icontains=search) | 
-                                   Q(location__iexact=search) |
-                                   Q(secondary_name__icontains=search) |
-                                   Q(invoice_number__icontains=search),
-                                   model__category__customer=self.request.user.customer).select_related('loaned_to').order_by(ordering)
+    def get_ordering(self):
+        ordering = self.request.GET.get('ordering') or self.default_ordering
+        if ordering.lstrip('-') not in self.orderings:
+            return self.default_ordering
+        return ordering
 
-    def get_context_data(self, **kwargs):
-        context = super(ToolListView, self).get_context_data(**kwargs)
-        context['search'] = self.request.GET.get('search')
-        context['ordering'] = self.request.GET.get('ordering')
-        return context
-
-class ModelListView(ListView):
-    template_name = 'model_list.html'
-
-    def get(self, request, *args, **kwargs):
-        if not request.user.customer:
-            return HttpResponseRedirect(reverse('admin_index'))
-        else:
-            return super(ListView, self).get(request, *args, **kwargs)
+    def get_base_queryset(self, search):
+        raise NotImplementedError
 
     def get_queryset(self):
         search = self.request.GET.get('search', '')
-        ordering = self.request.GET.get('ordering', 'name')
+        ordering = self.get_ordering()
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+
+        queryset = self.get_base_queryset(search)
+        if self.related:
+            queryset = queryset.select_related(*self.related)
+        if self.fields:
+            queryset = queryset.only(*self.fields)
+        queryset = queryset.order_by(ordering, descending and '-pk' or 'pk')
+
+        after = self.request.GET.get('after')
+        if not after:
+            return queryset
+
+        try:
+            after = int(after)
+        except ValueError:
+            raise Http404
+
+        value = queryset.model._default_manager.filter(
+            pk=after).values_list(field, flat=True)
+        if not value:
+            return queryset.none()
+
+        return queryset.filter(self.get_after_filter(field, descending,
+                                                     value[0], after))
+
+    def get_after_filter(self, field, descending, value, pk):
+        # Rows with no value sort after all others when the database orders
+        # NULL as the largest value and the ordering is ascending, or NULL
+        # is the smallest value and the ordering is descending
+        lookup = descending and 'lt' or 'gt'
+        nulls_after = connection.features.nulls_order_largest != descending
+
+        if value is None:
+            after = Q(**{'%s__isnull' % field: True, 'pk__%s' % lookup: pk})
+            if not nulls_after:
+                after |= Q(**{'%s__isnull' % field: False})
+        else:
+            after = (Q(**{'%s__%s' % (field, lookup): value}) |
+                     Q(**{field: value, 'pk__%s' % lookup: pk}))
+            if nulls_after:
+                after |= Q(**{'%s__isnull' % field: True})
 
-        return ToolModel.objects.filter(Q(name__icontains=search) |
-                                        Q(category__name__icontains=search),
-                                        category__customer=self.request.user.customer).order_by(ordering)
+        return after
 
     def get_context_data(self, **kwargs):
-        context = super(ModelListView, self).get_context_data(**kwargs)
+        object_list = list(kwargs.pop('object_list')[:PAGE_SIZE + 1])
+        next_cursor = None
+        if len(object_list) > PAGE_SIZE:
+            object_list = object_list[:PAGE_SIZE]
+            next_cursor = object_list[-1].pk
+
+        context = super(KeysetListView, self).get_context_data(
+            object_list=object_list, **kwargs)
         context['search'] = self.request.GET.get('search')
-        context['ordering'] = self.request.GET.get('ordering')
+        context['ordering'] = self.get_ordering()
+        context['next_cursor'] = next_cursor
         return context
 
-class CategoryListView(ListView):
-    template_name = 'category_list.html'
-
-    def get(self, request, *args, **kwargs):
-        if not request.user.customer:
-            return HttpResponseRedirect(reverse('admin_index'))
-        else:
-            return super(ListView, self).get(request, *args, **kwargs)
+class ContainerListView(KeysetListView):
+    template_name = 'container_list.html'
+    orderings = ('name', 'location__name', 'is_active')
+    fields = ('name', 'location', 'location__name', 'is_active')
+    related = ('location',)
 
-    def get_queryset(self):
-        search = self.request.GET.get('search', '')
-        ordering = self.request.GET.get('ordering', 'name')
+    def get_base_queryset(self, search):
+        return Container.objects.filter(Q(name__icontains=search) |
+                                        Q(location__name__icontains=search),
+                                        customer=self.request.user.customer)
 
-        return ToolCategory.objects.filter(customer=self.request.user.customer,
-                                           name__icontains=search).order_by(ordering)
+class ToolListView(KeysetListView):
+    template_name = 'tool_list.html'
+    orderings = ('name', 'model__name', 'model__category__name',
+                 'container__name', 'last_service', 'next_service_due',
+                 'buy_date', 'end_date', 'price')
+    fields = ('name', 'model', 'model__name', 'model__category',
+              'model__category__name', 'container', 'container__name',
+              'last_service', 'next_service_due', 'buy_date', 'end_date',
+              'location', 'employee', 'employee__name', 'construction_site',
+              'construction_site__name', 'price')
+    related = ('model__category', 'container', 'employee',
+               'construction_site')
+
+    def get_base_queryset(self, search):
+        return Tool.objects.search(self.request.user.customer, search)
+
+class ModelListView(KeysetListView):
+    template_name = 'model_list.html'
+    orderings = ('name', 'category__name', 'service_interval', 'price')
+    fields = ('name', 'category', 'category__name', 'service_interval',
+              'price')
+    related = ('category',)
+
+    def get_base_queryset(self, search):
+        customer = self.request.user.customer
+        tool_models = ToolModel.objects.with_rollups(customer.use_tool_counters)
+        return tool_models.filter(Q(name__icontains=search) |
+                                  Q(category__name__icontains=search),
+                                  category__customer=customer)
+
+class CategoryListView(KeysetListView):
+    template_name = 'category_list.html'
+    fields = ('name',)
 
-    def get_context_data(self, **kwargs):
-        context = super(CategoryListView, self).get_context_data(**kwargs)
-        context['search'] = self.request.GET.get('search')
-        context['ordering'] = self.request.GET.get('ordering')
-        return context
+    def get_base_queryset(self, search):
+        customer = self.request.user.customer
+        categories = ToolCategory.objects.with_rollups(customer.use_tool_counters)
+        return categories.filter(customer=customer, name__icontains=search)
 
-class EmployeeListView(ListView):
+class EmployeeListView(KeysetListView):
     template_name = 'employee_list.html'
+    orderings = ('name', 'email', 'phone_number', 'is_active', 'is_admin',
+                 'is_loan_flagged')
+    fields = ('name', 'email', 'phone_number', 'is_active', 'is_admin',
+              'is_loan_flagged')
 
-    def get(self, request, *args, **kwargs):
-        if not request.user.customer:
-            return HttpResponseRedirect(reverse('admin_index'))
-        else:
-            return super(ListView, self).get(request, *args, **kwargs)
-
-    def get_queryset(self):
-        search = self.request.GET.get('search', '')
-        ordering = self.request.GET.get('ordering', 'name')
-
-        if search == 'aktiv' or search == 'inaktive':
+    def get_base_queryset(self, search):
+        if search == 'aktiv' or search == 'aktive':
             return Employee.objects.filter(customer=self.request.user.customer,
-                                           is_active=True).order_by(sorting)
+                                           is_active=True)
         elif search == 'inaktiv' or search == 'inaktive':
             return Employee.objects.filter(customer=self.request.user.customer,
-                                           is_active=False).order_by(sorting)
+                                           is_active=False)
         else:
             return Employee.objects.filter(Q(name__icontains=search) |
                                            Q(phone_number__icontains=search) |
                                            Q(email__icontains=search),
-                                           customer=self.request.user.customer).order_by(ordering)
-
-    def get_context_data(self, **kwargs):
-        context = super(EmployeeListView, self).get_context_data(**kwargs)
-        context['search'] = self.request.GET.get('search')
-        context['ordering'] = self.request.GET.get('ordering')
-        return context
+                                           customer=self.request.user.customer)
 
-class ConstructionSiteListView(ListView):
+class ConstructionSiteListView(KeysetListView):
     template_name = 'building_site_list.html'
+    orderings = ('name', 'is_active')
+    fields = ('name', 'is_active')
 
-    def get(self, request, *args, **kwargs):
-        if not request.user.customer:
-            return HttpResponseRedirect(reverse('admin_index'))
-        else:
-            return super(ListView, self).get(request, *args, **kwargs)
-
-    def get_queryset(self):
-        search = self.request.GET.get('search', '')
-        ordering = self.request.GET.get('ordering', 'name')
-
+    def get_base_queryset(self, search):
         if search == 'aktiv' or search == 'aktive':
             return ConstructionSite.objects.filter(customer=self.request.user.customer,
-                                                   is_active=True).order_by(sorting)
+                                                   is_active=True)
         elif search == 'inaktiv' or search == 'inaktive':
             return ConstructionSite.objects.filter(customer=self.request.user.customer,
-                                                   is_active=False).order_by(sorting)
+                                                   is_active=False)
         else:
             return ConstructionSite.objects.filter(customer=self.request.user.customer,
-                                                   name__icontains=search).order_by(ordering)
+                                                   name__icontains=search)
 
-    def get_context_data(self, **kwargs):
-        context = super(ConstructionSiteListView, self).get_context_data(**kwargs)
-        context['search'] = self.request.GET.get('search')
-        context['ordering'] = self.request.GET.get('ordering')
-        return context
+class HistoryListView(ListView):
+    """
+    Pages through events from the event table and the archive, newest
+    first. ?after= takes the cursor of the last row already shown
+
+    """
+    related = ()
 
-class EventListView(ListView):
-    template_name = 'event_list.html'
-    
     def get(self, request, *args, **kwargs):
         if not request.user.customer:
             return HttpResponseRedirect(reverse('admin_index'))
         else:
             return super(ListView, self).get(request, *args, **kwargs)
 
+    def get_history_filters(self):
+        raise NotImplementedError
+
     def get_queryset(self):
-        tool_id = self.request.GET.get('tool_id')
-        tool = get_object_or_404(Tool, id = tool_id)
+        after = self.request.GET.get('after')
+        if after and not re.match(r'^[ae]\d+$', after):
+            raise Http404
 
-        return tool.event_set.all().order_by('start_date')
+        filters = self.get_history_filters()
+        if filters is None:
+            return []
+
+        events, self.next_cursor = event_history(PAGE_SIZE, after, 
+                                                 related=self.related,
+                                                 **filters)
+        return events
 
     def get_context_data(self, **kwargs):
-        context = super(EventListView, self).get_context_data(**kwargs)
+        context = super(HistoryListView, self).get_context_data(**kwargs)
+        context['next_url'] = None
+        if getattr(self, 'next_cursor', None):
+            params = self.request.GET.copy()
+            params['after'] = self.next_cursor
+            context['next_url'] = '%s?%s' % (self.request.path, 
+                                             params.urlencode())
+        return context
+
+class EventListView(HistoryListView):
+    template_name = 'event_list.html'
+    related = ('employee', 'construction_site')
 
+    def get_history_filters(self):
         tool_id = self.request.GET.get('tool_id')
-        tool = get_object_or_404(Tool, id = tool_id)
+        self.tool = get_object_or_404(Tool, id = tool_id)
 
-        context['reservations'] = tool.reservation_set.filter(end_date__gte=datetime.datetime.now())
+        return {'tool': self.tool}
+
+    def get_context_data(self, **kwargs):
+        context = super(EventListView, self).get_context_data(**kwargs)
+
+        # Reservations are only shown above the first page
+        if not self.request.GET.get('after'):
+            context['reservations'] = self.tool.reservation_set.filter(end_date__gte=datetime.datetime.now())
 
         return context
 
-class LoanListView(ListView):
+class LoanListView(HistoryListView):
     template_name = 'loan_list.html'
+    related = ('tool',)
 
-    def get(self, request, *args, **kwargs):
-        if not request.user.customer:
-            return HttpResponseRedirect(reverse('admin_index'))
-        else:
-            return super(ListView, self).get(request, *args, **kwargs)
-
-    def get_queryset(self):
+    def get_history_filters(self):
         loaner_id = self.request.GET.get('loaner_id')
         object_type = self.request.GET.get('object_type')
     
         if object_type == 'employee':
             employee = get_object_or_404(Employee, id = loaner_id)
-            return Event.objects.filter(employee=employee).order_by('-start_date')
+            return {'employee': employee}
         elif object_type == 'building_site':
             construction_site = get_object_or_404(ConstructionSite, id = loaner_id)
-            return Event.objects.filter(construction_site=construction_site).order_by('-start_date')
+            return {'construction_site': construction_site}
 
 class SimpleToolListView(ListView):
     template_name = 'simple_tool_list.html'
@@ -546,14 +576,17 @@ def form(request, class_name, form_name):
     return render(request, 'form.html', context)
 
 @login_required
-def action_form(request, form_name, object_type):
+def action_form(request, form_name, object_type, with_user=False):
     if not request.user.customer:
         return HttpResponseRedirect(reverse('admin_index'))
 
+    form_kwargs = {'customer': request.user.customer}
+    if with_user:
+        form_kwargs['user'] = request.user
+
     if request.POST:
         logger.info('%s is using a form action (%s)' % (request.user, object_type))
-        form = form_name(data=request.POST,
-                         customer=request.user.customer)
+        form = form_name(data=request.POST, **form_kwargs)
         if form.is_valid():
             obj_dict = form.save()
             response = {'status': 'success',
@@ -569,7 +602,7 @@ def action_form(request, form_name, object_type):
         return HttpResponse(simplejson.dumps(response), 
                             mimetype="application/json")
 
-    form = form_name(customer=request.user.customer)
+    form = form_name(**form_kwargs)
     context = {'form': form, 'object_type': object_type}
     return render(request, 'form.html', context)
 
@@ -590,37 +623,46 @@ def action(request, class_name):
         return HttpResponse(simplejson.dumps(response),
                             content_type='application/json')
 
-    obj_dict = {}
-
-    for object_id in object_ids:
-        obj = get_object_or_404(class_name, pk = object_id)
-        obj_name = obj.name
-
-        if action == 'loan_single':
-            response = obj.loan(request.user)
-            try:
-                obj_dict[response].append(obj_name)
-            except KeyError:
-                obj_dict[response] = [obj_name]
-        elif action == 'delete':
-            if request.user.is_admin:
-                obj.delete()
-                try:
-                    obj_dict[MESSAGES.OBJECT_DELETE_SUCCESS].append(obj_name)
-                except KeyError:
-                    obj_dict[MESSAGES.OBJECT_DELETE_SUCCESS] = [obj_name]
-            else:
-                try:
-                    obj_dict[MESSAGES.OBJECT_DELETE_RIGHTS].append(obj_name)
-                except KeyError:
-                    obj_dict[MESSAGES.OBJECT_DELETE_RIGHTS] = [obj_name]
-        else:
-            action_function = getattr(obj, action)
-            response = action_function(request.user)
-            try:
-                obj_dict[response].append(obj_name)
-            except KeyError:
-                obj_dict[response] = [obj_name]
+    if not all(object_id.isdigit() for object_id in object_ids):
+        raise Http404
+    object_ids = [int(object_id) for object_id in object_ids]
+    if (class_name.objects.filter(pk__in=object_ids).count() != 
+        len(set(object_ids))):
+        raise Http404
+
+    if class_name == Tool and action == 'loan_single':
+        obj_dict = Tool.objects.bulk_loan(object_ids, request.user)
+    elif class_name == Tool and action in TOOL_TRANSITIONS:
+        obj_dict = Tool.objects.bulk_transition(action, object_ids, 
+                                                request.user)
+    elif (action == 'delete' and request.user.is_admin and 
+          class_name in (ToolCategory, ToolModel, Tool)):
+        names = class_name.objects.in_bulk(object_ids)
+        CascadeDeleter(class_name, object_ids).delete()
+        obj_dict = {MESSAGES.OBJECT_DELETE_SUCCESS: [
+                names[object_id].name for object_id in object_ids]}
+    else:
+        obj_dict = {}
+        objects = class_name.objects.in_bulk(object_ids)
+
+        with transaction.commit_on_success():
+            for object_id in object_ids:
+                obj = objects[object_id]
+                obj_name = obj.name
+
+                if action == 'loan_single':
+                    response = obj.loan(request.user)
+                elif action == 'delete':
+                    if request.user.is_admin:
+                        obj.delete()
+                        response = MESSAGES.OBJECT_DELETE_SUCCESS
+                    else:
+                        response = MESSAGES.OBJECT_DELETE_RIGHTS
+                else:
+                    action_function = getattr(obj, action)
+                    response = action_function(request.user)
+
+                obj_dict.setdefault(response, []).append(obj_name)
 
     response = {'response': make_message(obj_dict)}
 
@@ -629,6 +671,24 @@ def action(request, class_name):
     return HttpResponse(simplejson.dumps(response), 
                         content_type="application/json")
 
+def deletion_message(model, name, counts):
+    """
+    Returns the question asked before deleting name, listing the other
+    rows deleted with it
+
+    """
+    own_table = dict(DELETED_TABLES)[model]
+    rows = []
+    for table, count in counts:
+        if table == own_table:
+            count -= 1
+        if count:
+            rows.append('%s %s' % (count, table))
+    message = 'Er du sikker på, at du vil slette %s?' % name
+    if rows:
+        message += ' Det sletter også %s.' % pretty_concatenate(rows)
+    return message
+
 @login_required
 def delete(request, class_to_delete):
     if not request.user.customer:
@@ -649,7 +709,18 @@ def delete(request, class_to_delete):
         raise Http404
     
     name = object_to_delete.name
-    object_to_delete.delete()
+
+    if class_to_delete in (ToolCategory, ToolModel, Tool):
+        deleter = CascadeDeleter(class_to_delete, [object_to_delete.pk])
+        # Ask what else goes with the object before it is deleted
+        if request.POST.get('preview'):
+            response = {'response': deletion_message(
+                    class_to_delete, name, deleter.preview())}
+            return HttpResponse(simplejson.dumps(response), 
+                                mimetype="application/json")
+        deleter.delete()
+    else:
+        object_to_delete.delete()
     logger.warning('%s with id %s deleted' % (class_to_delete.__name__, object_id))
 
     response = {'response': name + ' slettet'}
@@ -783,11 +854,71 @@ def qr_code(request, pk):
     if not request.user.customer:
         return HttpResponseRedirect(reverse('admin_index'))
 
-    img = qrcode.make('http://toolcontrol.dk/tools/%s/qr_action' % pk)
-    response = HttpResponse(mimetype='image/png')
-    img.save(response, 'PNG')
+    # The code only depends on pk, so it can be cached for good
+    key, png = tool_qr(pk)
+    etag = '"%s"' % key
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(png, mimetype='image/png')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
     return response
 
+# Most labels rendered in one request
+LABEL_LIMIT = 5000
+
+@login_required
+def labels(request):
+    """
+    Renders labels with QR code and name for the tools in ?ids= or for the
+    tools named ?prefix= followed by ?start_index= to ?end_index=, like
+    the names made by CreateManyToolsForm. ?format=zip gives a ZIP of
+    PNGs instead of a printable page
+
+    """
+    if not request.user.customer:
+        return HttpResponseRedirect(reverse('admin_index'))
+
+    tools = Tool.objects.filter(
+        model__category__customer=request.user.customer).only('name')
+
+    if request.GET.get('ids'):
+        try:
+            ids = [int(pk) for pk in request.GET['ids'].split(',')]
+        except ValueError:
+            raise Http404
+        tools = list(tools.filter(pk__in=ids).order_by('name'))
+    elif request.GET.get('start_index') and request.GET.get('end_index'):
+        prefix = request.GET.get('prefix', '')
+        try:
+            start_index = int(request.GET['start_index'])
+            end_index = int(request.GET['end_index'])
+        except ValueError:
+            raise Http404
+        # Check the size of the range before its names are made
+        if end_index - start_index + 1 > LABEL_LIMIT:
+            raise Http404
+        names = set(Tool.objects.range_names(
+                prefix, request.GET['start_index'], end_index))
+        tools = [tool for tool in tools.filter(
+                name__startswith=prefix).order_by('name') 
+                 if tool.name in names]
+    else:
+        raise Http404
+
+    if len(tools) > LABEL_LIMIT:
+        raise Http404
+
+    logger.info('%s is printing %s labels' % (request.user, len(tools)))
+    if request.GET.get('format') == 'zip':
+        response = HttpResponse(labels_zip(tools), 
+                                mimetype='application/zip')
+        response['Content-Disposition'] = 'attachment; filename=etiketter.zip'
+        return response
+
+    return render(request, 'qr/labels.html', {'labels': labels_sheet(tools)})
+
 def qr_text(request, pk):
     if not request.user.customer:
         return HttpResponseRedirect(reverse('admin_index'))
@@ -919,10 +1050,10 @@ def create_many_tools_form(request):
         form = CreateManyToolsForm(data=request.POST, 
                                    customer=request.user.customer)
         if form.is_valid():
+            count = form.save()
             logger.info('Many tools created succesfully')
-            form.save()
             response = {'status': 'success',
-                        'response': 'Værktøj oprettet'}
+                        'response': '%s værktøj oprettet' % count}
         else:
             logger.info('Many tools not created')
             context = {'form': form,
@@ -936,3 +1067,34 @@ def create_many_tools_form(request):
     context_dictionary = {'form': CreateManyToolsForm(request.user.customer),
                           'object_type': 'add_many_tools'}
     return render(request, 'form.html', context_dictionary)
+
+@login_required
+def import_tools_form(request):
+    if not request.user.customer:
+        return HttpResponseRedirect(reverse('admin_index'))
+
+    if request.POST:
+        logger.info('%s is importing tools' % request.user)
+        form = ImportToolsForm(request.user.customer, data=request.POST, 
+                               files=request.FILES)
+        result = None
+        if form.is_valid():
+            result = form.save()
+            if result.written:
+                logger.info('%s tools imported' % result.written)
+                response = {'status': 'success',
+                            'response': '%s værktøj importeret' % 
+                            result.written}
+                return HttpResponse(simplejson.dumps(response), 
+                                    mimetype='application/json')
+
+        context = {'form': form, 'result': result}
+        response = {'status': 'failure',
+                    'response': render_to_string('import_form.html', 
+                                                 RequestContext(request, 
+                                                                context))}
+        return HttpResponse(simplejson.dumps(response), 
+                            mimetype='application/json')
+
+    context_dictionary = {'form': ImportToolsForm(request.user.customer)}
+    return render(request, 'import_form.html', context_dictionary)